@@ -32,11 +32,10 @@
 
 
 import sys
-import commands
 import os
 
 # get path of the toolbox to be able to import sct_utils
-status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+path_sct = os.environ.get('SCT_DIR', '')
 sys.path.append(path_sct+'/scripts')
 import sct_utils as sct
 
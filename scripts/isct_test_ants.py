@@ -165,5 +165,5 @@ def usage():
 #=======================================================================================================================
 if __name__ == "__main__":
     # call main function
-    main()
+    sct.profile(main)
 
@@ -43,6 +43,7 @@
 import sys
 import getopt
 import os
+import sct_utils as sct
 try:
     import nibabel
 except ImportError, e:
@@ -216,4 +217,4 @@ def exist_image(fname):
 # START PROGRAM
 # ==========================================================================================
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sct.profile(main)
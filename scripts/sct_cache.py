@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Cache of registration results. Results (e.g., warping fields) are stored in a folder named after a key computed from
+# the content of the input files, the parameters and the version of the tools (toolbox, ANTs...). When a registration
+# is run again with the same inputs and parameters, the results are copied from the cache instead of being estimated.
+# The cache is size-bounded: least recently used results are removed first.
+#
+# The cache is disabled by default. To enable it, define the environment variable SCT_CACHE_DIR (absolute path of the
+# folder of the cache).
+# The maximum size of the cache (in MB) can be set with SCT_CACHE_SIZE (default: 5000).
+#
+# USAGE
+# ---------------------------------------------------------------------------------------
+#   import sct_cache
+#   key = sct_cache.get_key([fname_src, fname_dest], ['iterations=50x30'], ['antsRegistration'])
+#   if not sct_cache.get(key, ['tmp.reg0Warp.nii.gz']):
+#       (estimate tmp.reg0Warp.nii.gz)
+#       sct_cache.put(key, ['tmp.reg0Warp.nii.gz'])
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+import os
+import shutil
+import hashlib
+import commands
+
+# default maximum size of the cache (in MB)
+size_max_default = 5000
+# option printing the version of external tools (tools not listed are identified by their binary, see get_version_tool)
+tools_version_option = {'antsRegistration': '--version', 'c3d': '-version'}
+# versions of the external tools, computed once per process
+tools_version = {}
+
+
+#=======================================================================================================================
+# get_path_cache
+#=======================================================================================================================
+# Return the folder of the cache, or '' if the cache is disabled.
+def get_path_cache():
+    return os.path.expanduser(os.environ.get('SCT_CACHE_DIR', ''))
+
+
+#=======================================================================================================================
+# get_key
+#=======================================================================================================================
+# Return the key of a result from the content of the input files, the parameters (list of strings) and the name of the
+# external tools used (their version is included). Return None if the cache is disabled.
+def get_key(fname_list, param_list, tool_list):
+    if get_path_cache() == '':
+        return None
+    h = hashlib.sha1()
+    for fname in fname_list:
+        if fname == '':
+            h.update('none')
+        else:
+            h.update(hash_file(fname))
+    for param in param_list:
+        h.update(str(param))
+    h.update(get_version_sct())
+    for tool in tool_list:
+        h.update(get_version_tool(tool))
+    return h.hexdigest()
+
+
+#=======================================================================================================================
+# get
+#=======================================================================================================================
+# Copy the cached result of key into fname_list (files are matched by their name). Return True if the result was in
+# the cache, False otherwise.
+def get(key, fname_list):
+    if key is None:
+        return False
+    path_entry = os.path.join(get_path_cache(), key)
+    for fname in fname_list:
+        if not os.path.isfile(os.path.join(path_entry, os.path.basename(fname))):
+            return False
+    # the entry can be evicted by a concurrent run in the meantime: it is then a cache miss
+    try:
+        for fname in fname_list:
+            shutil.copyfile(os.path.join(path_entry, os.path.basename(fname)), fname)
+        # update time of last access (for LRU eviction)
+        os.utime(path_entry, None)
+    except (IOError, OSError):
+        return False
+    print '\nResult found in cache: '+path_entry
+    return True
+
+
+#=======================================================================================================================
+# put
+#=======================================================================================================================
+# Store files (fname_list) as the result of key, and remove least recently used results if the cache is too big.
+def put(key, fname_list):
+    if key is None:
+        return
+    path_cache = get_path_cache()
+    path_entry = os.path.join(path_cache, key)
+    if os.path.isdir(path_entry):
+        return
+    if not os.path.isdir(path_cache):
+        os.makedirs(path_cache)
+    # copy files in a temporary folder first, so that an entry is never seen incomplete (e.g., by a parallel run)
+    path_tmp = os.path.join(path_cache, 'tmp.'+key+'.'+str(os.getpid()))
+    os.mkdir(path_tmp)
+    for fname in fname_list:
+        shutil.copyfile(fname, os.path.join(path_tmp, os.path.basename(fname)))
+    try:
+        os.rename(path_tmp, path_entry)
+    except OSError:
+        # entry was created in the meantime
+        shutil.rmtree(path_tmp, ignore_errors=True)
+    print '\nResult stored in cache: '+path_entry
+    evict(path_cache, int(os.environ.get('SCT_CACHE_SIZE', size_max_default)) * 1024 * 1024)
+
+
+#=======================================================================================================================
+# evict
+#=======================================================================================================================
+# Remove least recently used entries until the size of the cache is below size_max (in bytes).
+def evict(path_cache, size_max):
+    entries = []
+    size_total = 0
+    for key in os.listdir(path_cache):
+        path_entry = os.path.join(path_cache, key)
+        if key.startswith('tmp.') or not os.path.isdir(path_entry):
+            continue
+        size = sum([os.path.getsize(os.path.join(path_entry, f)) for f in os.listdir(path_entry)])
+        entries.append((os.path.getmtime(path_entry), size, path_entry))
+        size_total += size
+    for time_access, size, path_entry in sorted(entries):
+        if size_total <= size_max:
+            break
+        shutil.rmtree(path_entry, ignore_errors=True)
+        size_total -= size
+
+
+#=======================================================================================================================
+# hash_file
+#=======================================================================================================================
+# Return the SHA1 of the content of a file.
+def hash_file(fname):
+    h = hashlib.sha1()
+    f = open(fname, 'rb')
+    for block in iter(lambda: f.read(1 << 20), ''):
+        h.update(block)
+    f.close()
+    return h.hexdigest()
+
+
+#=======================================================================================================================
+# get_version_sct
+#=======================================================================================================================
+def get_version_sct():
+    fname_version = os.path.join(os.environ.get('SCT_DIR', ''), 'version.txt')
+    if not os.path.isfile(fname_version):
+        return ''
+    f = open(fname_version)
+    version = f.read().strip()
+    f.close()
+    return version
+
+
+#=======================================================================================================================
+# get_version_tool
+#=======================================================================================================================
+# Return the version of an external tool: output of its version option if it has one (see tools_version_option), or
+# else path, size and time of modification of its binary.
+def get_version_tool(tool):
+    if tool not in tools_version:
+        status, output = 1, ''
+        if tool in tools_version_option:
+            status, output = commands.getstatusoutput(tool+' '+tools_version_option[tool])
+        if status != 0:
+            status, path_tool = commands.getstatusoutput('which '+tool)
+            if status == 0 and os.path.isfile(path_tool):
+                output = path_tool+':'+str(os.path.getsize(path_tool))+':'+str(os.path.getmtime(path_tool))
+            else:
+                output = 'not found'
+        tools_version[tool] = tool+':'+output
+    return tools_version[tool]
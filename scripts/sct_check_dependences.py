@@ -28,6 +28,7 @@ import sys
 #import getopt
 import commands
 import time
+import sct_utils as sct
 #import logging
 
 
@@ -69,7 +70,7 @@ def main():
     print '  '+sys.executable
 
     # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    path_sct = os.environ.get('SCT_DIR', '')
 
     # fetch version of the toolbox
     print 'Fetch version of the Spinal Cord Toolbox... '
@@ -277,6 +278,16 @@ def main():
     #             'PATH=${PATH}:'+path_c3d)
     #         restart_terminal = 1
     # 
+    # save the state of dependences, checked by scripts at startup (see sct_utils.check_if_installed)
+    print_line('Update state of dependences ................... ')
+    failed = sct.refresh_dependences()
+    if not failed:
+        print_ok()
+    else:
+        print_warning()
+        print '  not working: '+', '.join(failed)
+    print '  '+sct.get_fname_dependences()
+
     if install_software:
         print '\nDone! Please install the required software, then run this script again.'
     elif restart_terminal:
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Compose ITK transformations (affine text files and warping fields) into a single warping field. In-process
+# replacement for ComposeMultiTransform (ANTs), which has an unreliable exit status.
+#
+# See Usage() below for more information.
+#
+#
+# DEPENDENCIES
+# ---------------------------------------------------------------------------------------
+# EXTERNAL PYTHON PACKAGES
+# - nibabel: <http://nipy.sourceforge.net/nibabel/>
+# - numpy: <http://www.numpy.org>
+# - scipy: <http://www.scipy.org>
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+# Note on conventions:
+# - Warping fields are ITK displacement fields (as output by ANTs): 5D NIfTI (nx, ny, nz, 1, 3) whose vectors are
+#   expressed in mm in the ITK physical space (LPS). ITK affine text files are also expressed in LPS. Here, everything
+#   is converted to the RAS space of the NIfTI affine when read, and converted back to LPS when written.
+# - A transformation maps a point of the reference (destination) space to the point of the source space where the
+#   image is sampled. As in ComposeMultiTransform and WarpImageMultiTransform, transformations of a list are applied to
+#   the points in the order of the list, e.g. [warp, affine] maps p to affine(p + warp(p)).
+
+
+# DEFAULT PARAMETERS
+class param:
+    ## The constructor
+    def __init__(self):
+        self.debug              = 0
+        self.verbose            = 1 # verbose
+
+import sys
+import getopt
+import os
+import time
+import sct_utils as sct
+import sct_gzip
+import nibabel
+import numpy
+
+# conversion between RAS (NIfTI) and LPS (ITK) physical coordinates
+ras2lps = numpy.array([-1, -1, 1])
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    fname_ref = ''
+    fname_output = ''
+    transfo_list = []
+    scale = 1
+    verbose = param.verbose
+    start_time = time.time()
+
+    # Check input parameters. -w and -i can be repeated, the order of the transformations is kept.
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'hd:w:i:o:s:v:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ("-d"):
+            fname_ref = arg
+        elif opt in ("-w"):
+            transfo_list.append(arg)
+        elif opt in ("-i"):
+            transfo_list += ['-i', arg]
+        elif opt in ("-o"):
+            fname_output = arg
+        elif opt in ("-s"):
+            scale = float(arg)
+        elif opt in ('-v'):
+            verbose = int(arg)
+
+    # display usage if a mandatory argument is not provided
+    if fname_ref == '' or fname_output == '' or transfo_list == []:
+        usage()
+
+    # check existence of input files
+    sct.check_file_exist(fname_ref)
+
+    # print arguments
+    if verbose:
+        print '\nCheck parameters:'
+        print '.. Reference:            '+fname_ref
+        print '.. Transformations:      '+' '.join(transfo_list)
+        print '.. Scale:                '+str(scale)
+        print '.. Output:               '+fname_output
+
+    # Compose transformations
+    compose_transfo(fname_output, fname_ref, transfo_list, scale, verbose)
+
+    # display elapsed time
+    if verbose:
+        elapsed_time = time.time() - start_time
+        print '\nFinished! Elapsed time: '+str(int(round(elapsed_time)))+'s'
+
+
+# compose_transfo
+# ==========================================================================================
+def compose_transfo(fname_output, fname_ref, transfo_list, scale=1, verbose=1):
+    """Compose a list of transformations (same syntax as ComposeMultiTransform: file names, affine files preceded by
+    '-i' are inverted) on the grid of fname_ref, and write the resulting warping field in fname_output."""
+    if verbose:
+        print '\nCompose transformations: '+' '.join(transfo_list)+' (reference: '+fname_ref+')...'
+    img_ref = nibabel.load(fname_ref)
+    shape = img_ref.get_shape()[0:3]
+    affine = img_ref.get_affine()
+    field = compose(read_transfo_list(transfo_list), shape, affine)
+    if scale != 1:
+        field = scale_warp(field, scale)
+    write_warp(fname_output, field, affine)
+    if verbose:
+        print '.. File created: '+fname_output
+    return fname_output
+
+
+# read_transfo_list
+# ==========================================================================================
+def read_transfo_list(transfo_list):
+    """Read a list of transformations (same syntax as ComposeMultiTransform). Affine transformations are returned as
+    4x4 matrices, warping fields as [field, affine]."""
+    transfos = []
+    inverse = False
+    for fname in transfo_list:
+        if fname == '-i':
+            inverse = True
+            continue
+        sct.check_file_exist(fname)
+        if is_affine(fname):
+            matrix = read_affine(fname)
+            if inverse:
+                matrix = numpy.linalg.inv(matrix)
+            transfos.append(matrix)
+        else:
+            if inverse:
+                print '\nERROR: Cannot invert warping field '+fname+'. Use the inverse warping field instead. Exit program.\n'
+                sys.exit(2)
+            transfos.append(read_warp(fname))
+        inverse = False
+    return transfos
+
+
+# is_affine
+# ==========================================================================================
+def is_affine(fname):
+    return fname.endswith('.txt')
+
+
+# read_affine
+# ==========================================================================================
+def read_affine(fname):
+    """Read an ITK affine transformation (text file, MatrixOffsetTransformBase or AffineTransform, 3D) and return the
+    4x4 matrix that maps RAS points of the reference space to RAS points of the source space."""
+    parameters = []
+    fixed_parameters = [0, 0, 0]
+    f = open(fname)
+    for line in f.readlines():
+        if line.startswith('Parameters:'):
+            parameters = [float(x) for x in line.split(':')[1].split()]
+        elif line.startswith('FixedParameters:'):
+            fixed_parameters = [float(x) for x in line.split(':')[1].split()]
+    f.close()
+    if len(parameters) != 12:
+        print '\nERROR: '+fname+' is not a 3D ITK affine transformation (12 parameters expected). Exit program.\n'
+        sys.exit(2)
+    # y = M.(x-c) + t + c
+    matrix = numpy.eye(4)
+    matrix[0:3, 0:3] = numpy.array(parameters[0:9]).reshape(3, 3)
+    center = numpy.array(fixed_parameters[0:3])
+    matrix[0:3, 3] = numpy.array(parameters[9:12]) + center - numpy.dot(matrix[0:3, 0:3], center)
+    # convert from LPS to RAS
+    flip = numpy.diag(list(ras2lps)+[1])
+    return numpy.dot(flip, numpy.dot(matrix, flip))
+
+
+# read_warp
+# ==========================================================================================
+def read_warp(fname):
+    """Read an ITK warping field. Return [field, affine], field is (nx, ny, nz, 3) in RAS (mm)."""
+    img = nibabel.load(fname)
+    data = img.get_data()
+    if data.size != numpy.prod(data.shape[0:3])*3:
+        print '\nERROR: '+fname+' is not a 3D warping field. Exit program.\n'
+        sys.exit(2)
+    return [data.reshape(data.shape[0:3]+(3,)) * ras2lps, img.get_affine()]
+
+
+# write_warp
+# ==========================================================================================
+def write_warp(fname, field, affine):
+    """Write a warping field (nx, ny, nz, 3) in RAS (mm) as an ITK warping field."""
+    data = (field * ras2lps).astype('float32')
+    img = nibabel.Nifti1Image(data.reshape(data.shape[0:3]+(1, 3)), affine)
+    img.get_header().set_intent('vector', (), '')
+    sct_gzip.save(img, fname)
+    return fname
+
+
+# grid_points
+# ==========================================================================================
+def grid_points(shape, affine):
+    """Return the physical RAS coordinates (n x 3, mm) of all voxels of a grid."""
+    coord = numpy.indices(shape[0:3]).reshape(3, -1).transpose()
+    return vox2phys(coord, affine)
+
+
+# transform_points
+# ==========================================================================================
+def transform_points(points, transfos):
+    """Apply a list of transformations (output of read_transfo_list) to points (n x 3, RAS, mm), in the list order."""
+    for transfo in transfos:
+        if isinstance(transfo, numpy.ndarray):
+            points = vox2phys(points, transfo)
+        else:
+            points = points + sample_warp(transfo[0], transfo[1], points)
+    return points
+
+
+# compose
+# ==========================================================================================
+def compose(transfos, shape, affine):
+    """Compose a list of transformations (output of read_transfo_list) into a warping field (nx, ny, nz, 3), RAS, mm,
+    defined on the grid of given shape and affine."""
+    points = grid_points(shape, affine)
+    return (transform_points(points, transfos) - points).reshape(tuple(shape[0:3])+(3,))
+
+
+# resample_warp
+# ==========================================================================================
+def resample_warp(field, affine_field, shape, affine):
+    """Resample a warping field on another grid (given shape and affine)."""
+    return compose([[field, affine_field]], shape, affine)
+
+
+# scale_warp
+# ==========================================================================================
+def scale_warp(field, scale):
+    """Multiply displacements of a warping field by scale."""
+    return field * scale
+
+
+# sampling_coordinates
+# ==========================================================================================
+def sampling_coordinates(transfos, shape, affine, affine_src):
+    """Return the (continuous) voxel coordinates (3 x n) in the source image (of given affine) where each voxel of the
+    reference grid (given shape and affine) is read when applying the transformations. They only depend on the grids,
+    hence can be computed once and used to resample any number of source images (see resample)."""
+    points = transform_points(grid_points(shape, affine), transfos)
+    return phys2vox(points, affine_src).transpose()
+
+
+# resample
+# ==========================================================================================
+def resample(data, coord, shape, order=1):
+    """Resample a 3D array at coord (output of sampling_coordinates) and return an array of the reference shape.
+    order=1: linear interpolation (output is float32), order=0: nearest neighbour (output has the input type). Voxels
+    sampled outside of the source image are set to 0."""
+    from scipy.ndimage import map_coordinates
+    if order == 0:
+        output = data.dtype
+    else:
+        output = numpy.float32
+    data_out = map_coordinates(data, coord, order=order, mode='constant', cval=0, output=output, prefilter=False)
+    return data_out.reshape(tuple(shape[0:3]))
+
+
+# sample_warp
+# ==========================================================================================
+def sample_warp(field, affine_field, points):
+    """Return the displacement (n x 3, RAS, mm) of a warping field (nx, ny, nz, 3), RAS, mm, at points (n x 3, RAS,
+    mm), using linear interpolation. As in ITK, displacement is null outside of the field."""
+    from scipy.ndimage import map_coordinates
+    coord = phys2vox(points, affine_field).transpose()
+    return numpy.array([map_coordinates(field[:, :, :, i], coord, order=1, mode='constant', cval=0.0)
+                        for i in range(0, 3)]).transpose()
+
+
+# vox2phys
+# ==========================================================================================
+def vox2phys(coord, affine):
+    """Convert voxel coordinates (n x 3) into physical RAS coordinates (n x 3, mm). Also used to apply a 4x4 affine
+    matrix to points."""
+    return numpy.dot(coord, affine[0:3, 0:3].transpose()) + affine[0:3, 3]
+
+
+# phys2vox
+# ==========================================================================================
+def phys2vox(points, affine):
+    """Convert physical RAS coordinates (n x 3, mm) into (continuous) voxel coordinates (n x 3). Round-off errors are
+    removed from coordinates of voxel centers, so that voxels on the border of a grid are not sampled outside of it."""
+    coord = vox2phys(points, numpy.linalg.inv(affine))
+    coord_round = numpy.round(coord)
+    return numpy.where(numpy.abs(coord - coord_round) < 1e-6, coord_round, coord)
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Compose ITK transformations (warping fields and affine text files) into a single warping field defined on\n' \
+        '  the grid of a reference image. Transformations are given in the same order as for ComposeMultiTransform.\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' -d <reference> -w <warp> [-w <warp2> -i <affine> ...] -o <output>\n' \
+        '\n' \
+        'MANDATORY ARGUMENTS\n' \
+        '  -d <reference>               reference image (defines the grid of the output warping field)\n' \
+        '  -w <transfo>                 warping field or affine text file. Can be repeated.\n' \
+        '  -i <affine>                  inverse of affine text file. Can be repeated.\n' \
+        '  -o <output>                  output warping field\n' \
+        '\n' \
+        'OPTIONAL ARGUMENTS\n' \
+        '  -s <scale>                   multiply the displacements of the output warping field. Default=1\n' \
+        '  -v <0,1>                     verbose. Default='+str(param.verbose)+'\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # initialize parameters
+    param = param()
+    # call main function
+    sct.profile(main)
@@ -22,7 +22,6 @@
 
 import sys
 import os
-import commands
 import getopt
 import time
 import math
@@ -40,7 +39,7 @@ except ImportError:
     sys.exit(2)
 
 # get path of the toolbox
-status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+path_sct = os.environ.get('SCT_DIR', '')
 # append path that contains scripts, to be able to load modules
 sys.path.append(path_sct + '/scripts')
 import sct_utils as sct
@@ -187,7 +186,7 @@ def sct_moco_process_dmri(param, fname_data, fname_bvecs):
     #path_script = param.path_script
     
     ## get path of the toolbox # TODO: no need to do that another time!
-    #status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    #path_sct = os.environ.get('SCT_DIR', '')
     ## append path that contains scripts, to be able to load modules
     #sys.path.append(path_sct + '/scripts')
     #import sct_utils as sct
@@ -240,6 +239,7 @@ def sct_moco_process_dmri(param, fname_data, fname_bvecs):
     print '.. Index of b=0:'+str(index_b0)
     print '.. Index of DWI:'+str(index_dwi)
 
+    sct.step('split and average')
     # Split into T dimension
     print '\nSplit along T dimension...'
     status, output = sct.run(fsloutput + 'fslsplit ' + fname_data + ' data_splitT')
@@ -324,6 +324,7 @@ def sct_moco_process_dmri(param, fname_data, fname_bvecs):
     cmd = fsloutput + 'fslmaths ' + fname_dwi_groups_means_merge + ' -Tmean ' + fname_dwi_mean
     status, output = sct.run(cmd)
 
+    sct.step('motion estimation')
     # Estimate moco on dwi groups
     print '\n------------------------------------------------------------------------------'
     print 'Estimating motion based on DW groups...'
@@ -335,6 +336,7 @@ def sct_moco_process_dmri(param, fname_data, fname_bvecs):
     param.interp = 'trilinear'
     sct_moco(param)
 
+    sct.step('copy matrices')
     #Copy registration matrix for every dwi based on dwi_averaged_groups
     print '\n------------------------------------------------------------------------------'
     print 'Copy registration matrix for every dwi based on dwi_averaged_groups matrix...'
@@ -354,6 +356,7 @@ def sct_moco_process_dmri(param, fname_data, fname_bvecs):
                 cmd = 'cp dwigroups_moco.mat/' + 'mat.T' + str(iGroup) + '_Z' + str(i_Z) + '.txt' + ' ' + mat_final + 'mat.T' + str(group_indexes[iGroup][dwi]) + '_Z' + str(i_Z) + '.txt'
                 status, output = sct.run(cmd)
 
+    sct.step('motion correction')
     #Apply moco on all dmri data
     print '\n\n\n------------------------------------------------------------------------------'
     print 'Apply moco on all dmri data...'
@@ -410,4 +413,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
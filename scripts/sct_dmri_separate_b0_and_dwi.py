@@ -27,6 +27,8 @@ import getopt
 import os
 import math
 import time
+import numpy
+import nibabel
 import sct_utils as sct
 
 
@@ -37,7 +39,6 @@ def main():
 
     # Initialization
     path_script = os.path.dirname(__file__)
-    fsloutput = 'export FSLOUTPUTTYPE=NIFTI; ' # for faster processing, all outputs are in NIFTI
     # THIS DOES NOT WORK IN MY LAPTOP: path_sct = os.environ['SCT_DIR'] # path to spinal cord toolbox
     path_sct = path_script[:-8] # TODO: make it cleaner!
     fname_data = ''
@@ -80,14 +81,14 @@ def main():
     print '.. bvecs file:           '+fname_bvecs
 
     # Extract path, file and extension
+    fname_data = os.path.abspath(fname_data)
     path_data, file_data, ext_data = sct.extract_fname(fname_data)
 
     # create temporary folder
     path_tmp = 'tmp.'+time.strftime("%y%m%d%H%M%S")
     sct.run('mkdir '+path_tmp)
 
-    # copy files into tmp folder
-    sct.run('cp '+fname_data+' '+path_tmp)
+    # copy files into tmp folder (data are read from the input file)
     sct.run('cp '+fname_bvecs+' '+path_tmp)
 
     # go to tmp folder
@@ -127,29 +128,23 @@ def main():
 
     #TODO: check if number of bvecs and nt match
 
-    # Split into T dimension
-    print '\nSplit along T dimension...'
-    sct.run(fsloutput+' fslsplit '+fname_data+' data_splitT')
-
-    # retrieve output names
-    status, output = sct.run('ls data_splitT*.*')
-    file_data_split = output.split()
-    # Remove .nii extension
-    file_data_split = [file_data_split[i].replace('.nii','') for i in xrange (0,len(file_data_split))]
-
-    # Merge b=0 images
-    print '\nMerge b=0...'
-    cmd = fsloutput+'fslmerge -t b0'
-    for it in xrange(0,nb_b0):
-        cmd += ' '+file_data_split[index_b0[it]]
-    sct.run(cmd)
-
-    # Merge DWI images
-    print '\nMerge DWI...'
-    cmd = fsloutput+'fslmerge -t dwi'
-    for it in xrange(0,nb_dwi):
-        cmd += ' '+file_data_split[index_dwi[it]]
-    sct.run(cmd)
+    # Merge b=0 and DWI images. Volumes are read one at a time from the input file, without splitting the data into
+    # files (for compressed data, decompression starts from the closest seek point, see sct_gzip).
+    im = sct.Image(fname_data)
+    for file_merge, index in [('b0', index_b0), ('dwi', index_dwi)]:
+        print '\nMerge '+file_merge+'...'
+        for it in xrange(0,len(index)):
+            data_it = im.get_volume(index[it])
+            if it == 0:
+                data = numpy.empty((nx, ny, nz, len(index)), dtype=data_it.dtype)
+            data[:, :, :, it] = data_it
+        hdr = im.hdr.copy()
+        hdr.set_data_shape(data.shape)
+        # scaled data (float) are written as float, to avoid rounding by a new scaling
+        if data.dtype.kind == 'f':
+            hdr.set_data_dtype(numpy.float32)
+        nibabel.save(nibabel.Nifti1Image(data, None, hdr), file_merge+'.nii')
+        del data
 
     # come back to parent folder
     os.chdir('..')
@@ -205,4 +200,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
\ No newline at end of file
+    sct.profile(main)
@@ -70,9 +70,9 @@
 # ----------------------------------------------------------------------------------------------------------------------
 # Inputs
 # - data : data array of metrics
-# - sigmaN : standard deviation estimation of noise in metrics
-# - sigmaX : standard deviation estimation in all values of metrics by tracts
 # - tracts : cell array containing the white matter atlas
+# - atlas_map : linear system of the atlas and its factorization (output of bayesian_prepare). Since it does not depend
+#   on the metric, it is computed once and shared when several metrics are extracted.
 #
 # Outputs
 # - X_map : metric value estimation for each tract
@@ -137,6 +137,10 @@ class param:
         self.slice_choice = 0
         # by default, program don't export data results in file .txt
         self.output_choice = 0
+        # number of bootstrap replicates to compute confidence intervals (0: no bootstrap)
+        self.nb_bootstrap = 0
+        # number of processes used for bootstrap (0: number of CPUs)
+        self.nb_proc = 0
 
 # Import common Python libraries
 import os
@@ -145,7 +149,9 @@ import sys
 import time
 import glob
 import re
+import multiprocessing
 import sct_utils as sct
+import sct_warp_atlas2metric
 import numpy
 
 # Check if special Python libraries are installed or not
@@ -158,7 +164,7 @@ except ImportError:
 try:
     # library of calculations and processing matrices
     from numpy import mean, asarray, std, zeros, sum, ones, dot, eye, sqrt, empty, size, linspace, abs, amin, argmin, concatenate, array
-    from numpy.linalg import solve,pinv
+    from numpy.linalg import solve,pinv,eigh
 except ImportError:
     print '--- numpy not installed! Exit program. ---'
     sys.exit(2)
@@ -186,6 +192,7 @@ def main():
     vertebral_levels = param.vertebral_levels # no vertebral level selected by default
     slice_choice = param.slice_choice # no select label by default
     output_choice = param.output_choice # no select slice by default
+    nb_bootstrap = param.nb_bootstrap # no bootstrap by default
     start_time = time.time() # save start time for duration
 
     # Parameters for debug mode
@@ -206,15 +213,17 @@ def main():
 
     # Check input parameters
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hi:l:m:o:t:v:z:') # define flags
+        opts, args = getopt.getopt(sys.argv[1:], 'b:hi:l:m:o:t:v:z:') # define flags
     except getopt.GetoptError as err: # check if the arguments are defined
         print str(err) # error
         usage(label_title, label_name, label_num,fname_tracts) # display usage
     for opt, arg in opts: # explore flags
         if opt == '-h': # help option
             usage(label_title, label_name, label_num,fname_tracts) # display usage
-        elif opt in '-i': # MRI metric to input
-            fname_data = arg # save path of metric MRI
+        elif opt in '-b': # number of bootstrap replicates
+            nb_bootstrap = int(arg)
+        elif opt in '-i': # MRI metric(s) to input
+            fname_data = arg # save path of metric MRI (several files can be separated by ",")
         elif opt in '-l': # labels numbers option
             label_choice = 1 # label choice is activate
             label_number = arg # save labels numbers
@@ -240,21 +249,26 @@ def main():
     if fname_data == '' or fname_tracts == '':
         usage(label_title, label_name, label_num,fname_tracts)
 
-    # Check existence of data file
-    sct.check_file_exist(fname_data)
+    # Split list of metric files (several metrics can be extracted with the same atlas)
+    fname_data_list = [x.strip() for x in fname_data.split(',')]
 
-    # Extract path/file/extension
-    path_data, file_data, ext_data = sct.extract_fname(fname_data)
+    for i_metric in range(0, len(fname_data_list)):
 
-    # Add extensions file if there are not
-    if ext_data == '':
-        fname_data += '.nii.gz'
-        path_data, file_data, ext_data = sct.extract_fname(fname_data)
+        # Check existence of data file
+        sct.check_file_exist(fname_data_list[i_metric])
 
-    # Check if data extension is correct
-    if ext_data != '.nii.gz':
-        print '\nERROR: Data format ' + ext_data + ' not correct, use ".nii.gz". Exit program.\n'
-        sys.exit(2)
+        # Extract path/file/extension
+        path_data, file_data, ext_data = sct.extract_fname(fname_data_list[i_metric])
+
+        # Add extensions file if there are not
+        if ext_data == '':
+            fname_data_list[i_metric] += '.nii.gz'
+            path_data, file_data, ext_data = sct.extract_fname(fname_data_list[i_metric])
+
+        # Check if data extension is correct
+        if ext_data != '.nii.gz':
+            print '\nERROR: Data format ' + ext_data + ' not correct, use ".nii.gz". Exit program.\n'
+            sys.exit(2)
 
     # Extract title, tract names and label numbers
     [label_title, label_name, label_num, fname_tract] = read_name(fname_tracts)
@@ -289,12 +303,25 @@ def main():
     # Read files
     print '\nRead files...'
 
-    # Load data metric MRI
-    data = load(fname_data)
-
-    # Make data in array format
-    data = data.get_data()
+    # Load data metric MRI. Each volume of a 4D file is considered as a separate metric.
+    metric_name = []
+    metric_data = []
+    for fname in fname_data_list:
+        file_data = sct.extract_fname(fname)[1]
+        data = load(fname).get_data()
+        if data.ndim == 4:
+            for t in range(0, data.shape[3]):
+                metric_name.append(file_data + '_' + str(t))
+                metric_data.append(data[:, :, :, t])
+        else:
+            metric_name.append(file_data)
+            metric_data.append(data)
 
+    # Reshape data if it is the 2D image instead of 3D
+    for i_metric in range(0, len(metric_data)):
+        if metric_data[i_metric].ndim == 2:
+            metric_data[i_metric] = metric_data[i_metric].reshape(int(size(metric_data[i_metric], 0)), int(size(metric_data[i_metric], 1)), 1)
+    data = metric_data[0]
 
     # Select the input image slices corresponding to the selected vertebral levels
     if vertebral_levels != '':
@@ -351,8 +378,9 @@ def main():
     # Display arguments
     print '\nCheck input arguments...'
 
-    # Display data file
-    print '\tSpinal cord MRI : ' + fname_data
+    # Display data file(s)
+    for fname in fname_data_list:
+        print '\tSpinal cord MRI : ' + fname
 
     # Display mode extraction
     print '\tExtraction mode : ' + mode
@@ -374,6 +402,10 @@ def main():
     if output_choice == 1:
         print '\tOutput : ' + fname_output
 
+    # Display number of bootstrap replicates
+    if nb_bootstrap > 0:
+        print '\tBootstrap replicates : ' + str(nb_bootstrap)
+
     # Display labels chosen for results
     if label_choice == 1:
         print '\tSelected tracts numbers : ' + (str(nb)[1:-1]).replace(' ', '')
@@ -384,19 +416,24 @@ def main():
         print '\tLabel ' + str(label_num[label]) + ' \t\t' + fname_tract[label][(len(fname_tracts) + 1):]+ \
               '\t\t' + label_name[label]
 
-    # Initialise tracts variable as object because there are 4 dimensions
-    tracts = empty([len(fname_tract), 1], dtype=object)
+    # Tracts to read: the weighted average of a tract does not depend on the other tracts, hence only selected tracts
+    # are read. The bayesian estimation needs all tracts.
+    if mode == "weightedaverage":
+        tract_read = sorted(nb)
+    else:
+        tract_read = range(0, len(fname_tract))
 
-    # Load each partial volumes of each tracts
-    for label in range(0, len(fname_tract)):
-        tracts[label, 0] = load(fname_tract[label]).get_data()
+    # Initialise tracts variable as object because there are 4 dimensions
+    tracts = empty([len(tract_read), 1], dtype=object)
 
-    # Reshape data if it is the 2D image instead of 3D
-    if data.ndim == 2:
-        data=data.reshape(int(size(data,0)), int(size(data,1)),1)
+    sct.step('tracts loading')
+    # Load each partial volumes of each tracts (tracts not warped yet by sct_warp_atlas2metric are warped now)
+    tracts_data = sct_warp_atlas2metric.load_tracts([fname_tract[label] for label in tract_read])
+    for label in range(0, len(tract_read)):
+        tracts[label, 0] = tracts_data[label]
 
     # Reshape tracts if it is the 2D image instead of 3D
-    for label in range(0, len(fname_tract)):
+    for label in range(0, len(tract_read)):
         if (tracts[label,0]).ndim == 2:
             tracts[label,0] = tracts[label,0].reshape(int(size(tracts[label,0],0)), int(size(tracts[label,0],1)),1)
 
@@ -404,32 +441,67 @@ def main():
     if slice_choice ==0:
         nb_slice = [0,int(size(tracts[0, 0],2)-1)]
 
-    # Pretreatment before extraction
-    [data_new,tracts_new, number_tracts] = pretreatment(data, tracts, nb_slice)
+    # Initialisation of results (one column per metric)
+    X = zeros([len(fname_tract), len(metric_data)])
+    stand = zeros([len(fname_tract), len(metric_data)])
+    # 95% confidence interval estimated by bootstrap: lower and upper bounds
+    ci_low = zeros([len(fname_tract), len(metric_data)])
+    ci_high = zeros([len(fname_tract), len(metric_data)])
 
-    #TODO: only estimate the metric value for selected tracts AND NOT: for all and then display the metric value for the selected tracts (what this script currently does)
-    # Extraction with weighted_average
-    if mode == "weightedaverage":
+    # The atlas (and its factorization for the MAP) does not depend on the metric: compute it only once
+    atlas_map = None
 
-        # Do extraction with weighted average
-        [X, stand] = weighted_average(data_new, tracts_new, number_tracts)
-        print'\nWeighted average results \n'
+    for i_metric in range(0, len(metric_data)):
 
-        # Display results
-        for i in range(0, len(nb)):
-            print'\tLabel ' + str(nb[i]) + ' \tX = ' + str(X[nb[i], 0]) + ' \tSTD = ' + str(stand[nb[i], 0])
+        sct.step('estimation')
+        # Pretreatment before extraction
+        [data_new,tracts_new, number_tracts] = pretreatment(metric_data[i_metric], tracts, nb_slice)
+
+        #TODO: bayesian: only estimate the metric value for selected tracts AND NOT: for all and then display the metric value for the selected tracts (what this script currently does)
+        # Extraction with weighted_average
+        if mode == "weightedaverage":
+
+            # Do extraction with weighted average
+            [X_metric, stand_metric] = weighted_average(data_new, tracts_new, number_tracts)
+
+            # Bootstrap over voxels
+            if nb_bootstrap > 0:
+                sct.step('bootstrap')
+                X_boot = bootstrap_weighted_average(data_new, tracts_new, number_tracts, nb_bootstrap, tract_read)
+
+            print'\nWeighted average results: ' + metric_name[i_metric] + '\n'
+
+        # Extraction with bayesian model
+        if mode == "bayesian":
 
-    # Extraction with bayesian model
-    if mode == "bayesian":
+            # Build and factorize the linear system of the atlas only once
+            if atlas_map is None:
+                atlas_map = bayesian_prepare(tracts_new, number_tracts)
 
-        # Do extraction with maximum a posteriori method
-        [X, stand] = bayesian(data_new, tracts_new, number_tracts)
+            # Do extraction with maximum a posteriori method
+            [X_metric, stand_metric, sigmaX, sigmaN] = bayesian(data_new, tracts_new, number_tracts, atlas_map)
+
+            # Bootstrap over residuals (re-use the factorization of the atlas and the estimated sigmas)
+            if nb_bootstrap > 0:
+                sct.step('bootstrap')
+                X_boot = bootstrap_bayesian(data_new, number_tracts, atlas_map, X_metric, sigmaX, sigmaN, nb_bootstrap)
+
+            print'\nBayesian estimation results: ' + metric_name[i_metric] + '\n'
+
+        X[tract_read, i_metric] = X_metric[:, 0]
+        stand[tract_read, i_metric] = stand_metric[:, 0]
+        if nb_bootstrap > 0:
+            [ci_low[tract_read, i_metric], ci_high[tract_read, i_metric]] = numpy.percentile(X_boot, [2.5, 97.5], axis=0)
 
         # Display results
-        print'\nBayesian estimation results \n'
         for i in range(0, len(nb)):
-            print'\tLabel ' + str(nb[i]) + ' \tX = ' + str(X[nb[i], 0]) + ' \tSTD = ' + str(stand[nb[i], 0])
+            if nb_bootstrap > 0:
+                print'\tLabel ' + str(nb[i]) + ' \tX = ' + str(X[nb[i], i_metric]) + ' \tSTD = ' + str(stand[nb[i], i_metric]) + \
+                     ' \tCI95 = [' + str(ci_low[nb[i], i_metric]) + ', ' + str(ci_high[nb[i], i_metric]) + ']'
+            else:
+                print'\tLabel ' + str(nb[i]) + ' \tX = ' + str(X[nb[i], i_metric]) + ' \tSTD = ' + str(stand[nb[i], i_metric])
 
+    sct.step('output')
     # Save data output in file .txt
     if output_choice == 1:
         print '\nWrite results in ' + fname_output + '...'
@@ -446,12 +518,26 @@ def main():
         # Write slices chosen
         fid_metric.write('%s\t%i to %i\n\n'% ('Slices : ',nb_slice[0],nb_slice[1]))
 
-        # Write header title in file .txt
-        fid_metric.write('%s\t\t%s\t\t\t\t\t\t%s\t\t\t\t%s\n\n' % ('Label', 'Name', 'Metric', 'STD'))
+        if len(metric_data) == 1 and nb_bootstrap == 0:
+            # Write header title in file .txt
+            fid_metric.write('%s\t\t%s\t\t\t\t\t\t%s\t\t\t\t%s\n\n' % ('Label', 'Name', 'Metric', 'STD'))
 
-        # Write metric for label chosen in file .txt
-        for i in range(0, len(nb)):
-            fid_metric.write('%i\t%s\t\t\t%f\t\t\t%f\n' % (nb[i], label_name[nb[i]], X[nb[i]], stand[nb[i]]))
+            # Write metric for label chosen in file .txt
+            for i in range(0, len(nb)):
+                fid_metric.write('%i\t%s\t\t\t%f\t\t\t%f\n' % (nb[i], label_name[nb[i]], X[nb[i], 0], stand[nb[i], 0]))
+
+        else:
+            # Write one line per metric and label (long format)
+            fid_metric.write('%s\t%s\t%s\t%s\t%s' % ('Metric', 'Label', 'Name', 'Value', 'STD'))
+            if nb_bootstrap > 0:
+                fid_metric.write('\t%s\t%s' % ('CI95_low', 'CI95_high'))
+            fid_metric.write('\n')
+            for i_metric in range(0, len(metric_data)):
+                for i in range(0, len(nb)):
+                    fid_metric.write('%s\t%i\t%s\t%f\t%f' % (metric_name[i_metric], nb[i], label_name[nb[i]], X[nb[i], i_metric], stand[nb[i], i_metric]))
+                    if nb_bootstrap > 0:
+                        fid_metric.write('\t%f\t%f' % (ci_low[nb[i], i_metric], ci_high[nb[i], i_metric]))
+                    fid_metric.write('\n')
 
         # Close file .txt
         fid_metric.close()
@@ -485,8 +571,10 @@ def read_name(fname_tracts):
         print('\nERROR: ' + fname_tracts + ' does not exist. Exit program.\n')
         sys.exit(2)
 
-    # Save path of each tracts
-    fname_tract = glob.glob(fname_tracts + '/*.nii.gz')
+    # Save path of each tracts (tracts of an atlas warped by sct_warp_atlas2metric might not be warped yet)
+    fname_tract = sct_warp_atlas2metric.list_tracts(fname_tracts)
+    if fname_tract is None:
+        fname_tract = glob.glob(fname_tracts + '/*.nii.gz')
 
     # Check if tracts exist in folder
     if len(fname_tract) == 0:
@@ -745,11 +833,112 @@ def weighted_average(data_wa, tracts_wa, numtracts_wa):
 
     return [X_wa, std_wa]
 
+#=======================================================================================================================
+# Bootstrap
+#=======================================================================================================================
+
+# Arrays shared with the bootstrap processes. They are set before the pool of processes is created, so that the processes
+# (forked) access them without copying.
+bootstrap_shared = {}
+
+def bootstrap_run(function, nb_replicates):
+    """Run nb_replicates bootstrap replicates of function(seed, nb) in a pool of processes and concatenate results."""
+
+    nb_proc = param.nb_proc
+    if nb_proc == 0:
+        nb_proc = multiprocessing.cpu_count()
+
+    # Split replicates in chunks (one random seed per chunk, so that results do not depend on the number of processes)
+    nb_chunks = min(nb_replicates, 64)
+    chunks = [(seed, len(range(seed, nb_replicates, nb_chunks))) for seed in range(0, nb_chunks)]
+
+    print '\nBootstrap (' + str(nb_replicates) + ' replicates, ' + str(nb_proc) + ' processes)...'
+    if nb_proc == 1:
+        X_boot = map(function, chunks)
+    else:
+        pool = multiprocessing.Pool(nb_proc)
+        X_boot = pool.map(function, chunks)
+        pool.close()
+        pool.join()
+
+    return concatenate(X_boot, axis=0)
+
+
+def bootstrap_weighted_average(data_wa, tracts_wa, numtracts_wa, nb_replicates, labels):
+    """Estimate the weighted average of each tract on nb_replicates bootstrap samples of the voxels of the tract (its
+    support: voxels where its partial volume is not zero). Each tract is resampled on its own, with a random seed
+    depending on its label number (labels), so that its confidence interval does not depend on the other tracts
+    selected. Return an array of size nb_replicates x numtracts_wa."""
+
+    # Partial volumes and weighted data of the support of each tract
+    supports = []
+    for i in range(0, numtracts_wa):
+        mask = tracts_wa[i, 0] > 0
+        weights = tracts_wa[i, 0][mask]
+        supports.append([labels[i], weights, weights * data_wa[mask]])
+    bootstrap_shared['supports'] = supports
+
+    return bootstrap_run(bootstrap_weighted_average_chunk, nb_replicates)
+
+
+def bootstrap_weighted_average_chunk(chunk):
+    [seed, nb] = chunk
+    supports = bootstrap_shared['supports']
+
+    X_boot = zeros([nb, len(supports)])
+    for i, [label, weights, weighted_data] in enumerate(supports):
+        nb_voxels = weights.shape[0]
+        # Tracts that are zero everywhere are set to 0
+        if nb_voxels == 0:
+            continue
+
+        # Number of times each voxel is drawn in each replicate
+        count = numpy.random.RandomState([seed, label]).multinomial(nb_voxels, ones(nb_voxels) / nb_voxels, size=nb)
+
+        # Weighted average of each replicate
+        X_boot[:, i] = dot(count, weighted_data) / dot(count, weights)
+    return X_boot
+
+
+def bootstrap_bayesian(data, numtracts, atlas_map, X_map, sigmaX, sigmaN, nb_replicates):
+    """Estimate the MAP on nb_replicates bootstrap samples of the residuals. The linear system of the atlas and its
+    factorization, as well as sigmaX and sigmaN, are the ones of the initial estimation. Return an array of size
+    nb_replicates x numtracts."""
+
+    [slice_mid, P, P_save, factor] = atlas_map
+    Y = asarray(data[:, :, slice_mid]).reshape(-1, 1)
+    Y_fit = dot(P.transpose(), X_map)
+
+    bootstrap_shared['P'] = P
+    bootstrap_shared['factor'] = factor
+    bootstrap_shared['Y_fit'] = Y_fit
+    bootstrap_shared['residuals'] = Y - Y_fit
+    bootstrap_shared['sigmas'] = [sigmaX, sigmaN]
+
+    return bootstrap_run(bootstrap_bayesian_chunk, nb_replicates)
+
+
+def bootstrap_bayesian_chunk(chunk):
+    [seed, nb] = chunk
+    P = bootstrap_shared['P']
+    factor = bootstrap_shared['factor']
+    Y_fit = bootstrap_shared['Y_fit']
+    residuals = bootstrap_shared['residuals']
+    [sigmaX, sigmaN] = bootstrap_shared['sigmas']
+    numtracts = P.shape[0]
+    random_state = numpy.random.RandomState(seed)
+
+    X_boot = zeros([nb, numtracts])
+    for i in range(0, nb):
+        Y = Y_fit + residuals[random_state.randint(0, len(residuals), len(residuals))]
+        X_boot[i, :] = MAP(P, Y, eye(numtracts), sigmaX, sigmaN, ones([numtracts, 1]), mean(Y), factor)[0][:, 0]
+    return X_boot
+
 #=======================================================================================================================
 # Estimation of standard deviations
 #=======================================================================================================================
 
-def estimate_parameters(P, Y, R_X, U_comp, X0):
+def estimate_parameters(P, Y, R_X, U_comp, X0, factor=None):
 
     # Initialisation of iterations number
     iter = param.iter
@@ -778,7 +967,7 @@ def estimate_parameters(P, Y, R_X, U_comp, X0):
         for j in range(0, iter-1):
 
             # Estimate metrics with MAP
-            [sigma_map, sigma_noise] = MAP(P, Y, R_X, sigmaX[j], sigmaN[i], U_comp, X0)[1:]
+            [sigma_map, sigma_noise] = MAP(P, Y, R_X, sigmaX[j], sigmaN[i], U_comp, X0, factor)[1:]
 
             # Errors between sigma
             d_n[i, j] = abs(sigmaN[i] - sigma_noise)
@@ -802,16 +991,15 @@ def estimate_parameters(P, Y, R_X, U_comp, X0):
 # Estimation of map tracts
 #=======================================================================================================================
 
-def bayesian(data, tracts, numtracts):
+def bayesian_prepare(tracts, numtracts):
+    """Build the linear system of the atlas and factorize it. The result does not depend on the metric, hence it can be
+    shared between several metrics extracted with the same atlas."""
 
     # Choice one slice for simplification MAP
-    slice_mid = int(data.shape[2]/2)
-
-    # Resizing of data in 1D
-    Y = asarray(data[:, :, slice_mid]).reshape(-1, 1)
+    slice_mid = int(tracts[0, 0].shape[2]/2)
 
     # Initialization of matrix linear transformation
-    P = zeros([len(Y), numtracts])
+    P = zeros([tracts[0, 0][:, :, slice_mid].size, numtracts])
 
     # Matrix of linear transformation
     for label in range(0, numtracts):
@@ -826,12 +1014,31 @@ def bayesian(data, tracts, numtracts):
         label_sum = sum(P[:,label])
         P[:,label] = P[:, label] / label_sum
 
-    # Mean of data
-    X0 = mean(Y)
-
     # Inverse linear transformation because x=P*y so y=inv(P)*x
     P = pinv(P)
 
+    # Eigen-decomposition of P*P', used to solve the MAP system for any ratio sigmaN/sigmaX
+    factor = eigh(dot(P, P.transpose()))
+
+    return [slice_mid, P, P_save, factor]
+
+#=======================================================================================================================
+# Estimation of map tracts
+#=======================================================================================================================
+
+def bayesian(data, tracts, numtracts, atlas_map=None):
+
+    # Build linear system of the atlas if it was not provided
+    if atlas_map is None:
+        atlas_map = bayesian_prepare(tracts, numtracts)
+    [slice_mid, P, P_save, factor] = atlas_map
+
+    # Resizing of data in 1D
+    Y = asarray(data[:, :, slice_mid]).reshape(-1, 1)
+
+    # Mean of data
+    X0 = mean(Y)
+
     # Matrix of mean
     U_comp = ones([numtracts, 1])
 
@@ -839,10 +1046,10 @@ def bayesian(data, tracts, numtracts):
     R_X= eye(numtracts)
 
     # Estimate sigmas before MAP
-    [sigmaX, sigmaN] = estimate_parameters(P, Y, R_X, U_comp, X0)
+    [sigmaX, sigmaN] = estimate_parameters(P, Y, R_X, U_comp, X0, factor)
 
     # Compute MAP
-    X_map = MAP(P, Y, R_X, sigmaX, sigmaN, U_comp, X0)[0]
+    X_map = MAP(P, Y, R_X, sigmaX, sigmaN, U_comp, X0, factor)[0]
 
     # Standard deviation of MAP
     std_map = zeros([numtracts, 1])
@@ -855,17 +1062,22 @@ def bayesian(data, tracts, numtracts):
         temp = ((sum(temp)/(sum_label)))
         std_map[label] = sqrt(temp)
 
-    return [X_map, std_map]
+    return [X_map, std_map, sigmaX, sigmaN]
 
 #=======================================================================================================================
 # MAP
 #=======================================================================================================================
-def MAP(P, Y, R_X, sigmaX, sigmaN, U_comp, X0):
+def MAP(P, Y, R_X, sigmaX, sigmaN, U_comp, X0, factor=None):
 
     # Computing of MAP
-    A = dot(P, P.transpose())+(sigmaN/sigmaX)*(sigmaN/sigmaX)*R_X
     B = dot(P, (Y - X0 * dot(P.transpose(), U_comp)))
-    X_map = X0 + solve(A,B)
+    if factor is None:
+        A = dot(P, P.transpose())+(sigmaN/sigmaX)*(sigmaN/sigmaX)*R_X
+        X_map = X0 + solve(A,B)
+    else:
+        # Use eigen-decomposition of P*P' (only valid because R_X is the identity matrix)
+        [eigval, eigvec] = factor
+        X_map = X0 + dot(eigvec, dot(eigvec.transpose(), B) / (eigval + (sigmaN/sigmaX)*(sigmaN/sigmaX)).reshape(-1, 1))
 
     # Standard deviation in metrics
     sigma_map = std(X_map)
@@ -878,6 +1090,56 @@ def MAP(P, Y, R_X, sigmaX, sigmaN, U_comp, X0):
 
     return [X_map, sigma_map, sigma_noise]
 
+#=======================================================================================================================
+# get_vertebral_level_index
+#=======================================================================================================================
+def get_vertebral_level_index(fname_vertebral_labeling):
+    """Return the size of the vertebral labeling image and, for each level, the first slice, last slice and number of
+    voxels of the level. The index is computed once and saved beside the vertebral labeling file. It is computed again
+    if the vertebral labeling file is more recent than the index."""
+
+    fname_index = sct.extract_fname(fname_vertebral_labeling)[0] + 'vertebral_labeling_index.txt'
+
+    # Read index if it is up to date
+    if os.path.isfile(fname_index) and os.path.getmtime(fname_index) >= os.path.getmtime(fname_vertebral_labeling):
+        fid_index = open(fname_index)
+        lines = [line.split() for line in fid_index.readlines() if line.strip() and not line.startswith('#')]
+        fid_index.close()
+        shape = [int(x) for x in lines[0]]
+        index = dict([(int(line[0]), [int(line[1]), int(line[2]), int(line[3])]) for line in lines[1:]])
+        return [shape, index]
+
+    # Read files vertebral_labeling.nii.gz
+    print '\nRead files vertebral_labeling.nii.gz...'
+    data_vert_labeling = load(fname_vertebral_labeling).get_data()
+    shape = list(data_vert_labeling.shape)
+
+    # Count the voxels of each level, and find the levels present in each slice
+    levels = data_vert_labeling.astype(int)
+    offset = levels.min()
+    levels = levels - offset
+    nb_levels = levels.max() + 1
+    count = numpy.bincount(levels.ravel(), minlength=nb_levels)
+    present = array([numpy.bincount(levels[:, :, z].ravel(), minlength=nb_levels) > 0 for z in range(0, shape[2])])
+
+    index = {}
+    for level in (count > 0).nonzero()[0]:
+        slices = present[:, level].nonzero()[0]
+        index[int(level + offset)] = [int(slices[0]), int(slices[-1]), int(count[level])]
+
+    # Save index beside the vertebral labeling file (skip if the folder is not writable)
+    try:
+        fid_index = open(fname_index, 'w')
+        fid_index.write('# size of vertebral_labeling.nii.gz, then: level slice_min slice_max number_of_voxels\n')
+        fid_index.write('%i %i %i\n' % tuple(shape))
+        for level in sorted(index.keys()):
+            fid_index.write('%i %i %i %i\n' % tuple([level] + index[level]))
+        fid_index.close()
+    except IOError:
+        print '\tWARNING: Cannot write ' + fname_index + '.'
+
+    return [shape, index]
+
 #=======================================================================================================================
 # get_slices_matching_with_vertebral_levels
 #=======================================================================================================================
@@ -888,19 +1150,11 @@ def get_slices_matching_with_vertebral_levels(metric_data,fname_tracts,vert_leve
     fname_vertebral_labeling = fname_tracts + '/../vertebral_labeling.nii.gz'
     sct.check_file_exist(fname_vertebral_labeling)
 
-     # Read files vertebral_labeling.nii.gz
-    print '\nRead files vertebral_labeling.nii.gz...'
-
-    # Load vertebral_labeling.nii.gz
-    file_vert_labeling = load(fname_vertebral_labeling)
-
-    # Make data in array format
-    data_vert_labeling = file_vert_labeling.get_data()
+    # Get index of vertebral levels (level --> slice min, slice max, number of voxels)
+    [[vx, vy, vz], index] = get_vertebral_level_index(fname_vertebral_labeling)
 
     # Extract metric data size X, Y, Z
     [mx, my, mz] = metric_data.shape
-    # Extract vertebral labeling data size X, Y, Z
-    [vx, vy, vz] = data_vert_labeling.shape
 
     # Initialisation of check error flag
     exit_program = 0
@@ -921,7 +1175,7 @@ def get_slices_matching_with_vertebral_levels(metric_data,fname_tracts,vert_leve
         exit_program = 1
 
     # Compute the minimum and maximum vertebral levels available in the input image
-    min_vert_level, max_vert_level = int(numpy.amin(concatenate(data_vert_labeling,axis=None))), int(numpy.amax(concatenate(data_vert_labeling,axis=None)))
+    min_vert_level, max_vert_level = min(index.keys()), max(index.keys())
 
     if vert_levels_list!=None:
         # Check if the vertebral levels selected are available in the input image
@@ -933,29 +1187,28 @@ def get_slices_matching_with_vertebral_levels(metric_data,fname_tracts,vert_leve
             print '...maximum level available in the input image: '+str(max_vert_level)
             exit_program = 1
 
+        # Check if the vertebral levels selected are present in the input image
+        for level in vert_levels_list:
+            if not level in index:
+                print '\tERROR: Vertebral level ' + str(level) + ' is not present in the input image.'
+                exit_program = 1
+
         # Exit program if error is detect in sizes
         if exit_program == 1 :
             print '\nExit program.\n'
             sys.exit(2)
 
-
-        # Extract the X, Y, Z positions of voxels belonging to the first vertebral level
-        X_bottom_level, Y_bottom_level, Z_bottom_level = (data_vert_labeling==vert_levels_list[0]).nonzero()
-        # Record the bottom of slice of this level
-        slice_min_bottom = min(Z_bottom_level)
-
-        # Extract the X, Y, Z positions of voxels belonging to the last vertebral level
-        X_top_level, Y_top_level, Z_top_level = (data_vert_labeling==vert_levels_list[1]).nonzero()
-        # Record the top slice of this level
-        slice_max_top = max(Z_top_level)
+        # Record the bottom and top slices of the first and last vertebral levels
+        slice_min_bottom, slice_max_bottom = index[vert_levels_list[0]][0:2]
+        slice_min_top, slice_max_top = index[vert_levels_list[1]][0:2]
 
         # Take into account the case where the ordering of the slice is reversed compared to the ordering of the vertebral level
         if slice_min_bottom > slice_max_top:
-            slice_min = min(Z_top_level)
-            slice_max = max(Z_bottom_level)
+            slice_min = slice_min_top
+            slice_max = slice_max_bottom
         else:
-            slice_min = min(Z_bottom_level)
-            slice_max = max(Z_top_level)
+            slice_min = slice_min_bottom
+            slice_max = slice_max_top
 
         # Return the slice numbers in the right format
         return str(slice_min)+':'+str(slice_max)
@@ -994,7 +1247,8 @@ def usage(label_title, label_name, label_num, fname_tracts):
         ' sct_estimate_MAP_tracts.py -i <data> -t <tracts> -m <mode> -l <label> -z <slice> -o <output>\n' \
         '\n'\
         'MANDATORY ARGUMENTS\n' \
-        ' -i <data> : File to extract metrics from.\n' \
+        ' -i <data> : File(s) to extract metrics from. Several files can be separated by ",", e.g. -i fa.nii.gz,md.nii.gz.' \
+        ' Each volume of a 4D file is considered as a separate metric. The atlas is loaded only once for all metrics.\n' \
         '\n' \
         'OPTIONAL ARGUMENTS\n' \
         ' -l <label> : Label(s) corresponding to the tract(s) to extract the metric from. Begin at 0. ' \
@@ -1007,7 +1261,9 @@ def usage(label_title, label_name, label_num, fname_tracts):
         ' By defaults, all levels are ' \
         ' selected.'\
         ' -z <slice> : Slices to estimate the metric from. Begin at 0. Example: -z 3:6. By default, all ' \
-        ' slices are selected.\n'
+        ' slices are selected.\n' \
+        ' -b <replicates> : Number of bootstrap replicates used to estimate the 95% confidence interval of the metric. ' \
+        ' Voxels of each tract are resampled for weightedaverage, residuals for bayesian. Default = '+str(param.nb_bootstrap)+' (no bootstrap).\n'
 
 
     sys.exit(2)
@@ -1019,4 +1275,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
\ No newline at end of file
+    sct.profile(main)
@@ -41,15 +41,16 @@ except ImportError:
     print '--- numpy not installed! Exit program. ---'
     sys.exit(2)
 
-# check if dependant software are installed
-sct.check_if_installed('flirt -help','FSL')
-sct.check_if_installed('WarpImageMultiTransform -h','ANTS')
 
 #=======================================================================================================================
 # main
 #=======================================================================================================================
 def main():
     
+    # check if dependant software are installed
+    sct.check_if_installed('flirt -help','FSL')
+    sct.check_if_installed('WarpImageMultiTransform -h','ANTS')
+
     # Initialization
     fname_anat = ''
     fname_centerline = ''
@@ -107,130 +108,120 @@ def main():
     print '  Input volume ...................... '+fname_anat
     print '  Centerline ........................ '+fname_centerline
     print ''
-    
-    # Get input image orientation
-    status, output = sct.run('sct_orientation -i ' + fname_anat + ' -get')
-    input_image_orientation = output[-3:]
 
-    # Reorient input data into RL PA IS orientation
-    sct.run('sct_orientation -i '+fname_anat+' -o tmp.anat_orient.nii -orientation RPI')
-    sct.run('sct_orientation -i '+fname_centerline+' -o tmp.centerline_orient.nii -orientation RPI')
+    # Get full path (temporary files are written in a folder private to this run, see sct.workspace)
+    fname_anat = os.path.abspath(fname_anat)
+    fname_centerline = os.path.abspath(fname_centerline)
+    path_out = os.getcwd()+'/'
 
-    # Open centerline
-    #==========================================================================================
-    print '\nGet dimensions of input centerline...'
-    nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension('tmp.centerline_orient.nii')
-    print '.. matrix size: '+str(nx)+' x '+str(ny)+' x '+str(nz)
-    print '.. voxel size:  '+str(px)+'mm x '+str(py)+'mm x '+str(pz)+'mm'
-    
-    print '\nOpen centerline volume...'
-    file = nibabel.load('tmp.centerline_orient.nii')
-    data = file.get_data()
+    with sct.workspace(remove_temp_files):
+
+        # Reorient input data into RL PA IS orientation (written on disk for fslsplit)
+        input_image_orientation = sct.set_orientation(fname_anat, 'tmp.anat_orient.nii', 'RPI')
+
+        # Open centerline (reoriented in memory)
+        #==========================================================================================
+        print '\nOpen centerline volume...'
+        im = sct.Image(fname_centerline, 'RPI')
+        data = im.get_data()
+        nx, ny, nz = im.get_shape()[0:3]
+        px, py, pz = im.get_zooms()[0:3]
+        print '.. matrix size: '+str(nx)+' x '+str(ny)+' x '+str(nz)
+        print '.. voxel size:  '+str(px)+'mm x '+str(py)+'mm x '+str(pz)+'mm'
 
-    X, Y, Z = (data>0).nonzero()
-    min_z_index, max_z_index = min(Z), max(Z)
+        min_z_index, max_z_index = im.get_bounding_box()[2]
     
     
-    # loop across z and associate x,y coordinate with the point having maximum intensity
-    x_centerline = [0 for iz in range(min_z_index, max_z_index+1, 1)]
-    y_centerline = [0 for iz in range(min_z_index, max_z_index+1, 1)]
-    z_centerline = [iz for iz in range(min_z_index, max_z_index+1, 1)]
+        # loop across z and associate x,y coordinate with the point having maximum intensity
+        x_centerline = [0 for iz in range(min_z_index, max_z_index+1, 1)]
+        y_centerline = [0 for iz in range(min_z_index, max_z_index+1, 1)]
+        z_centerline = [iz for iz in range(min_z_index, max_z_index+1, 1)]
 
-    # Two possible scenario:
-    # 1. the centerline is probabilistic: each slices contains voxels with the probability of containing the centerline [0:...:1]
-    # We only take the maximum value of the image to aproximate the centerline.
-    # 2. The centerline/segmentation image contains many pixels per slice with values {0,1}.
-    # We take all the points and approximate the centerline on all these points.
+        # Two possible scenario:
+        # 1. the centerline is probabilistic: each slices contains voxels with the probability of containing the centerline [0:...:1]
+        # We only take the maximum value of the image to aproximate the centerline.
+        # 2. The centerline/segmentation image contains many pixels per slice with values {0,1}.
+        # We take all the points and approximate the centerline on all these points.
 
-    X, Y, Z = ((data<1)*(data>0)).nonzero() # X is empty if binary image
-    if (len(X) > 0): # Scenario 1
-        for iz in range(min_z_index, max_z_index+1, 1):
-            x_centerline[iz-min_z_index], y_centerline[iz-min_z_index] = numpy.unravel_index(data[:,:,iz].argmax(), data[:,:,iz].shape)
-    else: # Scenario 2
-        for iz in range(min_z_index, max_z_index+1, 1):
-            x_seg, y_seg = (data[:,:,iz]>0).nonzero()
-            if len(x_seg) > 0:
-                x_centerline[iz-min_z_index] = numpy.mean(x_seg)
-                y_centerline[iz-min_z_index] = numpy.mean(y_seg)
-
-    # TODO: find a way to do the previous loop with this, which is more neat:
-    # [numpy.unravel_index(data[:,:,iz].argmax(), data[:,:,iz].shape) for iz in range(0,nz,1)]
+        if ((data<1)*(data>0)).any(): # Scenario 1 (False if binary image)
+            x_max, y_max = im.get_max_per_slice()
+            x_centerline = list(x_max[min_z_index:max_z_index+1])
+            y_centerline = list(y_max[min_z_index:max_z_index+1])
+        else: # Scenario 2 (slices without point stay at 0)
+            for iz, x, y in zip(*im.get_centroids()):
+                x_centerline[iz-min_z_index] = x
+                y_centerline[iz-min_z_index] = y
     
-    # clear variable
-    del data
+        # clear variable
+        del data
     
-    # Fit the centerline points with the kind of curve given as argument of the script and return the new smoothed coordinates
-    if centerline_fitting == 'splines':
-        x_centerline_fit, y_centerline_fit = b_spline_centerline(x_centerline,y_centerline,z_centerline)
-    elif centerline_fitting == 'polynome':
-        x_centerline_fit, y_centerline_fit = polynome_centerline(x_centerline,y_centerline,z_centerline)
+        # Fit the centerline points with the kind of curve given as argument of the script and return the new smoothed coordinates
+        if centerline_fitting == 'splines':
+            x_centerline_fit, y_centerline_fit = b_spline_centerline(x_centerline,y_centerline,z_centerline)
+        elif centerline_fitting == 'polynome':
+            x_centerline_fit, y_centerline_fit = polynome_centerline(x_centerline,y_centerline,z_centerline)
 
-    #==========================================================================================
-    # Split input volume
-    print '\nSplit input volume...'
-    sct.run(sct.fsloutput + 'fslsplit tmp.anat_orient.nii tmp.anat_z -z')
-    file_anat_split = ['tmp.anat_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        #==========================================================================================
+        # Split input volume
+        print '\nSplit input volume...'
+        sct.run(sct.fsloutput + 'fslsplit tmp.anat_orient.nii tmp.anat_z -z')
+        file_anat_split = ['tmp.anat_z'+str(z).zfill(4) for z in range(0,nz,1)]
 
-    # initialize variables
-    file_mat_inv_cumul = ['tmp.mat_inv_cumul_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    z_init = min_z_index
-    displacement_max_z_index = x_centerline_fit[z_init-min_z_index]-x_centerline_fit[max_z_index-min_z_index]
+        # initialize variables
+        file_mat_inv_cumul = ['tmp.mat_inv_cumul_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        z_init = min_z_index
+        displacement_max_z_index = x_centerline_fit[z_init-min_z_index]-x_centerline_fit[max_z_index-min_z_index]
 
-    # write centerline as text file
-    print '\nGenerate fitted transformation matrices...'
-    file_mat_inv_cumul_fit = ['tmp.mat_inv_cumul_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    for iz in range(min_z_index, max_z_index+1, 1):
-        # compute inverse cumulative fitted transformation matrix
-        fid = open(file_mat_inv_cumul_fit[iz], 'w')
-        if (x_centerline[iz-min_z_index] == 0 and y_centerline[iz-min_z_index] == 0):
-            displacement = 0
-        else:
-            displacement = x_centerline_fit[z_init-min_z_index]-x_centerline_fit[iz-min_z_index]
-        fid.write('%i %i %i %f\n' %(1, 0, 0, displacement) )
-        fid.write('%i %i %i %f\n' %(0, 1, 0, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
-        fid.close()
-
-    # we complete the displacement matrix in z direction
-    for iz in range(0, min_z_index, 1):
-        fid = open(file_mat_inv_cumul_fit[iz], 'w')
-        fid.write('%i %i %i %f\n' %(1, 0, 0, 0) )
-        fid.write('%i %i %i %f\n' %(0, 1, 0, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
-        fid.close()
-    for iz in range(max_z_index+1, nz, 1):
-        fid = open(file_mat_inv_cumul_fit[iz], 'w')
-        fid.write('%i %i %i %f\n' %(1, 0, 0, displacement_max_z_index) )
-        fid.write('%i %i %i %f\n' %(0, 1, 0, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
-        fid.close()
+        # write centerline as text file
+        print '\nGenerate fitted transformation matrices...'
+        file_mat_inv_cumul_fit = ['tmp.mat_inv_cumul_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        for iz in range(min_z_index, max_z_index+1, 1):
+            # compute inverse cumulative fitted transformation matrix
+            fid = open(file_mat_inv_cumul_fit[iz], 'w')
+            if (x_centerline[iz-min_z_index] == 0 and y_centerline[iz-min_z_index] == 0):
+                displacement = 0
+            else:
+                displacement = x_centerline_fit[z_init-min_z_index]-x_centerline_fit[iz-min_z_index]
+            fid.write('%i %i %i %f\n' %(1, 0, 0, displacement) )
+            fid.write('%i %i %i %f\n' %(0, 1, 0, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
+            fid.close()
 
-    # apply transformations to data
-    print '\nApply fitted transformation matrices...'
-    file_anat_split_fit = ['tmp.anat_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    for iz in range(0, nz, 1):
-        # forward cumulative transformation to data
-        sct.run(fsloutput+'flirt -in '+file_anat_split[iz]+' -ref '+file_anat_split[iz]+' -applyxfm -init '+file_mat_inv_cumul_fit[iz]+' -out '+file_anat_split_fit[iz]+' -interp '+interp)
+        # we complete the displacement matrix in z direction
+        for iz in range(0, min_z_index, 1):
+            fid = open(file_mat_inv_cumul_fit[iz], 'w')
+            fid.write('%i %i %i %f\n' %(1, 0, 0, 0) )
+            fid.write('%i %i %i %f\n' %(0, 1, 0, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
+            fid.close()
+        for iz in range(max_z_index+1, nz, 1):
+            fid = open(file_mat_inv_cumul_fit[iz], 'w')
+            fid.write('%i %i %i %f\n' %(1, 0, 0, displacement_max_z_index) )
+            fid.write('%i %i %i %f\n' %(0, 1, 0, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
+            fid.close()
 
-    # Merge into 4D volume
-    print '\nMerge into 4D volume...'
-    sct.run(fsloutput+'fslmerge -z tmp.anat_orient_fit tmp.anat_orient_fit_z*')
+        # apply transformations to data
+        print '\nApply fitted transformation matrices...'
+        file_anat_split_fit = ['tmp.anat_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        for iz in range(0, nz, 1):
+            # forward cumulative transformation to data
+            sct.run(fsloutput+'flirt -in '+file_anat_split[iz]+' -ref '+file_anat_split[iz]+' -applyxfm -init '+file_mat_inv_cumul_fit[iz]+' -out '+file_anat_split_fit[iz]+' -interp '+interp)
 
-    # Reorient data as it was before
-    print '\nReorient data back into native orientation...'
-    sct.run('sct_orientation -i tmp.anat_orient_fit.nii -o tmp.anat_orient_fit_reorient.nii -orientation '+input_image_orientation)
+        # Merge into 4D volume
+        print '\nMerge into 4D volume...'
+        sct.run(fsloutput+'fslmerge -z tmp.anat_orient_fit tmp.anat_orient_fit_z*')
 
-    # Generate output file (in current folder)
-    print '\nGenerate output file (in current folder)...'
-    sct.generate_output_file('tmp.anat_orient_fit_reorient.nii','./',file_anat+'_flatten',ext_anat)
+        # Reorient data as it was before
+        print '\nReorient data back into native orientation...'
+        sct.set_orientation('tmp.anat_orient_fit.nii', 'tmp.anat_orient_fit_reorient.nii', input_image_orientation)
 
-    # Delete temporary files
-    if remove_temp_files == 1:
-        print '\nDelete temporary files...'
-        sct.run('rm tmp.*')
+        # Generate output file (in current folder)
+        print '\nGenerate output file (in current folder)...'
+        sct.generate_output_file('tmp.anat_orient_fit_reorient.nii',path_out,file_anat+'_flatten',ext_anat)
 
     # to view results
     print '\nDone! To view results, type:'
@@ -307,4 +298,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
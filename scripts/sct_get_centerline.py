@@ -90,15 +90,15 @@ except ImportError:
     print '--- numpy not installed! Exit program. ---'
     sys.exit(2)
 
-# check if dependant software are installed
-sct.check_if_installed('flirt -help','FSL')
-
 
 #=======================================================================================================================
 # main
 #=======================================================================================================================
 def main():
 
+    # check if dependant software are installed
+    sct.check_if_installed('flirt -help','FSL')
+
     # Initialization
     fname_anat = ''
     fname_point = ''
@@ -156,8 +156,7 @@ def main():
     file_schedule = path_script[0:-8]+'flirtsch/' + param.schedule_file
 
     # Get input image orientation
-    status, output = sct.run('sct_orientation -i ' + fname_anat + ' -get')
-    input_image_orientation = output[-3:]
+    input_image_orientation = sct.get_orientation(fname_anat)
 
     # Display arguments
     print '\nCheck input arguments...'
@@ -168,282 +167,289 @@ def main():
     print '  Gaussian kernel:      '+str(gaussian_kernel)
     print '  Degree of polynomial: '+str(param.deg_poly)
 
-    # convert to nii
-    print '\nCopy input data...'
-    sct.run('cp ' + fname_anat + ' tmp.anat'+ext_anat)
-    sct.run('fslchfiletype NIFTI tmp.anat')
-    sct.run('cp ' + fname_point + ' tmp.point'+ext_point)
-    sct.run('fslchfiletype NIFTI tmp.point')
-
-    # Reorient input anatomical volume into RL PA IS orientation
-    print '\nReorient input volume to RL PA IS orientation...'
-    sct.run(sct.fsloutput + 'fslswapdim tmp.anat RL PA IS tmp.anat_orient')
-
-    # Reorient binary point into RL PA IS orientation
-    print '\nReorient binary point into RL PA IS orientation...'
-    sct.run(sct.fsloutput + 'fslswapdim tmp.point RL PA IS tmp.point_orient')
-
-    # Get image dimensions
-    print '\nGet image dimensions...'
-    nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension('tmp.anat_orient')
-    print '.. matrix size: '+str(nx)+' x '+str(ny)+' x '+str(nz)
-    print '.. voxel size:  '+str(px)+'mm x '+str(py)+'mm x '+str(pz)+'mm'
-
-    # Split input volume
-    print '\nSplit input volume...'
-    sct.run(sct.fsloutput + 'fslsplit tmp.anat_orient tmp.anat_orient_z -z')
-    file_anat_split = ['tmp.anat_orient_z'+str(z).zfill(4) for z in range(0,nz,1)]
-
-    # Get the coordinates of the input point
-    print '\nGet the coordinates of the input point...'
-    file = nibabel.load('tmp.point_orient.nii')
-    data = file.get_data()
-    x_init, y_init, z_init = (data > 0).nonzero()
-    x_init = x_init[0]
-    y_init = y_init[0]
-    z_init = z_init[0]
-    print '('+str(x_init)+', '+str(y_init)+', '+str(z_init)+')'
-
-    # Extract the slice corresponding to z=z_init
-    print '\nExtract the slice corresponding to z='+str(z_init)+'...'
-    file_point_split = ['tmp.point_orient_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    sct.run(sct.fsloutput+'fslroi tmp.point_orient '+file_point_split[z_init]+' 0 -1 0 -1 '+str(z_init)+' 1')
-
-    # Create gaussian mask from point
-    print '\nCreate gaussian mask from point...'
-    file_mask_split = ['tmp.mask_orient_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    sct.run(sct.fsloutput+'fslmaths '+file_point_split[z_init]+' -s '+str(gaussian_kernel)+' '+file_mask_split[z_init])
-
-    # Obtain max value from mask
-    print '\nFind maximum value from mask...'
-    file = nibabel.load(file_mask_split[z_init]+'.nii')
-    data = file.get_data()
-    max_value_mask = numpy.max(data)
-    print '..'+str(max_value_mask)
-
-    # Normalize mask beween 0 and 1
-    print '\nNormalize mask beween 0 and 1...'
-    sct.run(sct.fsloutput+'fslmaths '+file_mask_split[z_init]+' -div '+str(max_value_mask)+' '+file_mask_split[z_init])
-
-    ## Take the square of the mask
-    #print '\nCalculate the square of the mask...'
-    #sct.run(sct.fsloutput+'fslmaths '+file_mask_split[z_init]+' -mul '+file_mask_split[z_init]+' '+file_mask_split[z_init])
-
-    # initialize variables
-    file_mat = ['tmp.mat_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    file_mat_inv = ['tmp.mat_inv_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    file_mat_inv_cumul = ['tmp.mat_inv_cumul_z'+str(z).zfill(4) for z in range(0,nz,1)]
-
-    # create identity matrix for initial transformation matrix
-    fid = open(file_mat_inv_cumul[z_init], 'w')
-    fid.write('%i %i %i %i\n' %(1, 0, 0, 0) )
-    fid.write('%i %i %i %i\n' %(0, 1, 0, 0) )
-    fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
-    fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
-    fid.close()
-
-    # initialize centerline: give value corresponding to initial point
-    x_centerline = [x_init]
-    y_centerline = [y_init]
-    z_centerline = [z_init]
-    warning_count = 0
-
-    # go up (1), then down (2) in reference to the binary point
-    for iUpDown in range(1, 3):
-
-        if iUpDown == 1:
-            # z increases
-            slice_gap_signed = slice_gap
-        elif iUpDown == 2:
-            # z decreases
-            slice_gap_signed = -slice_gap
-            # reverse centerline (because values will be appended at the end)
-            x_centerline.reverse()
-            y_centerline.reverse()
-            z_centerline.reverse()
-
-        # initialization before looping
-        z_dest = z_init # point given by user
-        z_src = z_dest + slice_gap_signed
-
-        # continue looping if 0 < z < nz
-        while 0 <= z_src and z_src <= nz-1:
-
-            # print current z:
-            print 'z='+str(z_src)+':'
-
-            # estimate transformation
-            sct.run(fsloutput+'flirt -in '+file_anat_split[z_src]+' -ref '+file_anat_split[z_dest]+' -schedule '+file_schedule+ ' -verbose 0 -omat '+file_mat[z_src]+' -cost normcorr -forcescaling -inweight '+file_mask_split[z_dest]+' -refweight '+file_mask_split[z_dest])
-
-            # display transfo
-            status, output = sct.run('cat '+file_mat[z_src])
-            print output
-
-            # check if transformation is bigger than 1.5x slice_gap
-            tx = float(output.split()[3])
-            ty = float(output.split()[7])
-            norm_txy = numpy.linalg.norm([tx, ty],ord=2)
-            if norm_txy > 1.5*slice_gap:
-                print 'WARNING: Transformation is too large --> using previous one.'
-                warning_count = warning_count + 1
-                # if previous transformation exists, replace current one with previous one
-                if os.path.isfile(file_mat[z_dest]):
-                    sct.run('cp '+file_mat[z_dest]+' '+file_mat[z_src])
-
-            # estimate inverse transformation matrix
-            sct.run('convert_xfm -omat '+file_mat_inv[z_src]+' -inverse '+file_mat[z_src])
-
-            # compute cumulative transformation
-            sct.run('convert_xfm -omat '+file_mat_inv_cumul[z_src]+' -concat '+file_mat_inv[z_src]+' '+file_mat_inv_cumul[z_dest])
-
-            # apply inverse cumulative transformation to initial gaussian mask (to put it in src space)
-            sct.run(fsloutput+'flirt -in '+file_mask_split[z_init]+' -ref '+file_mask_split[z_init]+' -applyxfm -init '+file_mat_inv_cumul[z_src]+' -out '+file_mask_split[z_src])
-
-            # open inverse cumulative transformation file and generate centerline
-            fid = open(file_mat_inv_cumul[z_src])
-            mat = fid.read().split()
-            x_centerline.append(x_init + float(mat[3]))
-            y_centerline.append(y_init + float(mat[7]))
-            z_centerline.append(z_src)
-            #z_index = z_index+1
-
-            # define new z_dest (target slice) and new z_src (moving slice)
-            z_dest = z_dest + slice_gap_signed
-            z_src = z_src + slice_gap_signed
-
-
-    # Reconstruct centerline
-    # ====================================================================================================
-
-    # reverse back centerline (because it's been reversed once, so now all values are in the right order)
-    x_centerline.reverse()
-    y_centerline.reverse()
-    z_centerline.reverse()
-
-    # fit centerline in the Z-X plane using polynomial function
-    print '\nFit centerline in the Z-X plane using polynomial function...'
-    coeffsx = numpy.polyfit(z_centerline, x_centerline, deg=param.deg_poly)
-    polyx = numpy.poly1d(coeffsx)
-    x_centerline_fit = numpy.polyval(polyx, z_centerline)
-    # calculate RMSE
-    rmse = numpy.linalg.norm(x_centerline_fit-x_centerline)/numpy.sqrt( len(x_centerline) )
-    # calculate max absolute error
-    max_abs = numpy.max( numpy.abs(x_centerline_fit-x_centerline) )
-    print '.. RMSE (in mm): '+str(rmse*px)
-    print '.. Maximum absolute error (in mm): '+str(max_abs*px)
-
-    # fit centerline in the Z-Y plane using polynomial function
-    print '\nFit centerline in the Z-Y plane using polynomial function...'
-    coeffsy = numpy.polyfit(z_centerline, y_centerline, deg=param.deg_poly)
-    polyy = numpy.poly1d(coeffsy)
-    y_centerline_fit = numpy.polyval(polyy, z_centerline)
-    # calculate RMSE
-    rmse = numpy.linalg.norm(y_centerline_fit-y_centerline)/numpy.sqrt( len(y_centerline) )
-    # calculate max absolute error
-    max_abs = numpy.max( numpy.abs(y_centerline_fit-y_centerline) )
-    print '.. RMSE (in mm): '+str(rmse*py)
-    print '.. Maximum absolute error (in mm): '+str(max_abs*py)
-
-    # display
-    if param.debug == 1:
-        plt.figure()
-        plt.plot(z_centerline,x_centerline,'.',z_centerline,x_centerline_fit,'r')
-        plt.legend(['Data','Polynomial Fit'])
-        plt.title('Z-X plane polynomial interpolation')
-        plt.show()
-
-        plt.figure()
-        plt.plot(z_centerline,y_centerline,'.',z_centerline,y_centerline_fit,'r')
-        plt.legend(['Data','Polynomial Fit'])
-        plt.title('Z-Y plane polynomial interpolation')
-        plt.show()
-
-    # generate full range z-values for centerline
-    z_centerline_full = [iz for iz in range(0, nz, 1)]
-
-    # calculate X and Y values for the full centerline
-    x_centerline_fit_full = numpy.polyval(polyx, z_centerline_full)
-    y_centerline_fit_full = numpy.polyval(polyy, z_centerline_full)
-
-    # Generate fitted transformation matrices and write centerline coordinates in text file
-    print '\nGenerate fitted transformation matrices and write centerline coordinates in text file...'
-    file_mat_inv_cumul_fit = ['tmp.mat_inv_cumul_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    file_mat_cumul_fit = ['tmp.mat_cumul_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    fid_centerline = open('tmp.centerline_coordinates.txt', 'w')
-    for iz in range(0, nz, 1):
-        # compute inverse cumulative fitted transformation matrix
-        fid = open(file_mat_inv_cumul_fit[iz], 'w')
-        fid.write('%i %i %i %f\n' %(1, 0, 0, x_centerline_fit_full[iz]-x_init) )
-        fid.write('%i %i %i %f\n' %(0, 1, 0, y_centerline_fit_full[iz]-y_init) )
-        fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
-        fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
-        fid.close()
-        # compute forward cumulative fitted transformation matrix
-        sct.run('convert_xfm -omat '+file_mat_cumul_fit[iz]+' -inverse '+file_mat_inv_cumul_fit[iz])
-        # write centerline coordinates in x, y, z format
-        fid_centerline.write('%f %f %f\n' %(x_centerline_fit_full[iz], y_centerline_fit_full[iz], z_centerline_full[iz]) )
-    fid_centerline.close()
-
-
-    # Prepare output data
-    # ====================================================================================================
-
-    # write centerline as text file
-    for iz in range(0, nz, 1):
-        # compute inverse cumulative fitted transformation matrix
-        fid = open(file_mat_inv_cumul_fit[iz], 'w')
-        fid.write('%i %i %i %f\n' %(1, 0, 0, x_centerline_fit_full[iz]-x_init) )
-        fid.write('%i %i %i %f\n' %(0, 1, 0, y_centerline_fit_full[iz]-y_init) )
+    # Get full path (temporary files are written in a folder private to this run, see sct.workspace)
+    fname_anat = os.path.abspath(fname_anat)
+    fname_point = os.path.abspath(fname_point)
+    file_schedule = os.path.abspath(file_schedule)
+    path_out = os.getcwd()+'/'
+
+    with sct.workspace(remove_temp_files):
+
+        # convert to nii
+        print '\nCopy input data...'
+        sct.run('cp ' + fname_anat + ' tmp.anat'+ext_anat)
+        sct.run('fslchfiletype NIFTI tmp.anat')
+        sct.run('cp ' + fname_point + ' tmp.point'+ext_point)
+        sct.run('fslchfiletype NIFTI tmp.point')
+
+        # Reorient input anatomical volume into RL PA IS orientation
+        print '\nReorient input volume to RL PA IS orientation...'
+        sct.run(sct.fsloutput + 'fslswapdim tmp.anat RL PA IS tmp.anat_orient')
+
+        # Reorient binary point into RL PA IS orientation
+        print '\nReorient binary point into RL PA IS orientation...'
+        sct.run(sct.fsloutput + 'fslswapdim tmp.point RL PA IS tmp.point_orient')
+
+        # Get image dimensions
+        print '\nGet image dimensions...'
+        nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension('tmp.anat_orient')
+        print '.. matrix size: '+str(nx)+' x '+str(ny)+' x '+str(nz)
+        print '.. voxel size:  '+str(px)+'mm x '+str(py)+'mm x '+str(pz)+'mm'
+
+        sct.step('preprocessing')
+        # Split input volume
+        print '\nSplit input volume...'
+        sct.run(sct.fsloutput + 'fslsplit tmp.anat_orient tmp.anat_orient_z -z')
+        file_anat_split = ['tmp.anat_orient_z'+str(z).zfill(4) for z in range(0,nz,1)]
+
+        # Get the coordinates of the input point
+        print '\nGet the coordinates of the input point...'
+        file = nibabel.load('tmp.point_orient.nii')
+        data = file.get_data()
+        x_init, y_init, z_init = (data > 0).nonzero()
+        x_init = x_init[0]
+        y_init = y_init[0]
+        z_init = z_init[0]
+        print '('+str(x_init)+', '+str(y_init)+', '+str(z_init)+')'
+
+        # Extract the slice corresponding to z=z_init
+        print '\nExtract the slice corresponding to z='+str(z_init)+'...'
+        file_point_split = ['tmp.point_orient_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        sct.run(sct.fsloutput+'fslroi tmp.point_orient '+file_point_split[z_init]+' 0 -1 0 -1 '+str(z_init)+' 1')
+
+        # Create gaussian mask from point
+        print '\nCreate gaussian mask from point...'
+        file_mask_split = ['tmp.mask_orient_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        sct.run(sct.fsloutput+'fslmaths '+file_point_split[z_init]+' -s '+str(gaussian_kernel)+' '+file_mask_split[z_init])
+
+        # Obtain max value from mask
+        print '\nFind maximum value from mask...'
+        file = nibabel.load(file_mask_split[z_init]+'.nii')
+        data = file.get_data()
+        max_value_mask = numpy.max(data)
+        print '..'+str(max_value_mask)
+
+        # Normalize mask beween 0 and 1
+        print '\nNormalize mask beween 0 and 1...'
+        sct.run(sct.fsloutput+'fslmaths '+file_mask_split[z_init]+' -div '+str(max_value_mask)+' '+file_mask_split[z_init])
+
+        ## Take the square of the mask
+        #print '\nCalculate the square of the mask...'
+        #sct.run(sct.fsloutput+'fslmaths '+file_mask_split[z_init]+' -mul '+file_mask_split[z_init]+' '+file_mask_split[z_init])
+
+        sct.step('slice-by-slice registration')
+        # initialize variables
+        file_mat = ['tmp.mat_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        file_mat_inv = ['tmp.mat_inv_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        file_mat_inv_cumul = ['tmp.mat_inv_cumul_z'+str(z).zfill(4) for z in range(0,nz,1)]
+
+        # create identity matrix for initial transformation matrix
+        fid = open(file_mat_inv_cumul[z_init], 'w')
+        fid.write('%i %i %i %i\n' %(1, 0, 0, 0) )
+        fid.write('%i %i %i %i\n' %(0, 1, 0, 0) )
         fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
         fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
         fid.close()
 
-    # write polynomial coefficients
-    numpy.savetxt('tmp.centerline_polycoeffs_x.txt',coeffsx)
-    numpy.savetxt('tmp.centerline_polycoeffs_y.txt',coeffsy)
-
-    # apply transformations to data
-    print '\nApply fitted transformation matrices...'
-    file_anat_split_fit = ['tmp.anat_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    file_mask_split_fit = ['tmp.mask_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    file_point_split_fit = ['tmp.point_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
-    for iz in range(0, nz, 1):
-        # forward cumulative transformation to data
-        sct.run(fsloutput+'flirt -in '+file_anat_split[iz]+' -ref '+file_anat_split[iz]+' -applyxfm -init '+file_mat_cumul_fit[iz]+' -out '+file_anat_split_fit[iz])
-        # inverse cumulative transformation to mask
-        sct.run(fsloutput+'flirt -in '+file_mask_split[z_init]+' -ref '+file_mask_split[z_init]+' -applyxfm -init '+file_mat_inv_cumul_fit[iz]+' -out '+file_mask_split_fit[iz])
-        # inverse cumulative transformation to point
-        sct.run(fsloutput+'flirt -in '+file_point_split[z_init]+' -ref '+file_point_split[z_init]+' -applyxfm -init '+file_mat_inv_cumul_fit[iz]+' -out '+file_point_split_fit[iz]+' -interp nearestneighbour')
-
-    # Merge into 4D volume
-    print '\nMerge into 4D volume...'
-    sct.run(fsloutput+'fslmerge -z tmp.anat_orient_fit tmp.anat_orient_fit_z*')
-    sct.run(fsloutput+'fslmerge -z tmp.mask_orient_fit tmp.mask_orient_fit_z*')
-    sct.run(fsloutput+'fslmerge -z tmp.point_orient_fit tmp.point_orient_fit_z*')
-
-    # Copy header geometry from input data
-    print '\nCopy header geometry from input data...'
-    sct.run(fsloutput+'fslcpgeom tmp.anat_orient.nii tmp.anat_orient_fit.nii ')
-    sct.run(fsloutput+'fslcpgeom tmp.anat_orient.nii tmp.mask_orient_fit.nii ')
-    sct.run(fsloutput+'fslcpgeom tmp.anat_orient.nii tmp.point_orient_fit.nii ')
-
-    # Generate output file (in current folder)
-    print '\nGenerate output file (in current folder)...'
-    #sct.generate_output_file('tmp.centerline_polycoeffs_x.txt','./','centerline_polycoeffs_x','.txt')
-    #sct.generate_output_file('tmp.centerline_polycoeffs_y.txt','./','centerline_polycoeffs_y','.txt')
-    #sct.generate_output_file('tmp.centerline_coordinates.txt','./','centerline_coordinates','.txt')
-    sct.generate_output_file('tmp.anat_orient.nii','./',file_anat+'_rpi',ext_anat)
-    sct.generate_output_file('tmp.anat_orient_fit.nii','./',file_anat+'_rpi_align',ext_anat)
-    sct.generate_output_file('tmp.mask_orient_fit.nii','./',file_anat+'_mask',ext_anat)
-    fname_output_centerline = sct.generate_output_file('tmp.point_orient_fit.nii','./',file_anat+'_centerline',ext_anat)
-    # Reorient the centerline into the initial orientation of the input image
-    print '\nReorient the centerline into the initial orientation of the input image...'
-    sct.run('sct_orientation -i '+fname_output_centerline+' -o ' +fname_output_centerline+' -orientation '+input_image_orientation)
-
-    # Delete temporary files
-    if remove_temp_files == 1:
-        print '\nDelete temporary files...'
-        sct.run('rm tmp.*')
+        # initialize centerline: give value corresponding to initial point
+        x_centerline = [x_init]
+        y_centerline = [y_init]
+        z_centerline = [z_init]
+        warning_count = 0
+
+        # go up (1), then down (2) in reference to the binary point
+        for iUpDown in range(1, 3):
+
+            if iUpDown == 1:
+                # z increases
+                slice_gap_signed = slice_gap
+            elif iUpDown == 2:
+                # z decreases
+                slice_gap_signed = -slice_gap
+                # reverse centerline (because values will be appended at the end)
+                x_centerline.reverse()
+                y_centerline.reverse()
+                z_centerline.reverse()
+
+            # initialization before looping
+            z_dest = z_init # point given by user
+            z_src = z_dest + slice_gap_signed
+
+            # continue looping if 0 < z < nz
+            while 0 <= z_src and z_src <= nz-1:
+
+                # print current z:
+                print 'z='+str(z_src)+':'
+
+                # estimate transformation
+                sct.run(fsloutput+'flirt -in '+file_anat_split[z_src]+' -ref '+file_anat_split[z_dest]+' -schedule '+file_schedule+ ' -verbose 0 -omat '+file_mat[z_src]+' -cost normcorr -forcescaling -inweight '+file_mask_split[z_dest]+' -refweight '+file_mask_split[z_dest])
+
+                # display transfo
+                status, output = sct.run('cat '+file_mat[z_src])
+                print output
+
+                # check if transformation is bigger than 1.5x slice_gap
+                tx = float(output.split()[3])
+                ty = float(output.split()[7])
+                norm_txy = numpy.linalg.norm([tx, ty],ord=2)
+                if norm_txy > 1.5*slice_gap:
+                    print 'WARNING: Transformation is too large --> using previous one.'
+                    warning_count = warning_count + 1
+                    # if previous transformation exists, replace current one with previous one
+                    if os.path.isfile(file_mat[z_dest]):
+                        sct.run('cp '+file_mat[z_dest]+' '+file_mat[z_src])
+
+                # estimate inverse transformation matrix
+                sct.run('convert_xfm -omat '+file_mat_inv[z_src]+' -inverse '+file_mat[z_src])
+
+                # compute cumulative transformation
+                sct.run('convert_xfm -omat '+file_mat_inv_cumul[z_src]+' -concat '+file_mat_inv[z_src]+' '+file_mat_inv_cumul[z_dest])
+
+                # apply inverse cumulative transformation to initial gaussian mask (to put it in src space)
+                sct.run(fsloutput+'flirt -in '+file_mask_split[z_init]+' -ref '+file_mask_split[z_init]+' -applyxfm -init '+file_mat_inv_cumul[z_src]+' -out '+file_mask_split[z_src])
+
+                # open inverse cumulative transformation file and generate centerline
+                fid = open(file_mat_inv_cumul[z_src])
+                mat = fid.read().split()
+                x_centerline.append(x_init + float(mat[3]))
+                y_centerline.append(y_init + float(mat[7]))
+                z_centerline.append(z_src)
+                #z_index = z_index+1
+
+                # define new z_dest (target slice) and new z_src (moving slice)
+                z_dest = z_dest + slice_gap_signed
+                z_src = z_src + slice_gap_signed
+
+
+        sct.step('centerline fit')
+        # Reconstruct centerline
+        # ====================================================================================================
+
+        # reverse back centerline (because it's been reversed once, so now all values are in the right order)
+        x_centerline.reverse()
+        y_centerline.reverse()
+        z_centerline.reverse()
+
+        # fit centerline in the Z-X plane using polynomial function
+        print '\nFit centerline in the Z-X plane using polynomial function...'
+        coeffsx = numpy.polyfit(z_centerline, x_centerline, deg=param.deg_poly)
+        polyx = numpy.poly1d(coeffsx)
+        x_centerline_fit = numpy.polyval(polyx, z_centerline)
+        # calculate RMSE
+        rmse = numpy.linalg.norm(x_centerline_fit-x_centerline)/numpy.sqrt( len(x_centerline) )
+        # calculate max absolute error
+        max_abs = numpy.max( numpy.abs(x_centerline_fit-x_centerline) )
+        print '.. RMSE (in mm): '+str(rmse*px)
+        print '.. Maximum absolute error (in mm): '+str(max_abs*px)
+
+        # fit centerline in the Z-Y plane using polynomial function
+        print '\nFit centerline in the Z-Y plane using polynomial function...'
+        coeffsy = numpy.polyfit(z_centerline, y_centerline, deg=param.deg_poly)
+        polyy = numpy.poly1d(coeffsy)
+        y_centerline_fit = numpy.polyval(polyy, z_centerline)
+        # calculate RMSE
+        rmse = numpy.linalg.norm(y_centerline_fit-y_centerline)/numpy.sqrt( len(y_centerline) )
+        # calculate max absolute error
+        max_abs = numpy.max( numpy.abs(y_centerline_fit-y_centerline) )
+        print '.. RMSE (in mm): '+str(rmse*py)
+        print '.. Maximum absolute error (in mm): '+str(max_abs*py)
+
+        # display
+        if param.debug == 1:
+            plt.figure()
+            plt.plot(z_centerline,x_centerline,'.',z_centerline,x_centerline_fit,'r')
+            plt.legend(['Data','Polynomial Fit'])
+            plt.title('Z-X plane polynomial interpolation')
+            plt.show()
+
+            plt.figure()
+            plt.plot(z_centerline,y_centerline,'.',z_centerline,y_centerline_fit,'r')
+            plt.legend(['Data','Polynomial Fit'])
+            plt.title('Z-Y plane polynomial interpolation')
+            plt.show()
+
+        # generate full range z-values for centerline
+        z_centerline_full = [iz for iz in range(0, nz, 1)]
+
+        # calculate X and Y values for the full centerline
+        x_centerline_fit_full = numpy.polyval(polyx, z_centerline_full)
+        y_centerline_fit_full = numpy.polyval(polyy, z_centerline_full)
+
+        # Generate fitted transformation matrices and write centerline coordinates in text file
+        print '\nGenerate fitted transformation matrices and write centerline coordinates in text file...'
+        file_mat_inv_cumul_fit = ['tmp.mat_inv_cumul_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        file_mat_cumul_fit = ['tmp.mat_cumul_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        fid_centerline = open('tmp.centerline_coordinates.txt', 'w')
+        for iz in range(0, nz, 1):
+            # compute inverse cumulative fitted transformation matrix
+            fid = open(file_mat_inv_cumul_fit[iz], 'w')
+            fid.write('%i %i %i %f\n' %(1, 0, 0, x_centerline_fit_full[iz]-x_init) )
+            fid.write('%i %i %i %f\n' %(0, 1, 0, y_centerline_fit_full[iz]-y_init) )
+            fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
+            fid.close()
+            # compute forward cumulative fitted transformation matrix
+            sct.run('convert_xfm -omat '+file_mat_cumul_fit[iz]+' -inverse '+file_mat_inv_cumul_fit[iz])
+            # write centerline coordinates in x, y, z format
+            fid_centerline.write('%f %f %f\n' %(x_centerline_fit_full[iz], y_centerline_fit_full[iz], z_centerline_full[iz]) )
+        fid_centerline.close()
+
+
+        sct.step('output')
+        # Prepare output data
+        # ====================================================================================================
+
+        # write centerline as text file
+        for iz in range(0, nz, 1):
+            # compute inverse cumulative fitted transformation matrix
+            fid = open(file_mat_inv_cumul_fit[iz], 'w')
+            fid.write('%i %i %i %f\n' %(1, 0, 0, x_centerline_fit_full[iz]-x_init) )
+            fid.write('%i %i %i %f\n' %(0, 1, 0, y_centerline_fit_full[iz]-y_init) )
+            fid.write('%i %i %i %i\n' %(0, 0, 1, 0) )
+            fid.write('%i %i %i %i\n' %(0, 0, 0, 1) )
+            fid.close()
+
+        # write polynomial coefficients
+        numpy.savetxt('tmp.centerline_polycoeffs_x.txt',coeffsx)
+        numpy.savetxt('tmp.centerline_polycoeffs_y.txt',coeffsy)
+
+        # apply transformations to data
+        print '\nApply fitted transformation matrices...'
+        file_anat_split_fit = ['tmp.anat_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        file_mask_split_fit = ['tmp.mask_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        file_point_split_fit = ['tmp.point_orient_fit_z'+str(z).zfill(4) for z in range(0,nz,1)]
+        for iz in range(0, nz, 1):
+            # forward cumulative transformation to data
+            sct.run(fsloutput+'flirt -in '+file_anat_split[iz]+' -ref '+file_anat_split[iz]+' -applyxfm -init '+file_mat_cumul_fit[iz]+' -out '+file_anat_split_fit[iz])
+            # inverse cumulative transformation to mask
+            sct.run(fsloutput+'flirt -in '+file_mask_split[z_init]+' -ref '+file_mask_split[z_init]+' -applyxfm -init '+file_mat_inv_cumul_fit[iz]+' -out '+file_mask_split_fit[iz])
+            # inverse cumulative transformation to point
+            sct.run(fsloutput+'flirt -in '+file_point_split[z_init]+' -ref '+file_point_split[z_init]+' -applyxfm -init '+file_mat_inv_cumul_fit[iz]+' -out '+file_point_split_fit[iz]+' -interp nearestneighbour')
+
+        # Merge into 4D volume
+        print '\nMerge into 4D volume...'
+        sct.run(fsloutput+'fslmerge -z tmp.anat_orient_fit tmp.anat_orient_fit_z*')
+        sct.run(fsloutput+'fslmerge -z tmp.mask_orient_fit tmp.mask_orient_fit_z*')
+        sct.run(fsloutput+'fslmerge -z tmp.point_orient_fit tmp.point_orient_fit_z*')
+
+        # Copy header geometry from input data
+        print '\nCopy header geometry from input data...'
+        sct.run(fsloutput+'fslcpgeom tmp.anat_orient.nii tmp.anat_orient_fit.nii ')
+        sct.run(fsloutput+'fslcpgeom tmp.anat_orient.nii tmp.mask_orient_fit.nii ')
+        sct.run(fsloutput+'fslcpgeom tmp.anat_orient.nii tmp.point_orient_fit.nii ')
+
+        # Generate output file (in current folder)
+        print '\nGenerate output file (in current folder)...'
+        #sct.generate_output_file('tmp.centerline_polycoeffs_x.txt','./','centerline_polycoeffs_x','.txt')
+        #sct.generate_output_file('tmp.centerline_polycoeffs_y.txt','./','centerline_polycoeffs_y','.txt')
+        #sct.generate_output_file('tmp.centerline_coordinates.txt','./','centerline_coordinates','.txt')
+        sct.generate_output_file('tmp.anat_orient.nii',path_out,file_anat+'_rpi',ext_anat)
+        sct.generate_output_file('tmp.anat_orient_fit.nii',path_out,file_anat+'_rpi_align',ext_anat)
+        sct.generate_output_file('tmp.mask_orient_fit.nii',path_out,file_anat+'_mask',ext_anat)
+        fname_output_centerline = sct.generate_output_file('tmp.point_orient_fit.nii',path_out,file_anat+'_centerline',ext_anat)
+        # Reorient the centerline into the initial orientation of the input image
+        print '\nReorient the centerline into the initial orientation of the input image...'
+        sct.set_orientation(fname_output_centerline, fname_output_centerline, input_image_orientation)
 
     # print number of warnings
     print '\nNumber of warnings: '+str(warning_count)+' (if >10, you should probably reduce the gap and/or increase the kernel size'
@@ -490,5 +496,5 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
 
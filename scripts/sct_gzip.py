@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Random access into gzip-compressed files (.nii.gz). Reading a volume or a slice of a compressed image with nibabel
+# decompresses everything before it; here, reading starts from the closest seek point before the requested data, so
+# that the amount of data decompressed for each read is bounded.
+# Seek points are:
+# - the start of each gzip member. Files written by block compressors (e.g., bgzip, pigz -i) are made of many small
+#   members, which can be decompressed independently. Their position is saved in an index file next to the compressed
+#   file (<file>.gzi, same format as bgzip), so that the file is scanned only once.
+# - inside a member, the state of the decompressor every <spacing> bytes of uncompressed data, recorded the first time
+#   the data are read. These seek points are kept in memory only (they depend on the state of zlib).
+# The last read position is also kept, so that reading consecutive volumes decompresses the file only once.
+#
+# Files are compressed in parallel (as pigz): the data are split into blocks which are compressed independently, in a
+# pool of threads, each block being a gzip member. The result is a standard gzip file, readable by any tool.
+# The compression level can be set with the environment variable SCT_COMPRESSION_LEVEL (1: fastest, 9: smallest,
+# default: 6). The pool uses all cores or, when the CPU scheduler is enabled (SCT_CPU_BUDGET, see sct_utils), the cores
+# reserved for it, as a multi-threaded command.
+#
+# See Usage() below for more information.
+#
+# USAGE
+# ---------------------------------------------------------------------------------------
+#   import sct_gzip
+#   data = sct_gzip.read('dmri.nii.gz', offset, size)  # offset and size in the uncompressed file
+#   sct_gzip.compress('dmri_moco.nii', 'dmri_moco.nii.gz')
+#   sct_gzip.save(nibabel.Nifti1Image(data, affine), 'warp.nii.gz')  # instead of nibabel.save()
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+import sys
+import getopt
+import os
+import struct
+import zlib
+import bisect
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+# uncompressed bytes between two seek points inside a gzip member
+spacing_default = 2*1024*1024
+# size of the compressed chunks read from the file
+chunk_size = 256*1024
+# size of the blocks compressed independently (uncompressed)
+block_size = 1024*1024
+# default compression level (as gzip)
+level_default = 6
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    fname_list = []
+    compression = 0
+    level = get_level()
+
+    # Check input parameters
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'hci:l:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ("-c"):
+            compression = 1
+        elif opt in ("-i"):
+            fname_list = arg.split(',')
+        elif opt in ("-l"):
+            level = int(arg)
+
+    # display usage if a mandatory argument is not provided
+    if fname_list == []:
+        usage()
+
+    for fname in fname_list:
+        if not os.path.isfile(fname):
+            print '\nERROR: '+fname+' does not exist. Exit program.\n'
+            sys.exit(2)
+        # compress file (the input file is removed, as gzip does)
+        if compression:
+            print '.. '+compress(fname, level=level)
+            os.remove(fname)
+            continue
+        # build index of file
+        index = get_index(fname)
+        index.build()
+        print '.. '+fname+': '+str(index.nb_members)+' gzip member(s), '+str(len(index.points))+' seek point(s)'
+
+
+#=======================================================================================================================
+# get_index
+#=======================================================================================================================
+# Return the index of a compressed file. Indexes are kept in memory until the file is modified.
+index_cache = {}
+def get_index(fname):
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    if fname not in index_cache or index_cache[fname][0] != (stat.st_mtime, stat.st_size):
+        index_cache[fname] = ((stat.st_mtime, stat.st_size), GzipIndex(fname))
+    return index_cache[fname][1]
+
+
+#=======================================================================================================================
+# read
+#=======================================================================================================================
+# Read size bytes of uncompressed data from offset (shorter if the end of the file is reached).
+def read(fname, offset, size):
+    return get_index(fname).read(offset, size)
+
+
+#=======================================================================================================================
+# GzipIndex
+#=======================================================================================================================
+# Seek points of a compressed file: (offset in the compressed file, offset in the uncompressed data, state of the
+# decompressor), sorted by offset in the uncompressed data. The state is None at the start of a gzip member.
+class GzipIndex:
+    def __init__(self, fname, spacing=spacing_default):
+        self.fname = fname
+        self.fname_index = fname+'.gzi'
+        self.spacing = spacing
+        self.points = [(0, 0, None)]
+        self.nb_members = 1
+        # seek points are known up to this offset (uncompressed data)
+        self.scanned = 0
+        # the whole file has been scanned
+        self.complete = False
+        # position where the last read stopped
+        self.cursor = None
+        self.load()
+
+    # Read seek points saved by a previous run (start of gzip members), if the index file is up to date
+    def load(self):
+        if not os.path.isfile(self.fname_index) or os.path.getmtime(self.fname_index) < os.path.getmtime(self.fname):
+            return
+        try:
+            f = open(self.fname_index, 'rb')
+            nb_points = struct.unpack('<Q', f.read(8))[0]
+            offsets = struct.unpack('<'+str(2*nb_points)+'Q', f.read(16*nb_points))
+            f.close()
+        except (IOError, struct.error):
+            return
+        self.points += [(offsets[2*i], offsets[2*i+1], None) for i in range(nb_points)]
+        self.nb_members = nb_points+1
+        self.scanned = self.points[-1][1]
+
+    # Save the start of gzip members (only useful for files with several members). The index is not saved if the folder
+    # is not writable.
+    def save(self):
+        members = [(c, u) for c, u, state in self.points[1:] if state is None]
+        if members == []:
+            return
+        try:
+            fname_tmp = self.fname_index+'.'+str(os.getpid())
+            f = open(fname_tmp, 'wb')
+            f.write(struct.pack('<Q', len(members)))
+            for c, u in members:
+                f.write(struct.pack('<QQ', c, u))
+            f.close()
+            os.rename(fname_tmp, self.fname_index)
+        except (IOError, OSError):
+            pass
+
+    # Scan the whole file and record all seek points
+    def build(self):
+        if not self.complete:
+            self.read(self.scanned, sys.maxint, discard=True)
+
+    # Read size bytes of uncompressed data from offset (discard=True: data are decompressed but not returned)
+    def read(self, offset, size, discard=False):
+        # start from the closest seek point (or from the last read position)
+        i = bisect.bisect_right([u for c, u, state in self.points], offset)-1
+        c, u, state = self.points[i]
+        if self.cursor is not None and u < self.cursor[1] <= offset:
+            c, u, state = self.cursor
+        if state is None:
+            d = zlib.decompressobj(16+zlib.MAX_WBITS)
+        else:
+            d = state.copy()
+        f = open(self.fname, 'rb')
+        f.seek(c)
+        output = []
+        end = offset+size
+        pending = ''
+        while u < end:
+            if pending == '':
+                pending = f.read(chunk_size)
+                if pending == '':
+                    break
+            # decompress up to the start of the requested data, then up to its end
+            if u < offset:
+                length = min(offset-u, chunk_size*4)
+            else:
+                length = min(end-u, chunk_size*4)
+            data = d.decompress(pending, length)
+            if u >= offset and not discard:
+                output.append(data)
+            u += len(data)
+            if d.unused_data != '':
+                # end of a gzip member: the next one starts with the unused data
+                c += len(pending)-len(d.unused_data)
+                pending = d.unused_data
+                if pending[0:2] != '\x1f\x8b':
+                    # trailing garbage (ignored, as gzip does)
+                    break
+                d = zlib.decompressobj(16+zlib.MAX_WBITS)
+                self.add_point(c, u, None)
+            else:
+                c += len(pending)-len(d.unconsumed_tail)
+                pending = d.unconsumed_tail
+                if u-self.points[-1][1] >= self.spacing:
+                    self.add_point(c, u, d.copy())
+        f.close()
+        if u < end and not self.complete:
+            # end of file
+            self.complete = True
+            self.save()
+        self.cursor = (c, u, d)
+        return ''.join(output)
+
+    # Record a seek point, if it is after the part of the file already scanned
+    def add_point(self, c, u, state):
+        if u > self.scanned:
+            self.points.append((c, u, state))
+            self.scanned = u
+            if state is None:
+                self.nb_members += 1
+
+
+#=======================================================================================================================
+# compress
+#=======================================================================================================================
+# Compress fname_in into fname_out (default: fname_in.gz) with nb_threads threads (default: cores reserved by the CPU
+# scheduler, or all cores if it is disabled). Return fname_out.
+def compress(fname_in, fname_out='', level=None, nb_threads=None):
+    import sct_utils as sct
+    if fname_out == '':
+        fname_out = fname_in+'.gz'
+    if level is None:
+        level = get_level()
+    nb_cores = 0
+    if nb_threads is None:
+        nb_cores = sct.scheduler_acquire('sct_gzip', -1)
+        nb_threads = nb_cores or get_nb_threads()
+    try:
+        compress_file(fname_in, fname_out, level, nb_threads)
+    finally:
+        sct.scheduler_release(nb_cores)
+    return fname_out
+
+
+#=======================================================================================================================
+# compress_file
+#=======================================================================================================================
+# Compress fname_in into fname_out in a pool of nb_threads threads.
+def compress_file(fname_in, fname_out, level, nb_threads):
+    pool = ThreadPool(nb_threads)
+    f_in = open(fname_in, 'rb')
+    # write in a temporary file first, so that a concurrent script never reads an incomplete file
+    fname_tmp = fname_out+'.'+str(os.getpid())
+    f_out = open(fname_tmp, 'wb')
+    nb_blocks = 0
+    while True:
+        # read a few blocks per thread at a time, to bound memory
+        blocks = [f_in.read(block_size) for i in range(2*nb_threads)]
+        blocks = [(block, level) for block in blocks if block != '']
+        if blocks == []:
+            break
+        for member in pool.map(compress_block, blocks):
+            f_out.write(member)
+        nb_blocks += len(blocks)
+    # an empty file is a gzip member of no data
+    if nb_blocks == 0:
+        f_out.write(compress_block(('', level)))
+    f_in.close()
+    f_out.close()
+    pool.close()
+    pool.join()
+    os.rename(fname_tmp, fname_out)
+
+
+#=======================================================================================================================
+# compress_block
+#=======================================================================================================================
+# Compress (block, level) as a gzip member (zlib releases the GIL: blocks are compressed in parallel by threads)
+def compress_block(args):
+    block, level = args
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+    return compressor.compress(block)+compressor.flush()
+
+
+#=======================================================================================================================
+# save
+#=======================================================================================================================
+# Save a nibabel image (same as nibabel.save). Compressed files are written uncompressed first, then compressed in
+# parallel.
+def save(img, fname):
+    import nibabel
+    if not fname.endswith('.gz'):
+        nibabel.save(img, fname)
+        return
+    fname_tmp = fname[0:-3]+'.'+str(os.getpid())+'.nii'
+    nibabel.save(img, fname_tmp)
+    compress(fname_tmp, fname)
+    os.remove(fname_tmp)
+
+
+#=======================================================================================================================
+# get_level
+#=======================================================================================================================
+# Compression level (SCT_COMPRESSION_LEVEL)
+def get_level():
+    return int(os.environ.get('SCT_COMPRESSION_LEVEL', level_default))
+
+
+#=======================================================================================================================
+# get_nb_threads
+#=======================================================================================================================
+# Number of compression threads when the CPU scheduler is disabled (number of cores)
+def get_nb_threads():
+    return multiprocessing.cpu_count()
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Build the index of compressed images (.nii.gz), for random access to volumes and slices (done automatically\n' \
+        '  when an image is read). For files made of several gzip members, the index is saved in <file>.gzi.\n' \
+        '  With -c, compress files in parallel instead (as gzip: <file> is replaced by <file>.gz).\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' -i <image1,image2,...>\n' \
+        '\n' \
+        'ARGUMENTS\n' \
+        '  -i <image1,image2,...>       compressed images (or images to compress, with -c)\n' \
+        '  -c                           compress images\n' \
+        '  -l <1..9>                    compression level. Default='+str(get_level())+'\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # call main function
+    main()
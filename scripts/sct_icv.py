@@ -41,6 +41,7 @@
 #########################################################################################
 
 import os, sys, getopt, re
+import sct_utils as sct
 
 # Default parameters
 # ==========================================================================================
@@ -380,4 +381,4 @@ def parse_report(path):
 # ==========================================================================================
 if __name__ == "__main__":
     param = parameters()
-    main()
+    sct.profile(main)
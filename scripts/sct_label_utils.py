@@ -16,9 +16,9 @@
 
 import os, sys
 import getopt
-import commands
 import sys
 import sct_utils as sct
+import sct_labels
 import nibabel
 import numpy as np
 
@@ -44,7 +44,7 @@ def main():
     output_level = 0 # 0 for image with point ; 1 for txt file
 
     # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    path_sct = os.environ.get('SCT_DIR', '')
 
     # Parameters for debug mode
     if param.debug:
@@ -95,18 +95,24 @@ def main():
     path_label, file_label, ext_label = sct.extract_fname(fname_label)
     path_label_output, file_label_output, ext_label_output = sct.extract_fname(fname_label_output)
 
-    # read nifti input file
-    img = nibabel.load(fname_label)
-    # 3d array for each x y z voxel values for the input nifti image
-    data = img.get_data()
+    sct.step('read labels')
+    # read input file (nifti or sparse label file)
+    if sct_labels.is_sparse(fname_label):
+        coord, value, shape, affine = sct_labels.read_labels(fname_label)
+        data = sct_labels.labels2data(coord, value, shape)
+        img = nibabel.Nifti1Image(data, affine)
+    else:
+        img = nibabel.load(fname_label)
+        # 3d array for each x y z voxel values for the input nifti image
+        data = img.get_data()
     hdr = img.get_header()
+    affine = img.get_affine()
 
-    #print '\nGet dimensions of input centerline...'
-    nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension(fname_label)
-    #print '.. matrix size: '+str(nx)+' x '+str(ny)+' x '+str(nz)
-    #print '.. voxel size:  '+str(px)+'mm x '+str(py)+'mm x '+str(pz)+'mm'
+    # get voxel size
+    px, py = hdr.get_zooms()[0:2]
 
 
+    sct.step('process labels')
     if type_process == 'cross':
         data = cross(data, cross_radius, fname_ref, dilate, px, py)
     elif type_process == 'remove':
@@ -128,10 +134,16 @@ def main():
         display_voxel(data)
         output_level = 1
 
-    if (output_level == 0):
+    sct.step('output')
+    if (output_level == 0 and sct_labels.is_sparse(fname_label_output)):
+        print '\nWrite sparse label file...'
+        coord, value = sct_labels.data2labels(data)
+        sct_labels.write_labels(fname_label_output, coord, value, data.shape, affine)
+        print '.. File created: '+fname_label_output
+    elif (output_level == 0):
         hdr.set_data_dtype('int32') # set imagetype to uint8, previous: int32. 
         print '\nWrite NIFTI volumes...'
-        data.astype('int')
+        data = data.astype('int32')
         img = nibabel.Nifti1Image(data, None, hdr)
         nibabel.save(img, 'tmp.'+file_label_output+'.nii.gz')
         sct.generate_output_file('tmp.'+file_label_output+'.nii.gz','./',file_label_output,ext_label_output)
@@ -140,205 +152,113 @@ def main():
 #=======================================================================================================================
 def cross(data, cross_radius, fname_ref, dilate, px, py):
     X, Y, Z = (data > 0).nonzero()
-    a = len(X)
     d = cross_radius # cross radius in pixel
-    dx = d/px # cross radius in mm
-    dy = d/py
-
-    # for all points with non-zeros neighbors, force the neighbors to 0
-    for i in range(0,a):
-        value = data[X[i]][Y[i]][Z[i]]
-        data[X[i]][Y[i]][Z[i]] = 0 # remove point on the center of the spinal cord
-        if fname_ref == '':
-            data[X[i]][Y[i]+dy][Z[i]] = value*10+1 # add point at distance from center of spinal cord
-            data[X[i]+dx][Y[i]][Z[i]] = value*10+2
-            data[X[i]][Y[i]-dy][Z[i]] = value*10+3
-            data[X[i]-dx][Y[i]][Z[i]] = value*10+4
-
-            # dilate cross to 3x3
-            if dilate:
-                data[X[i]-1][Y[i]+dy-1][Z[i]] = data[X[i]][Y[i]+dy-1][Z[i]] = data[X[i]+1][Y[i]+dy-1][Z[i]] = data[X[i]+1][Y[i]+dy][Z[i]] = data[X[i]+1][Y[i]+dy+1][Z[i]] = data[X[i]][Y[i]+dy+1][Z[i]] = data[X[i]-1][Y[i]+dy+1][Z[i]] = data[X[i]-1][Y[i]+dy][Z[i]] = data[X[i]][Y[i]+dy][Z[i]]
-                data[X[i]+dx-1][Y[i]-1][Z[i]] = data[X[i]+dx][Y[i]-1][Z[i]] = data[X[i]+dx+1][Y[i]-1][Z[i]] = data[X[i]+dx+1][Y[i]][Z[i]] = data[X[i]+dx+1][Y[i]+1][Z[i]] = data[X[i]+dx][Y[i]+1][Z[i]] = data[X[i]+dx-1][Y[i]+1][Z[i]] = data[X[i]+dx-1][Y[i]][Z[i]] = data[X[i]+dx][Y[i]][Z[i]]
-                data[X[i]-1][Y[i]-dy-1][Z[i]] = data[X[i]][Y[i]-dy-1][Z[i]] = data[X[i]+1][Y[i]-dy-1][Z[i]] = data[X[i]+1][Y[i]-dy][Z[i]] = data[X[i]+1][Y[i]-dy+1][Z[i]] = data[X[i]][Y[i]-dy+1][Z[i]] = data[X[i]-1][Y[i]-dy+1][Z[i]] = data[X[i]-1][Y[i]-dy][Z[i]] = data[X[i]][Y[i]-dy][Z[i]]
-                data[X[i]-dx-1][Y[i]-1][Z[i]] = data[X[i]-dx][Y[i]-1][Z[i]] = data[X[i]-dx+1][Y[i]-1][Z[i]] = data[X[i]-dx+1][Y[i]][Z[i]] = data[X[i]-dx+1][Y[i]+1][Z[i]] = data[X[i]-dx][Y[i]+1][Z[i]] = data[X[i]-dx-1][Y[i]+1][Z[i]] = data[X[i]-dx-1][Y[i]][Z[i]] = data[X[i]-dx][Y[i]][Z[i]]
-        else:
-            # read nifti input file
-            img_ref = nibabel.load(fname_ref)
-            # 3d array for each x y z voxel values for the input nifti image
-            data_ref = img_ref.get_data()
-            profile = []; p_median = []; p_gradient = []
-            for j in range(0,d+1):
-                profile.append(data_ref[X[i]][Y[i]+j][Z[i]])
-            for k in range(1,d):
-                a = np.array([profile[k-1],profile[k],profile[k+1]])
-                p_median.append(np.median(a))
-            for l in range(0,d-2):
-                p_gradient.append(p_median[l+1]-p_median[l])
-            d1 = p_gradient.index(max(p_gradient))
-
-            profile = []; p_median = []; p_gradient = []
-            for j in range(0,d+1):
-                profile.append(data_ref[X[i]+j][Y[i]][Z[i]])
-            for k in range(1,d):
-                a = np.array([profile[k-1],profile[k],profile[k+1]])
-                p_median.append(np.median(a))
-            for l in range(0,d-2):
-                p_gradient.append(p_median[l+1]-p_median[l])
-            d2 = p_gradient.index(max(p_gradient))
-
-            profile = []; p_median = []; p_gradient = []
-            for j in range(0,d+1):
-                profile.append(data_ref[X[i]][Y[i]-j][Z[i]])
-            for k in range(1,d):
-                a = np.array([profile[k-1],profile[k],profile[k+1]])
-                p_median.append(np.median(a))
-            for l in range(0,d-2):
-                p_gradient.append(p_median[l+1]-p_median[l])
-            d3 = p_gradient.index(max(p_gradient))
-
-            profile = []; p_median = []; p_gradient = []
-            for j in range(0,d+1):
-                profile.append(data_ref[X[i]-j][Y[i]][Z[i]])
-            for k in range(1,d):
-                a = np.array([profile[k-1],profile[k],profile[k+1]])
-                p_median.append(np.median(a))
-            for l in range(0,d-2):
-                p_gradient.append(p_median[l+1]-p_median[l])
-            d4 = p_gradient.index(max(p_gradient))
-
-            data[X[i]][Y[i]+d1][Z[i]] = value*10+1 # add point at distance from center of spinal cord
-            data[X[i]+d2][Y[i]][Z[i]] = value*10+2
-            data[X[i]][Y[i]-d3][Z[i]] = value*10+3
-            data[X[i]-d4][Y[i]][Z[i]] = value*10+4
-
-            # dilate cross to 3x3
-            if dilate:
-                data[X[i]-1][Y[i]+d1-1][Z[i]] = data[X[i]][Y[i]+d1-1][Z[i]] = data[X[i]+1][Y[i]+d1-1][Z[i]] = data[X[i]+1][Y[i]+d1][Z[i]] = data[X[i]+1][Y[i]+d1+1][Z[i]] = data[X[i]][Y[i]+d1+1][Z[i]] = data[X[i]-1][Y[i]+d1+1][Z[i]] = data[X[i]-1][Y[i]+d1][Z[i]] = data[X[i]][Y[i]+d1][Z[i]]
-                data[X[i]+d2-1][Y[i]-1][Z[i]] = data[X[i]+d2][Y[i]-1][Z[i]] = data[X[i]+d2+1][Y[i]-1][Z[i]] = data[X[i]+d2+1][Y[i]][Z[i]] = data[X[i]+d2+1][Y[i]+1][Z[i]] = data[X[i]+d2][Y[i]+1][Z[i]] = data[X[i]+d2-1][Y[i]+1][Z[i]] = data[X[i]+d2-1][Y[i]][Z[i]] = data[X[i]+d2][Y[i]][Z[i]]
-                data[X[i]-1][Y[i]-d3-1][Z[i]] = data[X[i]][Y[i]-d3-1][Z[i]] = data[X[i]+1][Y[i]-d3-1][Z[i]] = data[X[i]+1][Y[i]-d3][Z[i]] = data[X[i]+1][Y[i]-d3+1][Z[i]] = data[X[i]][Y[i]-d3+1][Z[i]] = data[X[i]-1][Y[i]-d3+1][Z[i]] = data[X[i]-1][Y[i]-d3][Z[i]] = data[X[i]][Y[i]-d3][Z[i]]
-                data[X[i]-d4-1][Y[i]-1][Z[i]] = data[X[i]-d4][Y[i]-1][Z[i]] = data[X[i]-d4+1][Y[i]-1][Z[i]] = data[X[i]-d4+1][Y[i]][Z[i]] = data[X[i]-d4+1][Y[i]+1][Z[i]] = data[X[i]-d4][Y[i]+1][Z[i]] = data[X[i]-d4-1][Y[i]+1][Z[i]] = data[X[i]-d4-1][Y[i]][Z[i]] = data[X[i]-d4][Y[i]][Z[i]]
+    dx = int(d/px) # cross radius in mm
+    dy = int(d/py)
+
+    # remove points on the center of the spinal cord
+    value = data[X, Y, Z]
+    data[X, Y, Z] = 0
+
+    # branches of the cross: +y, +x, -y, -x
+    directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+    if fname_ref == '':
+        distance = [dy, dx, dy, dx]
+    else:
+        # read nifti reference file (only once for all labels)
+        img_ref = nibabel.load(fname_ref)
+        # 3d array for each x y z voxel values for the input nifti image
+        data_ref = img_ref.get_data()
+        # distance to the edge of the spinal cord along each branch
+        distance = [edge_distance(data_ref, X, Y, Z, ux, uy, d) for ux, uy in directions]
+
+    # add points at distance from center of spinal cord
+    X_branch = [X + directions[k][0]*distance[k] for k in range(0, 4)]
+    Y_branch = [Y + directions[k][1]*distance[k] for k in range(0, 4)]
+    for k in range(0, 4):
+        data[X_branch[k], Y_branch[k], Z] = value*10+k+1
+
+    # dilate cross to 3x3 (branches may overlap, hence the value is read again before each dilation)
+    if dilate:
+        for k in range(0, 4):
+            value_branch = data[X_branch[k], Y_branch[k], Z]
+            for ix in range(-1, 2):
+                for iy in range(-1, 2):
+                    data[X_branch[k]+ix, Y_branch[k]+iy, Z] = value_branch
 
     return data
 
 
+#=======================================================================================================================
+def edge_distance(data_ref, X, Y, Z, ux, uy, d):
+    """For each point (X, Y, Z), return the distance (in pixel) along direction (ux, uy) where the gradient of the
+    median-filtered profile of data_ref is maximum."""
+    j = np.arange(0, d+1)
+    # profiles (one line per point)
+    profile = data_ref[X[:, None]+ux*j, Y[:, None]+uy*j, Z[:, None]]
+    # median filter of size 3
+    p_median = np.median(np.array([profile[:, 0:d-1], profile[:, 1:d], profile[:, 2:d+1]]), axis=0)
+    # gradient
+    p_gradient = p_median[:, 1:d-1] - p_median[:, 0:d-2]
+    return p_gradient.argmax(axis=1)
+
+
 #=======================================================================================================================
 def remove_label(data, fname_ref):
     X, Y, Z = (data > 0).nonzero()
 
-    img_ref = nibabel.load(fname_ref)
-    # 3d array for each x y z voxel values for the input nifti image
-    data_ref = img_ref.get_data()
-    X_ref, Y_ref, Z_ref = (data_ref > 0).nonzero()
-
-    nbLabel = len(X)
-    nbLabel_ref = len(X_ref)
-    for i in range(0,nbLabel):
-        value = data[X[i]][Y[i]][Z[i]]
-        isInRef = False
-        for j in range(0,nbLabel_ref):
-            value_ref = data_ref[X_ref[j]][Y_ref[j]][Z_ref[j]]
-            if value_ref == value:
-                isInRef = True
-        if isInRef == False:
-            data[X[i]][Y[i]][Z[i]] = 0
+    # values of the reference labels (nifti or sparse label file)
+    value_ref = sct_labels.read_labels(fname_ref)[1]
+
+    # remove labels whose value is not in the reference image
+    is_in_ref = np.in1d(data[X, Y, Z], value_ref)
+    data[X[~is_in_ref], Y[~is_in_ref], Z[~is_in_ref]] = 0
 
     return data
 
+#=======================================================================================================================
+def sort_along_y(data, unique=False):
+    """Return coordinates of non-zero voxels sorted along Y (the Z image is assumed to be in second dimension). Points
+    with the same Y keep their original order. If unique is True, only the first point of each Y is kept."""
+    X, Y, Z = (data > 0).nonzero()
+    indices = np.argsort(Y, kind='mergesort')
+    if unique:
+        indices = indices[np.unique(Y[indices], return_index=True)[1]]
+    return X[indices], Y[indices], Z[indices]
+
 # need binary centerline and segmentation with vertebral level. output_level=1 -> write .txt file. output_level=1 -> write centerline with vertebral levels
 #=======================================================================================================================
 def extract_disk_position(data_level, fname_centerline, output_level, fname_label_output):
-    X, Y, Z = (data_level > 0).nonzero()
-    
     img_centerline = nibabel.load(fname_centerline)
     # 3d array for each x y z voxel values for the input nifti image
     data_centerline = img_centerline.get_data()
-    Xc, Yc, Zc = (data_centerline > 0).nonzero()
-    nbLabel = len(X)
-    nbLabel_centerline = len(Xc)
-    # sort Xc, Yc, and Zc depending on Yc
-    cent = [Xc, Yc, Zc]
-    indices = range(nbLabel_centerline)
-    indices.sort(key = cent[1].__getitem__)
-    for i, sublist in enumerate(cent):
-        cent[i] = [sublist[j] for j in indices]
-    Xc = []
-    Yc = []
-    Zc = []
-    # remove double values
-    for i in range(0,len(cent[1])):
-        if Yc.count(cent[1][i])==0:
-            Xc.append(cent[0][i])
-            Yc.append(cent[1][i])
-            Zc.append(cent[2][i])
-    nbLabel_centerline = len(Xc)
-    
-    centerline_level = [0 for a in range(nbLabel_centerline)]
-    for i in range(0,nbLabel_centerline):
-        centerline_level[i] = data_level[Xc[i]][Yc[i]][Zc[i]]
-        data_centerline[Xc[i]][Yc[i]][Zc[i]] = 0
-    for i in range(0,nbLabel_centerline-1):
-        centerline_level[i] = abs(centerline_level[i+1]-centerline_level[i])
-    centerline_level[-1] = 0
-
-    C = [i for i, e in enumerate(centerline_level) if e != 0]
-    nb_disks = len(C)
-    
+    # sort centerline points along Y and remove double values
+    Xc, Yc, Zc = sort_along_y(data_centerline, unique=True)
+
+    # disks are located where the vertebral level changes along the centerline
+    centerline_level = data_level[Xc, Yc, Zc]
+    data_centerline[Xc, Yc, Zc] = 0
+    C = (np.diff(centerline_level) != 0).nonzero()[0]
+
     if output_level==0:
-        for i in range(0,nb_disks):
-            data_centerline[Xc[C[i]]][Yc[C[i]]][Zc[C[i]]] = data_level[Xc[C[i]]][Yc[C[i]]][Zc[C[i]]]
+        data_centerline[Xc[C], Yc[C], Zc[C]] = data_level[Xc[C], Yc[C], Zc[C]]
     elif output_level==1:
-        fo = open(fname_label_output, "wb")
-        for i in range(0,nb_disks):
-            line = (data_level[Xc[C[i]]][Yc[C[i]]][Zc[C[i]]],Xc[C[i]],Yc[C[i]],Zc[C[i]])
-            fo.write("%i %i %i %i\n" %line)
-        fo.close()
+        np.savetxt(fname_label_output, np.transpose([data_level[Xc[C], Yc[C], Zc[C]], Xc[C], Yc[C], Zc[C]]), fmt='%i')
 
     return data_centerline
 
 #=======================================================================================================================
 def extract_centerline(data,fname_label_output):
     # the Z image is assume to be in second dimension
-    X, Y, Z = (data > 0).nonzero()
-    cent = [X, Y, Z]
-    indices = range(0,len(X))
-    indices.sort(key = cent[1].__getitem__)
-    for i, sublist in enumerate(cent):
-        cent[i] = [sublist[j] for j in indices]
-    X = []; Y = []; Z = []
-    # remove double values
-    for i in range(0,len(cent[1])):
-        if Y.count(cent[1][i])==0:
-            X.append(cent[0][i])
-            Y.append(cent[1][i])
-            Z.append(cent[2][i])
-    
-    fo = open(fname_label_output, "wb")
-    for i in range(0,len(X)):
-        line = (X[i],Y[i],Z[i])
-        fo.write("%i %i %i\n" %line)
-    fo.close()
+    # sort points along Y and remove double values
+    X, Y, Z = sort_along_y(data, unique=True)
+    np.savetxt(fname_label_output, np.transpose([X, Y, Z]), fmt='%i')
 
 #=======================================================================================================================
 def extract_segmentation(data,fname_label_output):
     # the Z image is assume to be in second dimension
-    X, Y, Z = (data > 0).nonzero()
-    cent = [X, Y, Z]
-    indices = range(0,len(X))
-    indices.sort(key = cent[1].__getitem__)
-    for i, sublist in enumerate(cent):
-        cent[i] = [sublist[j] for j in indices]
-    X = []; Y = []; Z = []
-    # remove double values
-    for i in range(0,len(cent[1])):
-        X.append(cent[0][i])
-        Y.append(cent[1][i])
-        Z.append(cent[2][i])
-    
-    fo = open(fname_label_output, "wb")
-    for i in range(0,len(X)):
-        line = (X[i],Y[i],Z[i])
-        fo.write("%i %i %i\n" %line)
-    fo.close()
+    X, Y, Z = sort_along_y(data)
+    np.savetxt(fname_label_output, np.transpose([X, Y, Z]), fmt='%i')
 
 #=======================================================================================================================
 def fraction_volume(data,fname_ref,fname_label_output):
@@ -346,59 +266,21 @@ def fraction_volume(data,fname_ref,fname_label_output):
     img_ref = nibabel.load(fname_ref)
     # 3d array for each x y z voxel values for the input nifti image
     data_ref = img_ref.get_data()
-    Xr, Yr, Zr = (data_ref > 0).nonzero()
-    ref_matrix = [Xr, Yr, Zr]
-    indices = range(0,len(Xr))
-    indices.sort(key = ref_matrix[1].__getitem__)
-    for i, sublist in enumerate(ref_matrix):
-        ref_matrix[i] = [sublist[j] for j in indices]
-    Xr = []; Yr = []; Zr = []
-    for i in range(0,len(ref_matrix[1])):
-        Xr.append(ref_matrix[0][i])
-        Yr.append(ref_matrix[1][i])
-        Zr.append(ref_matrix[2][i])
-    
-    X, Y, Z = (data > 0).nonzero()
-    data_matrix = [X, Y, Z]
-    indices = range(0,len(X))
-    indices.sort(key = data_matrix[1].__getitem__)
-    for i, sublist in enumerate(data_matrix):
-        data_matrix[i] = [sublist[j] for j in indices]
-    X = []; Y = []; Z = []
-    for i in range(0,len(data_matrix[1])):
-        X.append(data_matrix[0][i])
-        Y.append(data_matrix[1][i])
-        Z.append(data_matrix[2][i])
-
-    volume_fraction = []
-    for i in range(ny):
-        r = []
-        for j,p in enumerate(Yr):
-            if p == i:
-                r.append(j)
-        d = []
-        for j,p in enumerate(Y):
-            if p == i:
-                d.append(j)
-        volume_ref = 0.0
-        for k in range(len(r)):
-            value = data_ref[Xr[r[k]]][Yr[r[k]]][Zr[r[k]]]
-            if value > 0.5:
-                volume_ref = volume_ref + value #suppose 1mm isotropic resolution
-        volume_data = 0.0
-        for k in range(len(d)):
-            value = data[X[d[k]]][Y[d[k]]][Z[d[k]]]
-            if value > 0.5:
-                volume_data = volume_data + value #suppose 1mm isotropic resolution
-        if volume_ref!=0:
-            volume_fraction.append(volume_data/volume_ref)
-        else:
-            volume_fraction.append(0)
 
-    fo = open(fname_label_output, "wb")
-    for i in range(ny):
-        fo.write("%i %f\n" %(i,volume_fraction[i]))
-    fo.close()
+    # volume of each slice along Y (suppose 1mm isotropic resolution)
+    volume_ref = volume_along_y(data_ref, ny)
+    volume_data = volume_along_y(data, ny)
+
+    volume_fraction = np.zeros(ny)
+    volume_fraction[volume_ref != 0] = volume_data[volume_ref != 0] / volume_ref[volume_ref != 0]
+
+    np.savetxt(fname_label_output, np.transpose([np.arange(ny), volume_fraction]), fmt=['%i', '%f'])
+
+#=======================================================================================================================
+def volume_along_y(data, ny):
+    """Sum of the voxel values above 0.5 in each slice along Y."""
+    X, Y, Z = (data > 0.5).nonzero()
+    return np.bincount(Y, weights=data[X, Y, Z], minlength=ny)[0:ny]
 
 #=======================================================================================================================
 def write_vertebral_levels(data,fname_vert_level_input):
@@ -436,8 +318,8 @@ def usage():
         '  sct_label_utils.py -i <inputdata> -o <outputdata> -c <crossradius>\n' \
         '\n'\
         'MANDATORY ARGUMENTS\n' \
-        '  -i           input volume.\n' \
-        '  -o           output volume.\n' \
+        '  -i           input volume (nifti or sparse label file .json).\n' \
+        '  -o           output volume. Use extension .json to write a sparse label file.\n' \
         '  -t           process: cross, remove.\n' \
         '  -c           cross radius in mm (default=5mm).\n' \
         '  -r           reference image for label removing' \
@@ -457,4 +339,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Read and write label files. Labels are a handful of non-zero voxels. Instead of a full-size NIfTI volume, they can
+# be stored in a sparse label file (extension .json) which contains the voxel coordinates, the values, the shape and
+# the affine of the image. All functions accept both formats: the format is chosen from the file extension.
+#
+# Sparse label file:
+#   {"shape": [nx, ny, nz], "affine": [[...], [...], [...], [...]], "labels": [[x, y, z, value], ...]}
+#
+# USAGE
+# ---------------------------------------------------------------------------------------
+#   import sct_labels
+#   coord, value, shape, affine = sct_labels.read_labels('landmarks.json')
+#   sct_labels.write_labels('landmarks.nii.gz', coord, value, shape, affine)
+#   fname_nifti = sct_labels.get_nifti('landmarks.json') # only when an external software needs a NIfTI file
+#
+# DEPENDENCIES
+# ---------------------------------------------------------------------------------------
+# EXTERNAL PYTHON PACKAGES
+# - nibabel: <http://nipy.sourceforge.net/nibabel/>
+# - numpy: <http://www.numpy.org>
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+import os
+import json
+import nibabel
+import numpy
+
+# extension of sparse label files
+ext_sparse = '.json'
+
+
+#=======================================================================================================================
+# is_sparse
+#=======================================================================================================================
+# Check if file is a sparse label file
+def is_sparse(fname):
+    return fname.endswith(ext_sparse)
+
+
+#=======================================================================================================================
+# read_labels
+#=======================================================================================================================
+# Read labels (non-zero voxels). Returns coordinates (n x 3), values (n), shape and affine of the image.
+def read_labels(fname):
+    if is_sparse(fname):
+        f = open(fname)
+        labels = json.load(f)
+        f.close()
+        coord_value = numpy.array(labels['labels'], dtype=float).reshape(-1, 4)
+        coord = coord_value[:, 0:3].astype(int)
+        value = coord_value[:, 3]
+        return coord, value, tuple(labels['shape']), numpy.array(labels['affine'])
+    else:
+        img = nibabel.load(fname)
+        data = img.get_data()
+        coord, value = data2labels(data)
+        return coord, value, data.shape[0:3], img.get_affine()
+
+
+#=======================================================================================================================
+# write_labels
+#=======================================================================================================================
+# Write labels in a sparse label file or in a NIfTI file (int32), depending on the extension of fname.
+def write_labels(fname, coord, value, shape, affine):
+    if is_sparse(fname):
+        labels = {'shape': [int(n) for n in shape[0:3]],
+                  'affine': numpy.asarray(affine).tolist(),
+                  'labels': [[int(c[0]), int(c[1]), int(c[2]), float(v)] for c, v in zip(coord, value)]}
+        f = open(fname, 'w')
+        json.dump(labels, f)
+        f.close()
+    else:
+        img = nibabel.Nifti1Image(labels2data(coord, value, shape, 'int32'), affine)
+        img.get_header().set_data_dtype('int32')
+        nibabel.save(img, fname)
+    return fname
+
+
+#=======================================================================================================================
+# data2labels
+#=======================================================================================================================
+# Get coordinates (n x 3) and values (n) of non-zero voxels of an array.
+def data2labels(data):
+    X, Y, Z = (data > 0).nonzero()[0:3]
+    return numpy.transpose([X, Y, Z]), data[X, Y, Z]
+
+
+#=======================================================================================================================
+# labels2data
+#=======================================================================================================================
+# Create an array of given shape containing the labels.
+def labels2data(coord, value, shape, dtype=float):
+    data = numpy.zeros(shape[0:3], dtype=dtype)
+    if len(value):
+        data[coord[:, 0], coord[:, 1], coord[:, 2]] = value
+    return data
+
+
+#=======================================================================================================================
+# get_nifti
+#=======================================================================================================================
+# Return the name of a NIfTI file containing the labels, for software that only reads NIfTI. Sparse label files are
+# converted to fname_out (default: same name with .nii.gz), unless the NIfTI file is already more recent.
+def get_nifti(fname, fname_out=''):
+    if not is_sparse(fname):
+        return fname
+    if fname_out == '':
+        fname_out = fname[0:-len(ext_sparse)]+'.nii.gz'
+    if not os.path.isfile(fname_out) or os.path.getmtime(fname_out) < os.path.getmtime(fname):
+        coord, value, shape, affine = read_labels(fname)
+        write_labels(fname_out, coord, value, shape, affine)
+    return fname_out
@@ -15,7 +15,6 @@
 # check if needed Python libraries are already installed or not
 import sys
 import os
-import commands
 import getopt
 import time
 import math
@@ -30,6 +29,12 @@ except ImportError:
     print '--- numpy not installed! Exit program. ---'
     sys.exit(2)
 
+# get path of the toolbox
+path_sct = os.environ.get('SCT_DIR', '')
+# append path that contains scripts, to be able to load modules
+sys.path.append(path_sct + '/scripts')
+import sct_utils as sct
+
 class moco_class:
     def __init__(self):
         
@@ -105,11 +110,6 @@ def main():
     if moco.cost_function_flirt == '':
         moco.cost_function_flirt = 'normcorr'     #Default Value
 
-    # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
-    # append path that contains scripts, to be able to load modules
-    sys.path.append(path_sct + '/scripts')
-    import sct_utils as sct
     
     #moco.path_script = os.path.dirname(__file__)
     #moco.path_script = os.path.abspath(moco.path_script)
@@ -159,11 +159,6 @@ def sct_moco(moco):
     #path_script         = moco.path_script
     merge_back          = moco.merge_back
     
-    # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
-    # append path that contains scripts, to be able to load modules
-    sys.path.append(path_sct + '/scripts')
-    import sct_utils as sct
     
     # check existence of input files
     sct.check_file_exist(fname_data)
@@ -419,4 +414,4 @@ def gauss2d(dims, sigma, center):
 #=======================================================================================================================
 if __name__ == "__main__":
     # call main function
-    main()
\ No newline at end of file
+    sct.profile(main)
@@ -67,11 +67,6 @@ try:
 except ImportError:
     print '--- numpy not installed! ---'
     sys.exit(2)
-try:
-    from scipy.interpolate import interp1d
-except ImportError:
-    print '--- scipy not installed! ---'
-    sys.exit(2)
 #import matplotlib.pyplot as plt
 #from mpl_toolkits.mplot3d import Axes3D
 class NURBS():
@@ -33,14 +33,10 @@ import math
 import sys
 import getopt
 import os
-import commands
 import numpy as np
 import time
 import sct_utils as sct
 from sct_nurbs import NURBS
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from scipy.misc import imsave
 try:
     import nibabel
 except ImportError:
@@ -56,7 +52,7 @@ def main():
     fsloutput = 'export FSLOUTPUTTYPE=NIFTI; ' # for faster processing, all outputs are in NIFTI
     # THIS DOES NOT WORK IN MY LAPTOP: path_sct = os.environ['SCT_DIR'] # path to spinal cord toolbox
     #path_sct = path_script[:-8] # TODO: make it cleaner!
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    path_sct = os.environ.get('SCT_DIR', '')
     fname_segmentation = ''
     name_process = ''
     processes = ['extract_centerline','compute_CSA']
@@ -132,65 +128,46 @@ def extract_centerline(fname_segmentation):
     
     remove_temp_files = param.remove_temp_files
     
-    # Change orientation of the input segmentation into RPI
-    print '\nOrient segmentation image to RPI orientation...'
-    fname_segmentation_orient = 'tmp.segmentation_rpi' + ext_data
-    sct.run('sct_orientation -i ' + file_data+ext_data + ' -o ' + fname_segmentation_orient + ' -orientation RPI')
-	
-    # Extract orientation of the input segmentation
-    status,sct_orientation_output = sct.run('sct_orientation -i ' + file_data+ext_data + ' -get')
-    orientation = sct_orientation_output[-3:]
+    # Open segmentation in RPI orientation (reoriented in memory)
+    print '\nOpen segmentation volume in RPI orientation...'
+    im = sct.Image(file_data+ext_data, 'RPI')
+    orientation = sct.get_orientation(file_data+ext_data)
     print '\nOrientation of segmentation image: ' + orientation
-	
-    # Get size of data
-    print '\nGet dimensions data...'
-    nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension(fname_segmentation_orient)
-    print '.. '+str(nx)+' x '+str(ny)+' y '+str(nz)+' z '+str(nt)
-	
-    print '\nOpen segmentation volume...'
-    file = nibabel.load(fname_segmentation_orient)
-    data = file.get_data()
-    hdr = file.get_header()
+    nx, ny, nz = im.get_shape()[0:3]
+    print '.. '+str(nx)+' x '+str(ny)+' y '+str(nz)+' z'
 	
     # Extract min and max index in Z direction
-    X, Y, Z = (data>0).nonzero()
-    print data
-    min_z_index, max_z_index = min(Z), max(Z)
-    x_centerline = [0 for i in range(0,max_z_index-min_z_index+1)]
-    y_centerline = [0 for i in range(0,max_z_index-min_z_index+1)]
-    z_centerline = [iz for iz in range(min_z_index, max_z_index+1)]
+    min_z_index, max_z_index = im.get_bounding_box()[2]
     # Extract segmentation points and average per slice
-    for iz in range(min_z_index, max_z_index+1):
-        x_seg, y_seg = (data[:,:,iz]>0).nonzero()
-        x_centerline[iz-min_z_index] = np.mean(x_seg)
-        y_centerline[iz-min_z_index] = np.mean(y_seg)
-    for k in range(len(X)):
-	    data[X[k],Y[k],Z[k]] = 0
+    z_centerline, x_centerline, y_centerline = [list(c) for c in im.get_centroids()]
+    # Output image: empty image with the same header
+    im_centerline = im.copy()
+    data = im_centerline.get_data()
+    data[:] = 0
+    sct.step('centerline fit')
     # Fit the centerline points with splines and return the new fitted coordinates
     x_centerline_fit, y_centerline_fit,x_centerline_deriv,y_centerline_deriv,z_centerline_deriv = b_spline_centerline(x_centerline,y_centerline,z_centerline)
 
 
     # Create an image with the centerline
-    for iz in range(min_z_index, max_z_index+1):
-	    data[round(x_centerline_fit[iz-min_z_index]),round(y_centerline_fit[iz-min_z_index]),iz] = 1
+    for k in range(len(z_centerline)):
+        data[int(round(x_centerline_fit[k])), int(round(y_centerline_fit[k])), z_centerline[k]] = 1
 
-    # Write the centerline image in RPI orientation
+    # Write the centerline image in the orientation of the input segmentation
+    print '\nOrient centerline image to input orientation: ' + orientation
+    hdr = im_centerline.hdr
     hdr.set_data_dtype('uint8') # set imagetype to uint8
+    data, hdr = sct.reorient(data, hdr, orientation)
     print '\nWrite NIFTI volumes...'
     img = nibabel.Nifti1Image(data, None, hdr)
     nibabel.save(img, 'tmp.centerline.nii')
-    sct.generate_output_file('tmp.centerline.nii','./',file_data+'_centerline',ext_data)
+    sct.generate_output_file('tmp.centerline.nii','../',file_data+'_centerline',ext_data)
 
     del data
 
     # come back to parent folder
     os.chdir('..')
 
-    # Change orientation of the output centerline into input orientation
-    print '\nOrient centerline image to input orientation: ' + orientation
-    fname_segmentation_orient = 'tmp.segmentation_rpi' + ext_data
-    sct.run('sct_orientation -i ' + path_tmp+'/'+file_data+'_centerline'+ext_data + ' -o ' + file_data+'_centerline'+ext_data + ' -orientation ' + orientation)
-
 
     # Remove temporary files
     if remove_temp_files == 1 :
@@ -227,20 +204,13 @@ def compute_CSA(fname_segmentation):
     remove_temp_files = param.remove_temp_files
     step = param.step
     
-    # # Change orientation of the input segmentation into RPI
-    print '\nOrient segmentation image to RPI orientation...'
-    fname_segmentation_orient = 'tmp.segmentation_rpi' + ext_data
-    sct.run('sct_orientation -i ' + file_data+ext_data + ' -o ' + fname_segmentation_orient + ' -orientation RPI')
-	
-    # Get size of data
-    print '\nGet dimensions data...'
-    nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension(fname_segmentation_orient)
-    print '.. '+str(nx)+' x '+str(ny)+' y '+str(nz)+' z '+str(nt)
-	
-    print '\nOpen segmentation volume...'
-    file = nibabel.load(fname_segmentation_orient)
-    data = file.get_data()
-    hdr = file.get_header()
+    # Open segmentation in RPI orientation (reoriented in memory)
+    print '\nOpen segmentation volume in RPI orientation...'
+    im = sct.Image(file_data+ext_data, 'RPI')
+    data = im.get_data()
+    hdr = im.hdr
+    nx, ny, nz = im.get_shape()[0:3]
+    print '.. '+str(nx)+' x '+str(ny)+' y '+str(nz)+' z'
     
     x_scale=hdr['pixdim'][1]
     y_scale=hdr['pixdim'][2]
@@ -248,22 +218,17 @@ def compute_CSA(fname_segmentation):
     
     #
     # Extract min and max index in Z direction
-    X, Y, Z = (data>0).nonzero()
+    X, Y, Z = im.get_nonzero()
     coords = np.array([str([X[i],Y[i],Z[i]]) for i in range(0,len(Z))]) #don't know why but finding strings in array of array of strings is WAY fater than doing the same with integers
     #coords = [[X[i],Y[i],Z[i]] for i in range(0,len(Z))]
     
-    min_z_index, max_z_index = min(Z), max(Z)
-    x_centerline = [0 for i in range(0,max_z_index-min_z_index+1)]
-    y_centerline = [0 for i in range(0,max_z_index-min_z_index+1)]
-    z_centerline = [iz for iz in range(min_z_index, max_z_index+1)]
+    min_z_index, max_z_index = im.get_bounding_box()[2]
     
     # Extract segmentation points and average per slice
-    for iz in range(min_z_index, max_z_index+1):
-        x_seg, y_seg = (data[:,:,iz]>0).nonzero()
-        x_centerline[iz-min_z_index] = np.mean(x_seg)
-        y_centerline[iz-min_z_index] = np.mean(y_seg)
+    z_centerline, x_centerline, y_centerline = [list(c) for c in im.get_centroids()]
     
 	
+    sct.step('centerline fit')
     # Fit the centerline points with splines and return the new fitted coordinates
     x_centerline_fit, y_centerline_fit,x_centerline_deriv,y_centerline_deriv,z_centerline_deriv = b_spline_centerline(x_centerline,y_centerline,z_centerline)
     
@@ -280,6 +245,7 @@ def compute_CSA(fname_segmentation):
     z=np.array([0,0,1])
     
     
+    sct.step('CSA')
     print('\nComputing CSA...')
     sections=[0 for i in range(0,max_z_index-min_z_index+1)]
     
@@ -302,7 +268,7 @@ def compute_CSA(fname_segmentation):
         max_diameter = (max([(max(X)-min(X))*x_scale,(max(Y)-min(Y))*y_scale])*np.sqrt(2))/(np.cos(angle)) # maximum dimension of the tilted plane
         
         plane = np.zeros((int(max_diameter/step),int(max_diameter/step)))  ## discretized plane which will be filled with 0/1
-        plane_grid = np.linspace(-int(max_diameter/2),int(max_diameter/2),(max_diameter/step)) # how the plane will be skimmed through
+        plane_grid = np.linspace(-int(max_diameter/2),int(max_diameter/2),int(max_diameter/step)) # how the plane will be skimmed through
         
         cpt=0
         
@@ -316,14 +282,15 @@ def compute_CSA(fname_segmentation):
                 
                 if (coord_voxel in coords) is True :  ## if this voxel is 1
                     
-                    plane[i_b1+int(max_diameter/2)][i_b2+int(max_diameter/2)]=1
+                    plane[int(i_b1+int(max_diameter/2))][int(i_b2+int(max_diameter/2))]=1
                     cpt = cpt+1
         
         
         
-        sections[iz]=cpt*step*step  # number of voxels that are in the intersection of each plane and the nonzeros values of segmentation, times the area of one cell of the discretized plane
+        # slices without segmentation are skipped by the centroids: sections are indexed by z (from min_z_index)
+        sections[int(z_centerline[iz])-min_z_index]=cpt*step*step  # number of voxels that are in the intersection of each plane and the nonzeros values of segmentation, times the area of one cell of the discretized plane
         
-        print sections[iz]
+        print sections[int(z_centerline[iz])-min_z_index]
     
     #os.chdir('..')
     #sct.run('mkdir JPG_Results')
@@ -337,8 +304,10 @@ def compute_CSA(fname_segmentation):
     
     ## plotting results
     
+    # matplotlib is slow to import: only imported when needed
+    import matplotlib.pyplot as plt
     fig=plt.figure()
-    plt.plot(z_centerline*z_scale, sections)
+    plt.plot(np.array(z_centerline)*z_scale, [sections[int(z)-min_z_index] for z in z_centerline])
     plt.show()
     
     
@@ -351,7 +320,7 @@ def compute_CSA(fname_segmentation):
     file.write('List of Cross Section Areas for each z slice\n')
     
     for i in range(min_z_index, max_z_index+1):
-        file.write('\nz = ' + str(i*z_scale) + ' mm -> CSA = ' + str(sections[i]) + ' mm^2')
+        file.write('\nz = ' + str(i*z_scale) + ' mm -> CSA = ' + str(sections[i-min_z_index]) + ' mm^2')
 
     file.close()
 
@@ -433,4 +402,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
@@ -8,7 +8,8 @@
 # DEPENDENCIES
 # ---------------------------------------------------------------------------------------
 # EXTERNAL PYTHON PACKAGES
-# none
+# - nibabel: <http://nipy.sourceforge.net/nibabel/>
+# - numpy: <http://www.numpy.org>
 #
 # EXTERNAL SOFTWARE
 # - itksnap/c3d <http://www.itksnap.org/pmwiki/pmwiki.php?n=Main.HomePage>
@@ -45,13 +46,17 @@ class param:
         self.numberIterations    = "50x30" # number of iterations
         self.verbose             = 0 # verbose
         self.compute_dest2sr     = 0 # compute dest2src warping field
+        self.crop_margin         = 15 # margin (in mm) around the spinal cord when cropping the destination image. Put 0 for no cropping.
 
 import sys
 import getopt
 import os
-import commands
 import time
 import sct_utils as sct
+import sct_compose_transfo
+import sct_cache
+import nibabel
+import numpy
 
 # MAIN
 # ==========================================================================================
@@ -64,6 +69,8 @@ def main():
     fname_dest_seg = ''
     fname_output = ''
     padding = param.padding
+    crop_margin = param.crop_margin
+    fname_mask = ''
     gradientStepLength = '0.1' # TODO: use that?
     numberIterations = param.numberIterations
     numberIterationsStep2 = "20"
@@ -78,7 +85,7 @@ def main():
     start_time = time.time()
 
     # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    path_sct = os.environ.get('SCT_DIR', '')
     print path_sct
 
     # Parameters for debug mode
@@ -97,12 +104,14 @@ def main():
 
     # Check input parameters
     try:
-        opts, args = getopt.getopt(sys.argv[1:],'he:d:i:m:n:o:p:q:r:s:t:v:x:z:')
+        opts, args = getopt.getopt(sys.argv[1:],'hc:e:d:i:m:n:o:p:q:r:s:t:v:x:z:')
     except getopt.GetoptError:
         usage()
     for opt, arg in opts:
         if opt == '-h':
             usage()
+        elif opt in ("-c"):
+            crop_margin = float(arg)
         elif opt in ("-d"):
             fname_dest = arg
         elif opt in ('-e'):
@@ -149,6 +158,8 @@ def main():
     if use_segmentation:
         sct.check_file_exist(fname_src_seg)
         sct.check_file_exist(fname_dest_seg)
+    if fname_mask != '':
+        sct.check_file_exist(fname_mask)
 
     # print arguments
     print '\nCheck parameters:'
@@ -158,7 +169,8 @@ def main():
     print '.. Segmentation dest:    '+fname_dest_seg
     print '.. Init transfo:         '+fname_init_transfo
     print '.. Output name:          '+fname_output
-    #print '.. Mask:                 '+fname_mask
+    print '.. Mask:                 '+fname_mask
+    print '.. Crop margin (mm):     '+str(crop_margin)
     print '.. number of iterations: '+str(numberIterations)
     print '.. Verbose:              '+str(verbose)
     print '.. Remove temp files:    '+str(remove_temp_files)
@@ -180,61 +192,109 @@ def main():
     else:
         path_out, file_out, ext_out = sct.extract_fname(fname_output)
 
-    # create local temp files
-    print('\nCreate local temp files...')
-    file_src_tmp = 'tmp.src'
-    file_dest_tmp = 'tmp.dest'
-    sct.run('c3d '+fname_src+' -o tmp.src.nii') # here we use c3d to make sure output is nii. TODO: cleaner way to do it.
-    sct.run('c3d '+fname_dest+' -o tmp.dest.nii')
+    # Get full path (temporary files are written in a folder private to this run, see sct.workspace)
+    fname_src = os.path.abspath(fname_src)
+    fname_dest = os.path.abspath(fname_dest)
     if use_segmentation:
-        file_src_seg_tmp = 'tmp.src_seg'
-        file_dest_seg_tmp = 'tmp.dest_seg'
-        sct.run('c3d '+fname_src_seg+' -o tmp.src_seg.nii')
-        sct.run('c3d '+fname_dest_seg+' -o tmp.dest_seg.nii')
-
-    # if use initial transformation (!! needs to be inserted before the --transform field in antsRegistration)
-    if fname_init_transfo != '':
-        file_src_reg_tmp = file_src_tmp+'_reg'
-        if use_segmentation:
-            file_src_seg_reg_tmp = file_src_seg_tmp+'_reg'
-        # apply initial transformation to moving image, and then estimate transformation between this output and
-        # destination image. This approach was chosen instead of inputting the transfo into ANTs, because if the transfo
-        # does not bring the image to the same space as the destination image, then warping fields cannot be concatenated at the end.
-        print('\nApply initial transformation to moving image...')
-        sct.run('WarpImageMultiTransform 3 '+file_src_tmp+'.nii '+file_src_reg_tmp+'.nii -R '+file_dest_tmp+'.nii '+fname_init_transfo+' --use-BSpline')
-        file_src_tmp = file_src_reg_tmp
-        if use_segmentation:
-            sct.run('WarpImageMultiTransform 3 '+file_src_seg_tmp+'.nii '+file_src_seg_reg_tmp+'.nii -R '+file_dest_seg_tmp+'.nii '+fname_init_transfo+' --use-BSpline')
-            file_src_seg_tmp = file_src_seg_reg_tmp
-
-    # Pad the target and source image (because ants doesn't deform the extremities)
-    if padding:
-        # Pad source image
-        print('\nPad source...')
-        pad_image(file_src_tmp,file_src_tmp+'_pad.nii',padding)
-        file_src_tmp = file_src_tmp+'_pad' # update file name
-        # Pad destination image
-        print('\nPad destination...')
-        pad_image(file_dest_tmp,file_dest_tmp+'_pad.nii',padding)
-        file_dest_tmp = file_dest_tmp+'_pad' # update file name
+        fname_src_seg = os.path.abspath(fname_src_seg)
+        fname_dest_seg = os.path.abspath(fname_dest_seg)
+    if fname_mask != '':
+        fname_mask = os.path.abspath(fname_mask)
+    fname_init_transfo = ' '.join([fname if fname == '-i' else os.path.abspath(fname) for fname in fname_init_transfo.split()])
+    fname_init_transfo_inv = ' '.join([fname if fname == '-i' else os.path.abspath(fname) for fname in fname_init_transfo_inv.split()])
+    path_out = os.path.abspath(path_out)+'/'
+
+    with sct.workspace(remove_temp_files):
+
+        # create local temp files
+        print('\nCreate local temp files...')
+        file_src_tmp = 'tmp.src'
+        file_dest_tmp = 'tmp.dest'
+        sct.run('c3d '+fname_src+' -o tmp.src.nii') # here we use c3d to make sure output is nii. TODO: cleaner way to do it.
+        sct.run('c3d '+fname_dest+' -o tmp.dest.nii')
         if use_segmentation:
+            file_src_seg_tmp = 'tmp.src_seg'
+            file_dest_seg_tmp = 'tmp.dest_seg'
+            sct.run('c3d '+fname_src_seg+' -o tmp.src_seg.nii')
+            sct.run('c3d '+fname_dest_seg+' -o tmp.dest_seg.nii')
+
+        # if use initial transformation (!! needs to be inserted before the --transform field in antsRegistration)
+        if fname_init_transfo != '':
+            file_src_reg_tmp = file_src_tmp+'_reg'
+            if use_segmentation:
+                file_src_seg_reg_tmp = file_src_seg_tmp+'_reg'
+            # apply initial transformation to moving image, and then estimate transformation between this output and
+            # destination image. This approach was chosen instead of inputting the transfo into ANTs, because if the transfo
+            # does not bring the image to the same space as the destination image, then warping fields cannot be concatenated at the end.
+            print('\nApply initial transformation to moving image...')
+            sct.run('WarpImageMultiTransform 3 '+file_src_tmp+'.nii '+file_src_reg_tmp+'.nii -R '+file_dest_tmp+'.nii '+fname_init_transfo+' --use-BSpline')
+            file_src_tmp = file_src_reg_tmp
+            if use_segmentation:
+                sct.run('WarpImageMultiTransform 3 '+file_src_seg_tmp+'.nii '+file_src_seg_reg_tmp+'.nii -R '+file_dest_seg_tmp+'.nii '+fname_init_transfo+' --use-BSpline')
+                file_src_seg_tmp = file_src_seg_reg_tmp
+
+        sct.step('preprocessing')
+        # Pad the target and source image (because ants doesn't deform the extremities)
+        if padding:
             # Pad source image
-            print('\nPad source segmentation...')
-            pad_image(file_src_seg_tmp,file_src_seg_tmp+'_pad.nii',padding)
-            file_src_seg_tmp = file_src_seg_tmp+'_pad' # update file name
+            print('\nPad source...')
+            pad_image(file_src_tmp,file_src_tmp+'_pad.nii',padding)
+            file_src_tmp = file_src_tmp+'_pad' # update file name
             # Pad destination image
-            print('\nPad destination segmentation...')
-            pad_image(file_dest_seg_tmp,file_dest_seg_tmp+'_pad.nii',padding)
-            file_dest_seg_tmp = file_dest_seg_tmp+'_pad' # update file name
+            print('\nPad destination...')
+            pad_image(file_dest_tmp,file_dest_tmp+'_pad.nii',padding)
+            file_dest_tmp = file_dest_tmp+'_pad' # update file name
+            if use_segmentation:
+                # Pad source image
+                print('\nPad source segmentation...')
+                pad_image(file_src_seg_tmp,file_src_seg_tmp+'_pad.nii',padding)
+                file_src_seg_tmp = file_src_seg_tmp+'_pad' # update file name
+                # Pad destination image
+                print('\nPad destination segmentation...')
+                pad_image(file_dest_seg_tmp,file_dest_seg_tmp+'_pad.nii',padding)
+                file_dest_seg_tmp = file_dest_seg_tmp+'_pad' # update file name
+
+        # Crop the destination image around the spinal cord (destination segmentation, or mask). The registration is
+        # restricted to the axial plane, hence only X and Y are cropped. Warping fields are estimated on the cropped grid and
+        # brought back to the full grid of the destination image when concatenating transformations (null displacement
+        # outside of the cropped region).
+        if crop_margin > 0 and (use_segmentation or fname_mask != ''):
+            print('\nCrop destination around the spinal cord...')
+            if use_segmentation:
+                box = get_crop_box(file_dest_seg_tmp+'.nii', crop_margin)
+            else:
+                box = get_crop_box(fname_mask, crop_margin)
+            if box is None:
+                print('WARNING: Spinal cord mask is empty: destination is not cropped.')
+            else:
+                crop_image(file_dest_tmp+'.nii', file_dest_tmp+'_crop.nii', box)
+                file_dest_tmp = file_dest_tmp+'_crop' # update file name
+                if use_segmentation:
+                    crop_image(file_dest_seg_tmp+'.nii', file_dest_seg_tmp+'_crop.nii', box)
+                    file_dest_seg_tmp = file_dest_seg_tmp+'_crop' # update file name
+
+        sct.step('warp estimation')
+        # Look for transformations already estimated with the same inputs and parameters (see sct_cache.py)
+        if use_segmentation == 0:
+            file_transfo_list = ['tmp.reg0Warp.nii.gz', 'tmp.reg0InverseWarp.nii.gz']
+        elif use_segmentation == 1:
+            file_transfo_list = ['tmp.regSeg0Warp.nii.gz', 'tmp.regSeg0InverseWarp.nii.gz', 'tmp.reg1Warp.nii.gz', 'tmp.reg1InverseWarp.nii.gz']
+        cache_key = sct_cache.get_key([fname_src, fname_dest, fname_src_seg, fname_dest_seg, fname_mask]+[fname for fname in fname_init_transfo.split() if fname != '-i'],
+                                      [os.path.basename(__file__), use_segmentation, numberIterations, numberIterationsStep2, padding, crop_margin],
+                                      ['antsRegistration', 'c3d', 'WarpImageMultiTransform'])
+        cache_hit = sct_cache.get(cache_key, file_transfo_list)
 
+        # transformations found in cache
+        if cache_hit:
+            print('\nSkip estimation of transformation (found in cache).')
 
-    # don't use spinal cord segmentation
-    if use_segmentation == 0:
+        # don't use spinal cord segmentation
+        elif use_segmentation == 0:
 
-        # Estimate transformation using ANTS
-        print('\nEstimate transformation using ANTS (might take a couple of minutes)...')
+            # Estimate transformation using ANTS
+            print('\nEstimate transformation using ANTS (might take a couple of minutes)...')
 
-        cmd = 'antsRegistration \
+            cmd = 'antsRegistration \
 --dimensionality 3 \
 '+use_init_transfo+' \
 --transform SyN[0.1,3,0] \
@@ -248,36 +308,36 @@ def main():
 --interpolation BSpline[3] \
 --winsorize-image-intensities [0.005,0.995]'
 
-        status, output = sct.run(cmd)
-        if verbose:
-            print output
-
-    # use spinal cord segmentation
-    elif use_segmentation == 1:
-
-        ## if use initial transformation (!! needs to be inserted before the --transform field in antsRegistration)
-        #if fname_init_transfo != '':
-        #    file_src_reg_tmp = file_src_tmp+'_reg'
-        #    file_src_seg_reg_tmp = file_src_seg_tmp+'_reg'
-        #    # apply initial transformation to moving image, and then estimate transformation between this output and
-        #    # destination image. This approach was chosen instead of inputting the transfo into ANTs, because if the transfo
-        #    # does not bring the image to the same space as the destination image, then warping fields cannot be concatenated at the end.
-        #    print('\nApply initial transformation to moving image...')
-        #    #cmd = 'WarpImageMultiTransform 3 '+file_src_tmp+'.nii '+file_src_reg_tmp+'.nii -R '+file_dest_tmp+'.nii '+fname_init_transfo+' --use-BSpline'
-        #    sct.run('WarpImageMultiTransform 3 '+file_src_tmp+'.nii '+file_src_reg_tmp+'.nii -R '+file_dest_tmp+'.nii '+fname_init_transfo)
-        #    # smooth image
-        #    sct.run('c3d tmp.src_pad_reg.nii -smooth 0.5mm -o tmp.src_pad_reg_smooth.nii')
-        #    sct.run('WarpImageMultiTransform 3 '+file_src_seg_tmp+'.nii '+file_src_seg_reg_tmp+'.nii -R '+file_dest_seg_tmp+'.nii '+fname_init_transfo)
-        #    file_src_tmp = file_src_reg_tmp
-        #    file_src_seg_tmp = file_src_seg_reg_tmp
-        #    #cmd = 'WarpImageMultiTransform 3 '+file_src_seg_tmp+' '+file_src_seg_reg_tmp+' -R '+file_dest_seg_tmp+' '+fname_init_transfo
-        #    #use_init_transfo = ' --initial-moving-transform '+fname_init_transfo
-        #    #output_warping_field = "tmp.regSeg1Warp.nii.gz"
-
-        # Estimate transformation using ANTS
-        print('\nStep #1: Estimate transformation using spinal cord segmentations...')
-
-        cmd = 'antsRegistration \
+            status, output = sct.run(cmd)
+            if verbose:
+                print output
+
+        # use spinal cord segmentation
+        elif use_segmentation == 1:
+
+            ## if use initial transformation (!! needs to be inserted before the --transform field in antsRegistration)
+            #if fname_init_transfo != '':
+            #    file_src_reg_tmp = file_src_tmp+'_reg'
+            #    file_src_seg_reg_tmp = file_src_seg_tmp+'_reg'
+            #    # apply initial transformation to moving image, and then estimate transformation between this output and
+            #    # destination image. This approach was chosen instead of inputting the transfo into ANTs, because if the transfo
+            #    # does not bring the image to the same space as the destination image, then warping fields cannot be concatenated at the end.
+            #    print('\nApply initial transformation to moving image...')
+            #    #cmd = 'WarpImageMultiTransform 3 '+file_src_tmp+'.nii '+file_src_reg_tmp+'.nii -R '+file_dest_tmp+'.nii '+fname_init_transfo+' --use-BSpline'
+            #    sct.run('WarpImageMultiTransform 3 '+file_src_tmp+'.nii '+file_src_reg_tmp+'.nii -R '+file_dest_tmp+'.nii '+fname_init_transfo)
+            #    # smooth image
+            #    sct.run('c3d tmp.src_pad_reg.nii -smooth 0.5mm -o tmp.src_pad_reg_smooth.nii')
+            #    sct.run('WarpImageMultiTransform 3 '+file_src_seg_tmp+'.nii '+file_src_seg_reg_tmp+'.nii -R '+file_dest_seg_tmp+'.nii '+fname_init_transfo)
+            #    file_src_tmp = file_src_reg_tmp
+            #    file_src_seg_tmp = file_src_seg_reg_tmp
+            #    #cmd = 'WarpImageMultiTransform 3 '+file_src_seg_tmp+' '+file_src_seg_reg_tmp+' -R '+file_dest_seg_tmp+' '+fname_init_transfo
+            #    #use_init_transfo = ' --initial-moving-transform '+fname_init_transfo
+            #    #output_warping_field = "tmp.regSeg1Warp.nii.gz"
+
+            # Estimate transformation using ANTS
+            print('\nStep #1: Estimate transformation using spinal cord segmentations...')
+
+            cmd = 'antsRegistration \
 --dimensionality 3 \
 --transform SyN[0.5,3,0] \
 --metric MI['+file_dest_seg_tmp+'.nii,'+file_src_seg_tmp+'.nii,1,32] \
@@ -287,19 +347,19 @@ def main():
 --Restrict-Deformation 1x1x0 \
 --output [tmp.regSeg,tmp.regSeg.nii]'
 
-        #'+use_init_transfo+' \
+            #'+use_init_transfo+' \
 
-            #if fname_init_transfo != '':
-            #    cmd = cmd+' --initial-moving-transform '+fname_init_transfo
-            #    output_warping_field = "tmp.regSeg1Warp.nii.gz"
+                #if fname_init_transfo != '':
+                #    cmd = cmd+' --initial-moving-transform '+fname_init_transfo
+                #    output_warping_field = "tmp.regSeg1Warp.nii.gz"
               
-        status, output = sct.run(cmd)
-        if verbose:
-            print output
+            status, output = sct.run(cmd)
+            if verbose:
+                print output
 
-        print('\nStep #2: Improve local deformation using images (start from previous transformation)...')
+            print('\nStep #2: Improve local deformation using images (start from previous transformation)...')
 
-        cmd = 'antsRegistration \
+            cmd = 'antsRegistration \
 --dimensionality 3 \
 --initial-moving-transform tmp.regSeg0Warp.nii.gz \
 --transform SyN[0.1,1,0] \
@@ -312,84 +372,64 @@ def main():
 --collapse-output-transforms 0 \
 --interpolation BSpline[3]'
 
-        #if fname_init_transfo != '':
-        #    cmd = cmd+' --initial-moving-transform '+fname_init_transfo
+            #if fname_init_transfo != '':
+            #    cmd = cmd+' --initial-moving-transform '+fname_init_transfo
         
-        status, output = sct.run(cmd)
-        if verbose:
-            print output
-
-    # update file name
-    file_src_tmp = file_src_tmp+'_reg'
-    file_warp_final = 'tmp.reg0Warp.nii.gz'
-
-    # Concatenate transformations
-    print('\nConcatenate transformations...')
-    # if user has initial transfo
-    if fname_init_transfo != '':
+            status, output = sct.run(cmd)
+            if verbose:
+                print output
+
+        # store transformations in cache
+        if not cache_hit:
+            sct_cache.put(cache_key, file_transfo_list)
+
+        # update file name
+        file_src_tmp = file_src_tmp+'_reg'
+        file_warp_final = 'tmp.reg0Warp.nii.gz'
+
+        sct.step('warp concatenation')
+        # Concatenate transformations
+        print('\nConcatenate transformations...')
+        # transformations are listed in the same order as for ComposeMultiTransform
         if use_segmentation == 0:
-            # src --> dest
-            cmd1 = 'ComposeMultiTransform 3 tmp.warp_src2dest.nii.gz -R tmp.dest.nii tmp.reg0Warp.nii.gz '+fname_init_transfo
-            # dest --> src
-            if compute_dest2src:
-                cmd2 = 'ComposeMultiTransform 3 tmp.warp_dest2src.nii.gz -R tmp.src.nii '+fname_init_transfo_inv+' tmp.reg0InverseWarp.nii.gz'
-
+            transfo_src2dest = ['tmp.reg0Warp.nii.gz']
+            transfo_dest2src = ['tmp.reg0InverseWarp.nii.gz']
         elif use_segmentation == 1:
-            # src --> dest
-            cmd1 = 'ComposeMultiTransform 3 tmp.warp_src2dest.nii.gz -R tmp.dest.nii tmp.reg1Warp.nii.gz tmp.regSeg0Warp.nii.gz '+fname_init_transfo
-            # dest --> src
-            if compute_dest2src:
-                cmd2 = 'ComposeMultiTransform 3 tmp.warp_dest2src.nii.gz -R tmp.src.nii '+fname_init_transfo_inv+' tmp.regSeg0InverseWarp.nii.gz tmp.reg1InverseWarp.nii.gz'
-
-    # if user does not have initial transfo
-    else:
-        if use_segmentation == 0:
-            # src --> dest
-            cmd1 = 'ComposeMultiTransform 3 tmp.warp_src2dest.nii.gz -R tmp.dest.nii tmp.reg0Warp.nii.gz'
-            # dest --> src
-            if compute_dest2src:
-                cmd2 = 'ComposeMultiTransform 3 tmp.warp_dest2src.nii.gz -R tmp.src.nii tmp.reg0InverseWarp.nii.gz'
-
-        elif use_segmentation == 1:
-            # src --> dest
-            cmd1 = 'ComposeMultiTransform 3 tmp.warp_src2dest.nii.gz -R tmp.dest.nii tmp.reg1Warp.nii.gz tmp.regSeg0Warp.nii.gz'
-            # dest --> src
-            if compute_dest2src:
-                cmd2 = 'ComposeMultiTransform 3 tmp.warp_dest2src.nii.gz -R tmp.src.nii tmp.regSeg0InverseWarp.nii.gz tmp.reg1InverseWarp.nii.gz'
-
-    print('>> ' + cmd1)
-    commands.getstatusoutput(cmd1)  # here cannot use sct.run() because of wrong output status in ComposeMultiTransform
-    if compute_dest2src:
-        print('>> ' + cmd2)
-        commands.getstatusoutput(cmd2)  # here cannot use sct.run() because of wrong output status in ComposeMultiTransform
-
-    # Apply warping field to src data
-    print('\nApply transfo source --> dest...')
-    status, output = sct.run('WarpImageMultiTransform 3 tmp.src.nii tmp.src_reg.nii -R tmp.dest.nii tmp.warp_src2dest.nii.gz --use-BSpline')
-    if compute_dest2src:
-        print('\nApply transfo dest --> source...')
-        status, output = sct.run('WarpImageMultiTransform 3 tmp.dest.nii tmp.dest_reg.nii -R tmp.src.nii tmp.warp_dest2src.nii.gz --use-BSpline')
-
-
-    ## Remove padding
-    #if padding:
-    #    print('\nRemove padding...')
-    #    remove_padding(fname_dest,file_src_tmp,file_src_tmp+'_nopad.nii')
-    #    file_src_tmp = file_src_tmp+'_nopad' # update file name
-
-    # Generate output files
-    print('\nGenerate output files...')
-#    if fname_init_transfo == '':
-    fname_src2dest = sct.generate_output_file('tmp.src_reg.nii', path_out, file_out, ext_out)
-    sct.generate_output_file('tmp.warp_src2dest.nii.gz', path_out, 'warp_src2dest', '.nii.gz')
-    if compute_dest2src:
-        fname_dest2src = sct.generate_output_file('tmp.dest_reg.nii', path_out, file_dest+'_reg', ext_dest)
-        sct.generate_output_file('tmp.warp_dest2src.nii.gz', path_out, 'warp_dest2src', '.nii.gz')
-
-    # Delete temporary files
-    if remove_temp_files == 1:
-        print '\nDelete temporary files...'
-        sct.run('rm tmp.*')
+            transfo_src2dest = ['tmp.reg1Warp.nii.gz', 'tmp.regSeg0Warp.nii.gz']
+            transfo_dest2src = ['tmp.regSeg0InverseWarp.nii.gz', 'tmp.reg1InverseWarp.nii.gz']
+        # if user has initial transfo
+        if fname_init_transfo != '':
+            transfo_src2dest = transfo_src2dest + fname_init_transfo.split()
+            transfo_dest2src = fname_init_transfo_inv.split() + transfo_dest2src
+        # src --> dest
+        sct_compose_transfo.compose_transfo('tmp.warp_src2dest.nii.gz', 'tmp.dest.nii', transfo_src2dest)
+        # dest --> src
+        if compute_dest2src:
+            sct_compose_transfo.compose_transfo('tmp.warp_dest2src.nii.gz', 'tmp.src.nii', transfo_dest2src)
+
+        sct.step('warp application')
+        # Apply warping field to src data
+        print('\nApply transfo source --> dest...')
+        status, output = sct.run('WarpImageMultiTransform 3 tmp.src.nii tmp.src_reg.nii -R tmp.dest.nii tmp.warp_src2dest.nii.gz --use-BSpline')
+        if compute_dest2src:
+            print('\nApply transfo dest --> source...')
+            status, output = sct.run('WarpImageMultiTransform 3 tmp.dest.nii tmp.dest_reg.nii -R tmp.src.nii tmp.warp_dest2src.nii.gz --use-BSpline')
+
+
+        ## Remove padding
+        #if padding:
+        #    print('\nRemove padding...')
+        #    remove_padding(fname_dest,file_src_tmp,file_src_tmp+'_nopad.nii')
+        #    file_src_tmp = file_src_tmp+'_nopad' # update file name
+
+        # Generate output files
+        print('\nGenerate output files...')
+    #    if fname_init_transfo == '':
+        fname_src2dest = sct.generate_output_file('tmp.src_reg.nii', path_out, file_out, ext_out)
+        sct.generate_output_file('tmp.warp_src2dest.nii.gz', path_out, 'warp_src2dest', '.nii.gz')
+        if compute_dest2src:
+            fname_dest2src = sct.generate_output_file('tmp.dest_reg.nii', path_out, file_dest+'_reg', ext_dest)
+            sct.generate_output_file('tmp.warp_dest2src.nii.gz', path_out, 'warp_dest2src', '.nii.gz')
 
     # display elapsed time
     elapsed_time = time.time() - start_time
@@ -437,8 +477,16 @@ def usage():
         '  -o <output>                  name of output file. Default=source_reg\n' \
         '  -n <N1xN2>                   number of iterations for first and second stage. Default='+param.numberIterations+'\n' \
         '  -p <padding>                 size of padding at top and bottom, to enable deformation at volume edge. Default='+str(param.padding)+'\n' \
+        '  -m <mask>                    spinal cord mask in the destination space (e.g., warped template cord), used for\n' \
+        '                               cropping if no segmentation is given.\n' \
+        '  -c <margin>                  crop destination around the spinal cord (segmentation or mask) with a margin (in mm)\n' \
+        '                               before estimating the transformation. Put 0 for no cropping. Default='+str(param.crop_margin)+'\n' \
         '  -r <0,1>                     remove temporary files. Default='+str(param.remove_temp_files)+'\n' \
-        '  -v <0,1>                     verbose. Default='+str(param.verbose)+'\n'
+        '  -v <0,1>                     verbose. Default='+str(param.verbose)+'\n' \
+        '\n' \
+        'CACHE\n' \
+        '  To skip the estimation when registering again the same images with the same parameters, define the\n' \
+        '  environment variable SCT_CACHE_DIR (folder where estimated transformations are kept). See sct_cache.py.\n'
 
     # exit program
     sys.exit(2)
@@ -455,6 +503,36 @@ def pad_image(fname_in,file_out,padding):
 
 
 
+# get bounding box of the spinal cord
+# ==========================================================================================
+def get_crop_box(fname_mask, margin):
+    """Return [xmin, xmax, ymin, ymax] (voxels) of the non-zero voxels of fname_mask, enlarged by margin (mm), or None if
+    the mask is empty."""
+    im = sct.Image(fname_mask)
+    box = im.get_bounding_box()
+    if box is None:
+        return None
+    px, py = im.get_zooms()[0:2]
+    dx, dy = int(numpy.ceil(margin/px)), int(numpy.ceil(margin/py))
+    return [max(box[0][0]-dx, 0), min(box[0][1]+dx, im.get_shape()[0]-1), max(box[1][0]-dy, 0), min(box[1][1]+dy, im.get_shape()[1]-1)]
+
+
+# crop an image
+# ==========================================================================================
+def crop_image(fname_in, fname_out, box):
+    """Crop fname_in in X and Y ([xmin, xmax, ymin, ymax], voxels, included). The affine is updated, so that the cropped
+    image stays at the same position in the physical space."""
+    img = nibabel.load(fname_in)
+    data = img.get_data()[box[0]:box[1]+1, box[2]:box[3]+1]
+    affine = img.get_affine().copy()
+    affine[0:3, 3] = numpy.dot(affine[0:3, 0:3], [box[0], box[2], 0]) + affine[0:3, 3]
+    hdr = img.get_header().copy()
+    hdr.set_qform(affine)
+    hdr.set_sform(affine)
+    nibabel.save(nibabel.Nifti1Image(data, affine, hdr), fname_out)
+    print('.. '+fname_in+' ('+'x'.join([str(n) for n in img.shape])+') --> '+fname_out+' ('+'x'.join([str(n) for n in data.shape])+')')
+
+
 # remove padding
 # ==========================================================================================
 def remove_padding(file_ref,file_in,file_out):
@@ -472,7 +550,7 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
 
 
 
@@ -59,6 +59,7 @@ class param:
         self.debug = 0 # debug mode
         self.verbose             = 1 # verbose
         self.number_iterations    = "50x20" # number of iterations
+        self.pyramid             = 0 # downsampling factor of the template for the coarse stage (0: shrink-factors of antsRegistration)
 
 # check if needed Python libraries are already installed or not
 import os
@@ -67,11 +68,10 @@ import commands
 import sys
 import time
 import sct_utils as sct
+import sct_compose_transfo
+import sct_template_pyramid
 from sct_utils import fsloutput
 
-# check if dependant software are installed
-sct.check_if_installed('WarpImageMultiTransform -h','ANTS')
-
 
 
 #=======================================================================================================================
@@ -79,6 +79,9 @@ sct.check_if_installed('WarpImageMultiTransform -h','ANTS')
 #=======================================================================================================================
 def main():
 
+    # check if dependant software are installed
+    sct.check_if_installed('WarpImageMultiTransform -h','ANTS')
+
     # Initialization
     fname_anat = ''
     fname_landmark_anat = ''
@@ -87,6 +90,7 @@ def main():
     fname_mask = ''
     remove_temp_files = param.remove_temp_files
     number_iterations = param.number_iterations
+    pyramid = param.pyramid
     verbose = param.verbose
     start_time = time.time()
 
@@ -103,7 +107,7 @@ def main():
 
     # Check input param
     try:
-        opts, args = getopt.getopt(sys.argv[1:],'hi:f:l:m:n:o:r:s:t:v:')
+        opts, args = getopt.getopt(sys.argv[1:],'hi:f:l:m:n:o:p:r:s:t:v:')
     except getopt.GetoptError as err:
         print str(err)
         usage()
@@ -122,6 +126,8 @@ def main():
             number_iterations = arg
         elif opt in ("-o"):
             fname_template_seg = arg
+        elif opt in ('-p'):
+            pyramid = int(arg)
         elif opt in ('-r'):
             remove_temp_files = int(arg)
         elif opt in ("-s"):
@@ -152,23 +158,86 @@ def main():
     print '  template:             '+fname_template
     print '  landmarks template:   '+fname_landmark_template
     print '  number of iterations: '+str(number_iterations)
+    print '  pyramid level:        '+str(pyramid)
     print '  mask anatomic:        '+fname_mask
     print '  Verbose:              '+str(verbose)
 
-
-
-
-    # Estimate transfo: straight --> template (affine landmark-based)'
-    print '\nEstimate transfo: straight anat --> template (affine landmark-based)...'
-    sct.run('ANTSUseLandmarkImagesToGetAffineTransform '+fname_landmark_template+' '+fname_landmark_anat+' affine tmp.straight2templateAffine.txt')
-
-    # Apply transformation: straight --> template
-    print '\nApply transformation straight --> template...'
-    sct.run('WarpImageMultiTransform 3 '+fname_anat+' tmp.straight2templateAffine.nii tmp.straight2templateAffine.txt -R '+fname_template)
-
-    # Estimate transformation: straight --> template (deformation)
-    print '\nEstimate transformation: straight --> template (diffeomorphic transformation). Takes ~15-45 minutes...'
-    cmd = 'antsRegistration \
+    # Get full path (temporary files are written in a folder private to this run, see sct.workspace)
+    fname_anat = os.path.abspath(fname_anat)
+    fname_landmark_anat = os.path.abspath(fname_landmark_anat)
+    fname_template = os.path.abspath(fname_template)
+    fname_landmark_template = os.path.abspath(fname_landmark_template)
+    if fname_mask != '':
+        fname_mask = os.path.abspath(fname_mask)
+    path_out = os.getcwd()+'/'
+
+    with sct.workspace(remove_temp_files):
+
+        sct.step('affine estimation')
+        # Estimate transfo: straight --> template (affine landmark-based)'
+        print '\nEstimate transfo: straight anat --> template (affine landmark-based)...'
+        sct.run('ANTSUseLandmarkImagesToGetAffineTransform '+fname_landmark_template+' '+fname_landmark_anat+' affine tmp.straight2templateAffine.txt')
+
+        # Apply transformation: straight --> template
+        print '\nApply transformation straight --> template...'
+        sct.run('WarpImageMultiTransform 3 '+fname_anat+' tmp.straight2templateAffine.nii tmp.straight2templateAffine.txt -R '+fname_template)
+
+        sct.step('warp estimation')
+        # Estimate transformation: straight --> template (deformation)
+        print '\nEstimate transformation: straight --> template (diffeomorphic transformation). Takes ~15-45 minutes...'
+        if pyramid:
+            # coarse stage on the downsampled template (precomputed once, see sct_template_pyramid), then refinement at full
+            # resolution starting from the coarse transformation. If there is no iteration left for the refinement (e.g.,
+            # -n 50x0), the coarse transformation is used as is (fast low-resolution registration).
+            number_iterations_coarse = number_iterations.split('x')[0]
+            number_iterations_fine = 'x'.join(number_iterations.split('x')[1:])
+            if number_iterations_fine.replace('x', '').strip('0') == '':
+                number_iterations_fine = ''
+            cmd = 'antsRegistration \
+--dimensionality 3 \
+--transform SyN[0.2,3] \
+--metric MI['+sct_template_pyramid.get_level(fname_template, pyramid)+',tmp.straight2templateAffine.nii,1,32] \
+--convergence '+number_iterations_coarse+' \
+--shrink-factors 1 \
+--smoothing-sigmas 1mm \
+--Restrict-Deformation 1x1x0 \
+--output [tmp.straight2templateCoarse] \
+--collapse-output-transforms 0 \
+--interpolation BSpline[3] \
+--winsorize-image-intensities [0.005,0.995]'
+            if fname_mask != '':
+                cmd = cmd+' -x '+sct_template_pyramid.get_level(fname_mask, pyramid)
+            status, output = sct.run(cmd)
+            if verbose:
+                print output
+            transfo_straight2template = ['tmp.straight2templateCoarse0Warp.nii.gz', 'tmp.straight2templateAffine.txt']
+            transfo_template2straight = ['-i', 'tmp.straight2templateAffine.txt', 'tmp.straight2templateCoarse0InverseWarp.nii.gz']
+            if number_iterations_fine != '':
+                cmd = 'antsRegistration \
+--dimensionality 3 \
+--transform SyN[0.2,3] \
+--metric MI['+fname_template+',tmp.straight2templateAffine.nii,1,32] \
+--convergence '+number_iterations_fine+' \
+--shrink-factors '+'x'.join(['1' for i in number_iterations_fine.split('x')])+' \
+--smoothing-sigmas '+'x'.join(['0' for i in number_iterations_fine.split('x')])+'mm \
+--Restrict-Deformation 1x1x0 \
+--output [tmp.straight2template,tmp.straight2template.nii.gz] \
+--collapse-output-transforms 0 \
+--interpolation BSpline[3] \
+--winsorize-image-intensities [0.005,0.995] \
+--initial-moving-transform tmp.straight2templateCoarse0Warp.nii.gz'
+                if fname_mask != '':
+                    cmd = cmd+' -x '+fname_mask
+                status, output = sct.run(cmd)
+                if verbose:
+                    print output
+                transfo_straight2template = ['tmp.straight2template1Warp.nii.gz']+transfo_straight2template
+                transfo_template2straight = transfo_template2straight+['tmp.straight2template1InverseWarp.nii.gz']
+            else:
+                # warped image on the grid of the template
+                sct.run('WarpImageMultiTransform 3 tmp.straight2templateAffine.nii tmp.straight2template.nii.gz -R '+fname_template+' tmp.straight2templateCoarse0Warp.nii.gz')
+        else:
+            cmd = 'antsRegistration \
 --dimensionality 3 \
 --transform SyN[0.2,3] \
 --metric MI['+fname_template+',tmp.straight2templateAffine.nii,1,32] \
@@ -181,50 +250,48 @@ def main():
 --interpolation BSpline[3] \
 --winsorize-image-intensities [0.005,0.995]'
 
-    if fname_mask != '':
-        # TODO: check if mask exist
-        cmd = cmd+' -x '+fname_mask
-
-    # run command
-    status, output = sct.run(cmd)
-    if verbose:
-        print output
-
-    # Concatenate affine and non-linear transformations...
-    print '\nConcatenate affine and non-linear transformations: straight --> template...'
-    # NB: cannot use sct.run() because output of ComposeMultiTransform is not 0, even if there is no error (bug in ANTS-- already reported on 2013-12-30)
-    cmd = 'ComposeMultiTransform 3 tmp.warp_straight2template.nii.gz -R '+fname_template+' tmp.straight2template0Warp.nii.gz tmp.straight2templateAffine.txt'
-    print('>> '+cmd)
-    commands.getstatusoutput(cmd)
-
-    # Concatenate affine and non-linear transformations...
-    print '\nConcatenate affine and non-linear transformations: template --> straight...'
-    # NB: cannot use sct.run() because output of ComposeMultiTransform is not 0, even if there is no error (bug in ANTS-- already reported on 2013-12-30)
-    cmd = 'ComposeMultiTransform 3 tmp.warp_template2straight.nii.gz -R '+fname_anat+' -i tmp.straight2templateAffine.txt tmp.straight2template0InverseWarp.nii.gz'
-    print('>> '+cmd)
-    commands.getstatusoutput(cmd)
-
-    # Apply transformation: template --> straight
-    print '\nApply transformation: template --> straight...'
-    sct.run('WarpImageMultiTransform 3 '+fname_template+' tmp.template2straight.nii.gz'+' -R '+fname_anat+' tmp.warp_template2straight.nii.gz')
-
-
-
-# THIS CODE USES 2-STEP METHOD WITH SEGMENTATION
-
-#     # Estimate transfo: straight --> template (affine landmark-based)'
-#     print '\nEstimate transfo: straight anat --> template (affine landmark-based)...'
-#     sct.run('ANTSUseLandmarkImagesToGetAffineTransform '+fname_landmark_template+' '+fname_landmark_anat+' affine tmp.straight2templateAffine.txt')
-#
-#     # Apply transformation: straight --> template
-#     print '\nApply transformation straight --> template...'
-#     sct.run('WarpImageMultiTransform 3 '+fname_anat+' tmp.straight2templateAffine.nii tmp.straight2templateAffine.txt -R '+fname_template)
-#     sct.run('WarpImageMultiTransform 3 '+fname_anat_seg+' tmp.straightSeg2templateAffine.nii tmp.straight2templateAffine.txt -R '+fname_template)
-#
-#     # Estimate transformation using ANTS
-#     print('\nStep #1: Estimate transformation using spinal cord segmentations...')
-#
-#     cmd = 'antsRegistration \
+            if fname_mask != '':
+                # TODO: check if mask exist
+                cmd = cmd+' -x '+fname_mask
+
+            # run command
+            status, output = sct.run(cmd)
+            if verbose:
+                print output
+            transfo_straight2template = ['tmp.straight2template0Warp.nii.gz', 'tmp.straight2templateAffine.txt']
+            transfo_template2straight = ['-i', 'tmp.straight2templateAffine.txt', 'tmp.straight2template0InverseWarp.nii.gz']
+
+        sct.step('warp concatenation')
+        # Concatenate affine and non-linear transformations...
+        print '\nConcatenate affine and non-linear transformations: straight --> template...'
+        sct_compose_transfo.compose_transfo('tmp.warp_straight2template.nii.gz', fname_template, transfo_straight2template)
+
+        # Concatenate affine and non-linear transformations...
+        print '\nConcatenate affine and non-linear transformations: template --> straight...'
+        sct_compose_transfo.compose_transfo('tmp.warp_template2straight.nii.gz', fname_anat, transfo_template2straight)
+
+        sct.step('warp application')
+        # Apply transformation: template --> straight
+        print '\nApply transformation: template --> straight...'
+        sct.run('WarpImageMultiTransform 3 '+fname_template+' tmp.template2straight.nii.gz'+' -R '+fname_anat+' tmp.warp_template2straight.nii.gz')
+
+
+
+    # THIS CODE USES 2-STEP METHOD WITH SEGMENTATION
+
+    #     # Estimate transfo: straight --> template (affine landmark-based)'
+    #     print '\nEstimate transfo: straight anat --> template (affine landmark-based)...'
+    #     sct.run('ANTSUseLandmarkImagesToGetAffineTransform '+fname_landmark_template+' '+fname_landmark_anat+' affine tmp.straight2templateAffine.txt')
+    #
+    #     # Apply transformation: straight --> template
+    #     print '\nApply transformation straight --> template...'
+    #     sct.run('WarpImageMultiTransform 3 '+fname_anat+' tmp.straight2templateAffine.nii tmp.straight2templateAffine.txt -R '+fname_template)
+    #     sct.run('WarpImageMultiTransform 3 '+fname_anat_seg+' tmp.straightSeg2templateAffine.nii tmp.straight2templateAffine.txt -R '+fname_template)
+    #
+    #     # Estimate transformation using ANTS
+    #     print('\nStep #1: Estimate transformation using spinal cord segmentations...')
+    #
+    #     cmd = 'antsRegistration \
 # --dimensionality 3 \
 # --transform SyN[0.2,3,0] \
 # --metric MI['+fname_template_seg+',tmp.straightSeg2templateAffine.nii,1,32] \
@@ -233,21 +300,21 @@ def main():
 # --smoothing-sigmas 2x1mm \
 # --Restrict-Deformation 1x1x0 \
 # --output [tmp.regSeg,tmp.straightSeg2template.nii.gz]'
-#
-#     # run command
-#     status, output = sct.run(cmd)
-#     if verbose:
-#         print output
-#
-#     # Apply warping field: seg --> template_seg
-#     print '\nApply transformation anat_seg --> template_seg...'
-#     sct.run('WarpImageMultiTransform 3 '+fname_anat+' tmp.straight2templateStep1.nii tmp.regSeg0Warp.nii.gz -R '+fname_template)
-#
-#     print('\nStep #2: Improve local deformation using images (start from previous transformation)...')
-#
-#     # Estimate transformation: straight --> template (deformation)
-#     print '\nEstimate transformation: straight --> template (diffeomorphic transformation). Takes 10-45 minutes...'
-#     cmd = 'antsRegistration \
+    #
+    #     # run command
+    #     status, output = sct.run(cmd)
+    #     if verbose:
+    #         print output
+    #
+    #     # Apply warping field: seg --> template_seg
+    #     print '\nApply transformation anat_seg --> template_seg...'
+    #     sct.run('WarpImageMultiTransform 3 '+fname_anat+' tmp.straight2templateStep1.nii tmp.regSeg0Warp.nii.gz -R '+fname_template)
+    #
+    #     print('\nStep #2: Improve local deformation using images (start from previous transformation)...')
+    #
+    #     # Estimate transformation: straight --> template (deformation)
+    #     print '\nEstimate transformation: straight --> template (diffeomorphic transformation). Takes 10-45 minutes...'
+    #     cmd = 'antsRegistration \
 # --dimensionality 3 \
 # --transform SyN[0.1,1,0] \
 # --metric CC['+fname_template+',tmp.straight2templateStep1.nii,1,4] \
@@ -257,50 +324,45 @@ def main():
 # --Restrict-Deformation 1x1x0 \
 # --output [tmp.straight2template,tmp.straight2template.nii.gz] \
 # --interpolation BSpline[3]'
-#
-#     # use mask (if provided by user)
-#     if fname_mask != '':
-#         # TODO: check if mask exist
-#         cmd = cmd+' -x '+fname_mask
-#
-#     # run command
-#     status, output = sct.run(cmd)
-#     if verbose:
-#         print output
-#
-#     # Concatenate affine and non-linear transformations...
-#     print '\nConcatenate affine and non-linear transformations: straight --> template...'
-#     # NB: cannot use sct.run() because output of ComposeMultiTransform is not 0, even if there is no error (bug in ANTS-- already reported on 2013-12-30)
-#     cmd = 'ComposeMultiTransform 3 tmp.warp_straight2template.nii.gz -R '+fname_template+' tmp.straight2template0Warp.nii.gz tmp.regSeg0Warp.nii.gz tmp.straight2templateAffine.txt'
-#     print('>> '+cmd)
-#     commands.getstatusoutput(cmd)
-#
-#     # Concatenate affine and non-linear transformations...
-#     print '\nConcatenate affine and non-linear transformations: template --> straight...'
-#     # NB: cannot use sct.run() because output of ComposeMultiTransform is not 0, even if there is no error (bug in ANTS-- already reported on 2013-12-30)
-#     cmd = 'ComposeMultiTransform 3 tmp.warp_template2straight.nii.gz -R '+fname_anat+' -i tmp.straight2templateAffine.txt tmp.straight2template0InverseWarp.nii.gz'
-#     print('>> '+cmd)
-#     commands.getstatusoutput(cmd)
-#
-#     # Apply transformation: template --> straight
-#     print '\nApply transformation: template --> straight...'
-#     sct.run('WarpImageMultiTransform 3 '+fname_template+' tmp.template2straight.nii.gz'+' -R '+fname_anat+' tmp.warp_template2straight.nii.gz')
-#
-
-
-
-
-    # Generate output file (in current folder)
-    print '\nGenerate output file...'
-    sct.generate_output_file('tmp.warp_template2straight.nii.gz','./','warp_template2straight',ext_anat) # warping field template --> straight
-    sct.generate_output_file('tmp.warp_straight2template.nii.gz','./','warp_straight2template',ext_anat) # warping field straight --> template
-    sct.generate_output_file('tmp.straight2template.nii.gz','./',file_anat+'2template',ext_anat) # anat --> template
-    sct.generate_output_file('tmp.template2straight.nii.gz','./',file_template+'2straight',ext_anat) # anat --> template
-
-    # Delete temporary files
-    if remove_temp_files == 1:
-        print '\nDelete temporary files...'
-        sct.run('rm tmp.*')
+    #
+    #     # use mask (if provided by user)
+    #     if fname_mask != '':
+    #         # TODO: check if mask exist
+    #         cmd = cmd+' -x '+fname_mask
+    #
+    #     # run command
+    #     status, output = sct.run(cmd)
+    #     if verbose:
+    #         print output
+    #
+    #     # Concatenate affine and non-linear transformations...
+    #     print '\nConcatenate affine and non-linear transformations: straight --> template...'
+    #     # NB: cannot use sct.run() because output of ComposeMultiTransform is not 0, even if there is no error (bug in ANTS-- already reported on 2013-12-30)
+    #     cmd = 'ComposeMultiTransform 3 tmp.warp_straight2template.nii.gz -R '+fname_template+' tmp.straight2template0Warp.nii.gz tmp.regSeg0Warp.nii.gz tmp.straight2templateAffine.txt'
+    #     print('>> '+cmd)
+    #     commands.getstatusoutput(cmd)
+    #
+    #     # Concatenate affine and non-linear transformations...
+    #     print '\nConcatenate affine and non-linear transformations: template --> straight...'
+    #     # NB: cannot use sct.run() because output of ComposeMultiTransform is not 0, even if there is no error (bug in ANTS-- already reported on 2013-12-30)
+    #     cmd = 'ComposeMultiTransform 3 tmp.warp_template2straight.nii.gz -R '+fname_anat+' -i tmp.straight2templateAffine.txt tmp.straight2template0InverseWarp.nii.gz'
+    #     print('>> '+cmd)
+    #     commands.getstatusoutput(cmd)
+    #
+    #     # Apply transformation: template --> straight
+    #     print '\nApply transformation: template --> straight...'
+    #     sct.run('WarpImageMultiTransform 3 '+fname_template+' tmp.template2straight.nii.gz'+' -R '+fname_anat+' tmp.warp_template2straight.nii.gz')
+    #
+
+
+
+
+        # Generate output file (in current folder)
+        print '\nGenerate output file...'
+        sct.generate_output_file('tmp.warp_template2straight.nii.gz',path_out,'warp_template2straight',ext_anat) # warping field template --> straight
+        sct.generate_output_file('tmp.warp_straight2template.nii.gz',path_out,'warp_straight2template',ext_anat) # warping field straight --> template
+        sct.generate_output_file('tmp.straight2template.nii.gz',path_out,file_anat+'2template',ext_anat) # anat --> template
+        sct.generate_output_file('tmp.template2straight.nii.gz',path_out,file_template+'2straight',ext_anat) # anat --> template
 
     elapsed_time = time.time() - start_time
     print '\nFinished! Elapsed time: '+str(int(round(elapsed_time)))+'s\n'
@@ -335,6 +397,10 @@ def usage():
         '  -m <mask>                   mask on anatomical image.\n' \
         '  -r <0,1>                    remove temporary files. Default='+str(param.remove_temp_files)+'. \n' \
         '  -n <nxm>                    change the iteration number of the registration (antsRegistration).\n' \
+        '  -p <factor>                 run the coarse stage (first number of -n) on the template downsampled by\n' \
+        '                              factor (pyramid level generated once, see sct_template_pyramid.py), then the\n' \
+        '                              other stages at full resolution. With -n 50x0, only the coarse stage is run\n' \
+        '                              (fast low-resolution registration). 0: no pyramid. Default='+str(param.pyramid)+'\n' \
         '  -v <0,1>                    verbose. Default='+str(param.verbose)+'\n'
 
     # exit program
@@ -348,5 +414,5 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
 
@@ -26,16 +26,19 @@ class param:
         self.debug               = 0
         self.remove_temp_files   = 1 # remove temporary files
         self.output_type         = 1
-        self.speed               = 'fast' # speed of registration. slow | normal | fast
+        self.speed               = 'fast' # speed of registration. slow | normal | fast | lowres
+        self.pyramid             = 0 # downsampling factor of the template for the coarse stage of registration (0: no pyramid)
+        self.pyramid_lowres      = 4 # downsampling factor used by the speed preset lowres
         self.verbose             = 0 # verbose
 
 
 import sys
 import getopt
 import os
-import commands
 import time
 import sct_utils as sct
+import sct_compose_transfo
+import sct_cache
 
 # MAIN
 # ==========================================================================================
@@ -48,10 +51,11 @@ def main():
     output_type = param.output_type
     remove_temp_files = param.remove_temp_files
     speed = param.speed
+    pyramid = param.pyramid
     start_time = time.time()
 
     # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    path_sct = os.environ.get('SCT_DIR', '')
 
     # get path of the template
     path_template = path_sct+'/data/template'
@@ -66,7 +70,7 @@ def main():
 
     # Check input parameters
     try:
-        opts, args = getopt.getopt(sys.argv[1:],'hi:l:m:o:r:s:')
+        opts, args = getopt.getopt(sys.argv[1:],'hi:l:m:o:p:r:s:')
     except getopt.GetoptError:
         usage()
     for opt, arg in opts:
@@ -80,6 +84,8 @@ def main():
             fname_seg = arg
         elif opt in ("-o"):
             output_type = int(arg)
+        elif opt in ("-p"):
+            pyramid = int(arg)
         elif opt in ("-r"):
             remove_temp_files = int(arg)
         elif opt in ("-s"):
@@ -104,7 +110,7 @@ def main():
     sct.check_file_exist(fname_landmarks)
     sct.check_file_exist(fname_seg)
 
-    # Check speed parameter and create registration mode: slow 50x30, normal 50x15, fast 10x3 (default)
+    # Check speed parameter and create registration mode: slow 50x30, normal 50x15, fast 10x3 (default), lowres 10x0
     print('\nAssign number of iterations based on speed...')
     if speed == "slow":
         nb_iterations = "50x30"
@@ -114,8 +120,12 @@ def main():
         nb_iterations = "10x3"
     elif speed == "superfast":
         nb_iterations = "3x1" # only for debugging purpose-- do not inform the user about this option
+    elif speed == "lowres":
+        nb_iterations = "10x0" # coarse stage only (on the template pyramid)
+        if not pyramid:
+            pyramid = param.pyramid_lowres
     else:
-        print 'ERROR: Wrong input registration speed {slow, normal, fast}.'
+        print 'ERROR: Wrong input registration speed {slow, normal, fast, lowres}.'
         sys.exit(2)
     print '.. '+nb_iterations
 
@@ -123,11 +133,10 @@ def main():
     fname_data = os.path.abspath(fname_data)
     fname_landmarks = os.path.abspath(fname_landmarks)
     fname_seg = os.path.abspath(fname_seg)
+    path_out = os.getcwd()+'/'
 
-    # create temporary folder
-    print('\nCreate temporary folder...')
-    path_tmp = 'tmp.'+time.strftime("%y%m%d%H%M%S")
-    status, output = sct.run('mkdir '+path_tmp)
+    # create temporary folder (private to this run, see sct.tmp_create). It is kept if the registration fails.
+    path_tmp = sct.tmp_create()
 
     # go to tmp folder
     os.chdir(path_tmp)
@@ -138,77 +147,91 @@ def main():
     status, output = sct.run('c3d '+fname_landmarks+' -o landmarks.nii')
     status, output = sct.run('c3d '+fname_seg+' -o segmentation.nii')
 
-    # Change orientation of input images to RPI
-    print('\nChange orientation of input images to RPI...')
-    status, output = sct.run('sct_orientation -i data.nii -o data_rpi.nii.gz -orientation RPI')
-    status, output = sct.run('sct_orientation -i landmarks.nii.gz -o landmarks_rpi.nii.gz -orientation RPI')
-    status, output = sct.run('sct_orientation -i segmentation.nii.gz -o segmentation_rpi.nii.gz -orientation RPI')
-
-    # Straighten the spinal cord using centerline/segmentation
-    print('\nStraighten the spinal cord using centerline/segmentation...')
-    status, output = sct.run('sct_straighten_spinalcord.py -i data_rpi.nii.gz -c segmentation_rpi.nii.gz -r 1')
-
-    # Label preparation:
-    # --------------------------------------------------------------------------------
-    # Remove unused label on template. Keep only label present in the input label image
-    print('\nRemove unused label on template. Keep only label present in the input label image...')
-    status, output = sct.run('sct_label_utils.py -t remove -i '+path_template+'/landmarks_center.nii.gz -o template_label.nii.gz -r landmarks_rpi.nii.gz')
-
-    # Create a cross for the template labels - 5 mm
-    print('\nCreate a 5 mm cross for the template labels...')
-    status, output = sct.run('sct_label_utils.py -t cross -i template_label.nii.gz -o template_label_cross.nii.gz -c 5')
-
-    # Create a cross for the input labels and dilate for straightening preparation - 5 mm
-    print('\nCreate a 5mm cross for the input labels and dilate for straightening preparation...')
-    status, output = sct.run('sct_label_utils.py -t cross -i landmarks_rpi.nii.gz -o landmarks_rpi_cross3x3.nii.gz -c 5 -d')
-
-    # Push the input labels in the template space
-    print('\nPush the input labels to the straight space...')
-    status, output = sct.run('WarpImageMultiTransform 3 landmarks_rpi_cross3x3.nii.gz landmarks_rpi_cross3x3_straight.nii.gz -R data_rpi_straight.nii.gz warp_curve2straight.nii.gz --use-NN')
-
-    # Convert landmarks from FLOAT32 to INT
-    print '\nConvert landmarks from FLOAT32 to INT...'
-    sct.run('c3d landmarks_rpi_cross3x3_straight.nii.gz -type int -o landmarks_rpi_cross3x3_straight.nii.gz')
-
-    # Registration of the straight spinal cord on the template - ${nb_iteration} slow 50x30, normal 50x15, fast 10x3
-    # straighten the segmentation
-    # TODO: when using the segmentation in the future, de-comment this
-    #cmd="WarpImageMultiTransform
-    #3
-    #$folder_tmp/${file_mask_name}_rpi${file_mask_ext}
-    #$folder_tmp/${file_mask_name}_rpi_straight${file_mask_ext}
-    #-R ${file_in_name}_rpi_straight${file_in_ext}
-    #warp_curve2straight.nii.gz
-    #--use-NN"
-    #echo ==============================================================================================
-    #echo "$cmd"
-    #echo ==============================================================================================
-    #$cmd
-
-    # Registration of straight spinal cord to template
-    print('\nRegistration of straight spinal cord to template...')
-    status, output = sct.run('sct_register_straight_spinalcord_to_template.py -i data_rpi_straight.nii.gz -l landmarks_rpi_cross3x3_straight.nii.gz -t '+path_template+'/MNI-Poly-AMU_T2.nii.gz -f template_label_cross.nii.gz -m '+path_template+'/mask_gaussian_templatespace_sigma20.nii.gz -r 1 -n '+nb_iterations+' -v 1')
-
-    # Concatenate warping fields: template2anat & anat2template
-    print('\nConcatenate warping fields: template2anat & anat2template...')
-    commands.getstatusoutput('ComposeMultiTransform 3 warp_template2anat.nii.gz -R data.nii.gz warp_straight2curve.nii.gz warp_template2straight.nii.gz')
-    commands.getstatusoutput('ComposeMultiTransform 3 warp_anat2template.nii.gz -R '+path_template+'/MNI-Poly-AMU_T2.nii.gz warp_straight2template.nii.gz warp_curve2straight.nii.gz')
-
+    # Look for warping fields already estimated with the same inputs and parameters (see sct_cache.py)
+    file_warp_list = ['warp_template2anat.nii.gz', 'warp_anat2template.nii.gz']
+    cache_key = sct_cache.get_key([fname_data, fname_landmarks, fname_seg, path_template+'/MNI-Poly-AMU_T2.nii.gz', path_template+'/landmarks_center.nii.gz', path_template+'/mask_gaussian_templatespace_sigma20.nii.gz'],
+                                  [os.path.basename(__file__), nb_iterations, pyramid],
+                                  ['antsRegistration', 'ANTSUseLandmarkImagesToGetAffineTransform', 'ANTSUseLandmarkImagesToGetBSplineDisplacementField', 'WarpImageMultiTransform', 'c3d'])
+    cache_hit = sct_cache.get(cache_key, file_warp_list)
+    if cache_hit:
+        print('\nSkip straightening and registration (warping fields found in cache).')
+    else:
+        # Change orientation of input images to RPI
+        print('\nChange orientation of input images to RPI...')
+        sct.set_orientation('data.nii', 'data_rpi.nii.gz', 'RPI')
+        sct.set_orientation('landmarks.nii', 'landmarks_rpi.nii.gz', 'RPI')
+        sct.set_orientation('segmentation.nii', 'segmentation_rpi.nii.gz', 'RPI')
+
+        sct.step('straightening')
+        # Straighten the spinal cord using centerline/segmentation
+        print('\nStraighten the spinal cord using centerline/segmentation...')
+        status, output = sct.run('sct_straighten_spinalcord.py -i data_rpi.nii.gz -c segmentation_rpi.nii.gz -r 1')
+
+        # Label preparation:
+        # --------------------------------------------------------------------------------
+        sct.step('labels')
+        # Remove unused label on template. Keep only label present in the input label image
+        print('\nRemove unused label on template. Keep only label present in the input label image...')
+        # N.B. intermediate labels are stored in sparse label files (.json). Only labels read by ANTs are NIfTI files.
+        status, output = sct.run('sct_label_utils.py -t remove -i '+path_template+'/landmarks_center.nii.gz -o template_label.json -r landmarks_rpi.nii.gz')
+
+        # Create a cross for the template labels - 5 mm
+        print('\nCreate a 5 mm cross for the template labels...')
+        status, output = sct.run('sct_label_utils.py -t cross -i template_label.json -o template_label_cross.nii.gz -c 5')
+
+        # Create a cross for the input labels and dilate for straightening preparation - 5 mm
+        print('\nCreate a 5mm cross for the input labels and dilate for straightening preparation...')
+        status, output = sct.run('sct_label_utils.py -t cross -i landmarks_rpi.nii.gz -o landmarks_rpi_cross3x3.json -c 5 -d')
+
+        # Push the input labels in the template space (labels are moved with the inverse warping field, and written as INT)
+        print('\nPush the input labels to the straight space...')
+        status, output = sct.run('sct_warp_labels.py -i landmarks_rpi_cross3x3.json -d data_rpi_straight.nii.gz -w warp_straight2curve.nii.gz -o landmarks_rpi_cross3x3_straight.nii.gz')
+
+        # Registration of the straight spinal cord on the template - ${nb_iteration} slow 50x30, normal 50x15, fast 10x3
+        # straighten the segmentation
+        # TODO: when using the segmentation in the future, de-comment this
+        #cmd="WarpImageMultiTransform
+        #3
+        #$folder_tmp/${file_mask_name}_rpi${file_mask_ext}
+        #$folder_tmp/${file_mask_name}_rpi_straight${file_mask_ext}
+        #-R ${file_in_name}_rpi_straight${file_in_ext}
+        #warp_curve2straight.nii.gz
+        #--use-NN"
+        #echo ==============================================================================================
+        #echo "$cmd"
+        #echo ==============================================================================================
+        #$cmd
+
+        sct.step('registration')
+        # Registration of straight spinal cord to template
+        print('\nRegistration of straight spinal cord to template...')
+        status, output = sct.run('sct_register_straight_spinalcord_to_template.py -i data_rpi_straight.nii.gz -l landmarks_rpi_cross3x3_straight.nii.gz -t '+path_template+'/MNI-Poly-AMU_T2.nii.gz -f template_label_cross.nii.gz -m '+path_template+'/mask_gaussian_templatespace_sigma20.nii.gz -r 1 -n '+nb_iterations+' -p '+str(pyramid)+' -v 1')
+
+        sct.step('warp concatenation')
+        # Concatenate warping fields: template2anat & anat2template
+        print('\nConcatenate warping fields: template2anat & anat2template...')
+        sct_compose_transfo.compose_transfo('warp_template2anat.nii.gz', 'data.nii', ['warp_straight2curve.nii.gz', 'warp_template2straight.nii.gz'])
+        sct_compose_transfo.compose_transfo('warp_anat2template.nii.gz', path_template+'/MNI-Poly-AMU_T2.nii.gz', ['warp_straight2template.nii.gz', 'warp_curve2straight.nii.gz'])
+
+        # store warping fields in cache
+        sct_cache.put(cache_key, file_warp_list)
+
+    sct.step('warp application')
     # Apply warping fields to anat and template
     if output_type == 1:
-        sct.run('WarpImageMultiTransform 3 '+path_template+'/MNI-Poly-AMU_T2.nii.gz template2anat.nii.gz -R data.nii.gz warp_template2anat.nii.gz')
-        sct.run('WarpImageMultiTransform 3 data.nii.gz anat2template.nii.gz -R '+path_template+'/MNI-Poly-AMU_T2.nii.gz warp_anat2template.nii.gz')
+        sct.run('WarpImageMultiTransform 3 '+path_template+'/MNI-Poly-AMU_T2.nii.gz template2anat.nii.gz -R data.nii warp_template2anat.nii.gz')
+        sct.run('WarpImageMultiTransform 3 data.nii anat2template.nii.gz -R '+path_template+'/MNI-Poly-AMU_T2.nii.gz warp_anat2template.nii.gz')
 
    # Generate output files
     print('\nGenerate output files...')
-    sct.generate_output_file('warp_template2anat.nii.gz','../','warp_template2anat','.nii.gz')
-    sct.generate_output_file('warp_anat2template.nii.gz','../','warp_anat2template','.nii.gz')
+    sct.generate_output_file('warp_template2anat.nii.gz',path_out,'warp_template2anat','.nii.gz')
+    sct.generate_output_file('warp_anat2template.nii.gz',path_out,'warp_anat2template','.nii.gz')
     if output_type == 1:
-        sct.generate_output_file('template2anat.nii.gz','../','template2anat','.nii.gz')
-        sct.generate_output_file('anat2template.nii.gz','../','anat2template','.nii.gz')
+        sct.generate_output_file('template2anat.nii.gz',path_out,'template2anat','.nii.gz')
+        sct.generate_output_file('anat2template.nii.gz',path_out,'anat2template','.nii.gz')
 
     # come back to parent folder
-    os.chdir('..')
+    os.chdir(path_out)
 
     # Delete temporary files
     if remove_temp_files == 1:
@@ -247,8 +270,15 @@ def usage():
         '\n' \
         'OPTIONAL ARGUMENTS\n' \
         '  -o {0, 1}                    output type. 0: warp, 1: warp+images. Default='+str(param.output_type)+'\n' \
-        '  -s {slow, normal, fast}      Speed of registration. Slow gives the best results. Default='+param.speed+'\n' \
-        '  -r {0, 1}                    remove temporary files. Default='+str(param.remove_temp_files)+'\n'
+        '  -s {slow, normal, fast, lowres}  Speed of registration. Slow gives the best results. lowres only registers\n' \
+        '                                at low resolution (on the template downsampled by '+str(param.pyramid_lowres)+'). Default='+param.speed+'\n' \
+        '  -p <factor>                  run the coarse stage of registration on the template downsampled by <factor>\n' \
+        '                                (see sct_template_pyramid.py). 0: no pyramid. Default='+str(param.pyramid)+'\n' \
+        '  -r {0, 1}                    remove temporary files. Default='+str(param.remove_temp_files)+'\n' \
+        '\n' \
+        'CACHE\n' \
+        '  To skip straightening and registration when registering again the same data with the same parameters, define\n' \
+        '  the environment variable SCT_CACHE_DIR (folder where estimated warping fields are kept). See sct_cache.py.\n'
 
 
     # exit program
@@ -262,4 +292,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
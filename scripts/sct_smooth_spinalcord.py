@@ -112,11 +112,11 @@ def main():
     # Change orientation of the input image into RPI
     print '\nOrient input volume to RPI orientation...'
     fname_anat_orient = path_anat+ file_anat+'_rpi'+ ext_anat
-    sct.run('sct_orientation -i ' + fname_anat + ' -o ' + fname_anat_orient + ' -orientation RPI')
+    sct.set_orientation(fname_anat, fname_anat_orient, 'RPI')
     # Change orientation of the input image into RPI
     print '\nOrient centerline to RPI orientation...'
     fname_centerline_orient = path_centerline+file_centerline+'_rpi'+ ext_centerline
-    sct.run('sct_orientation -i ' + fname_centerline + ' -o ' + fname_centerline_orient + ' -orientation RPI')
+    sct.set_orientation(fname_centerline, fname_centerline_orient, 'RPI')
 
 
     # Straighten the spinal cord
@@ -188,4 +188,4 @@ def usage():
 #=======================================================================================================================
 if __name__ == "__main__":
     # call main function
-    main()
\ No newline at end of file
+    sct.profile(main)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Multi-resolution pyramid of template images. Each level is the template downsampled by an integer factor (block
+# average for images and masks, block maximum for labels, so that single-voxel labels do not disappear). Levels are
+# generated once and kept beside the template (in a folder "pyramid"), or in SCT_PYRAMID_DIR if defined or if the
+# template folder is not writable. A level is generated again if the template is more recent.
+#
+# See Usage() below for more information.
+#
+#
+# DEPENDENCIES
+# ---------------------------------------------------------------------------------------
+# EXTERNAL PYTHON PACKAGES
+# - nibabel: <http://nipy.sourceforge.net/nibabel/>
+# - numpy: <http://www.numpy.org>
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+
+# DEFAULT PARAMETERS
+class param:
+    ## The constructor
+    def __init__(self):
+        self.debug              = 0
+        self.factors            = '2,4' # downsampling factors
+        self.verbose            = 1 # verbose
+
+import sys
+import getopt
+import os
+import tempfile
+import sct_utils as sct
+import sct_gzip
+import nibabel
+import numpy
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    fname_list = []
+    fname_label_list = []
+    factors = param.factors
+
+    # Check input parameters
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'hi:l:f:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ("-i"):
+            fname_list = arg.split(',')
+        elif opt in ("-l"):
+            fname_label_list = arg.split(',')
+        elif opt in ("-f"):
+            factors = arg
+
+    # display usage if a mandatory argument is not provided
+    if fname_list == [] and fname_label_list == []:
+        usage()
+
+    # check existence of input files
+    for fname in fname_list+fname_label_list:
+        sct.check_file_exist(fname)
+
+    # generate pyramid levels
+    for factor in [int(f) for f in factors.split(',')]:
+        for fname in fname_list:
+            print '.. '+get_level(fname, factor)
+        for fname in fname_label_list:
+            print '.. '+get_level(fname, factor, label=True)
+
+
+# get_level
+# ==========================================================================================
+def get_level(fname, factor, label=False):
+    """Return the file name of fname downsampled by factor, and generate it if it does not exist or is older than
+    fname. label=True: block maximum instead of block average."""
+    if factor <= 1:
+        return fname
+    path_fname, file_fname, ext_fname = sct.extract_fname(fname)
+    fname_level = os.path.join(get_path_pyramid(fname), file_fname+'_shrink'+str(factor)+'.nii.gz')
+    if not os.path.isfile(fname_level) or os.path.getmtime(fname_level) < os.path.getmtime(fname):
+        print '\nGenerate pyramid level (factor '+str(factor)+') of '+fname+'...'
+        img = nibabel.load(fname)
+        data, affine = downsample(img.get_data(), img.get_affine(), factor, label)
+        hdr = img.get_header().copy()
+        hdr.set_data_dtype(data.dtype)
+        # write in a temporary file first, so that a concurrent script never reads an incomplete level
+        fname_tmp = fname_level+'.'+str(os.getpid())+'.nii.gz'
+        sct_gzip.save(nibabel.Nifti1Image(data, affine, hdr), fname_tmp)
+        os.rename(fname_tmp, fname_level)
+    return fname_level
+
+
+# get_path_pyramid
+# ==========================================================================================
+def get_path_pyramid(fname):
+    """Folder where the pyramid levels of fname are kept."""
+    path_pyramid = os.environ.get('SCT_PYRAMID_DIR', '')
+    if path_pyramid == '':
+        path_pyramid = os.path.join(os.path.dirname(os.path.abspath(fname)), 'pyramid')
+        if not os.access(os.path.dirname(path_pyramid), os.W_OK):
+            path_pyramid = os.path.join(tempfile.gettempdir(), 'sct_pyramid_'+str(os.getuid()))
+    if not os.path.isdir(path_pyramid):
+        os.makedirs(path_pyramid)
+    return path_pyramid
+
+
+# downsample
+# ==========================================================================================
+def downsample(data, affine, factor, label=False):
+    """Downsample a 3D array by an integer factor along each axis (incomplete blocks at the upper edge are averaged over
+    the available voxels). Return the downsampled array and its affine (voxel = center of the block)."""
+    shape = numpy.array(data.shape[0:3])
+    shape_out = (shape + factor - 1) / factor
+    # pad with NaN up to a multiple of factor, then reduce each block ignoring NaN
+    data_pad = numpy.empty(shape_out * factor, dtype=float)
+    data_pad[:] = numpy.nan
+    data_pad[0:shape[0], 0:shape[1], 0:shape[2]] = data[:, :, :]
+    blocks = data_pad.reshape(shape_out[0], factor, shape_out[1], factor, shape_out[2], factor).transpose(0, 2, 4, 1, 3, 5).reshape(tuple(shape_out)+(-1,))
+    if label:
+        data_out = numpy.nanmax(blocks, axis=3).astype(data.dtype)
+    else:
+        data_out = (numpy.nansum(blocks, axis=3) / numpy.sum(~numpy.isnan(blocks), axis=3)).astype(numpy.float32)
+    affine_out = affine.copy()
+    affine_out[0:3, 0:3] = affine[0:3, 0:3] * factor
+    affine_out[0:3, 3] = numpy.dot(affine[0:3, 0:3], [(factor-1)/2.0]*3) + affine[0:3, 3]
+    return data_out, affine_out
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Generate the multi-resolution pyramid of template images (done automatically when a level is needed).\n' \
+        '  Levels are kept in the folder "pyramid" beside the images, or in SCT_PYRAMID_DIR.\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' -i <image1,image2,...> -l <label1,label2,...>\n' \
+        '\n' \
+        'ARGUMENTS\n' \
+        '  -i <image1,image2,...>       images and masks (block average)\n' \
+        '  -l <label1,label2,...>       label images (block maximum)\n' \
+        '  -f <factor1,factor2,...>     downsampling factors. Default='+param.factors+'\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # initialize parameters
+    param = param()
+    # call main function
+    sct.profile(main)
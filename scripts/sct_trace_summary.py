@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Summarize a trace of external commands (written by sct_utils.run when the environment variable SCT_TRACE is defined):
+# number of calls, wall time, CPU time and peak memory, grouped by tool, step and/or script.
+#
+# See Usage() below for more information.
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+
+# DEFAULT PARAMETERS
+class param:
+    ## The constructor
+    def __init__(self):
+        self.debug              = 0
+        self.group              = 'tool' # fields used to group records
+        self.verbose            = 1 # verbose
+
+import sys
+import getopt
+import os
+import json
+import sct_utils as sct
+
+# fields which can be used to group records
+fields_group = ['tool', 'step', 'script']
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    fname_trace = os.environ.get('SCT_TRACE', '')
+    group = param.group
+
+    # Check input parameters
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'hi:g:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ("-i"):
+            fname_trace = arg
+        elif opt in ("-g"):
+            group = arg
+
+    # display usage if a mandatory argument is not provided
+    if fname_trace == '':
+        usage()
+
+    # check parameters
+    sct.check_file_exist(fname_trace)
+    group = group.split(',')
+    for field in group:
+        if field not in fields_group:
+            print '\nERROR: cannot group by '+field+' (choose among '+', '.join(fields_group)+'). Exit program.\n'
+            sys.exit(2)
+
+    # read trace
+    records = []
+    for line in open(fname_trace):
+        if line.strip() != '':
+            records.append(json.loads(line))
+
+    # toolbox scripts run by another script (tool *.py) include the commands they run: they are not counted in the total
+    total = summarize([record for record in records if not record['tool'].endswith('.py')], [])
+    print_summary(summarize(records, group), group, total.get((), [0, 0.0, 0.0, 0.0, 0]))
+
+
+# summarize
+# ==========================================================================================
+def summarize(records, group):
+    """Aggregate records by the fields in group. Return {key: [number of calls, wall, user, sys, max rss]}, key being the
+    tuple of the values of the fields in group."""
+    summary = {}
+    for record in records:
+        key = tuple([record[field] for field in group])
+        if key not in summary:
+            summary[key] = [0, 0.0, 0.0, 0.0, 0]
+        summary[key][0] += 1
+        summary[key][1] += record['wall']
+        summary[key][2] += record['user']
+        summary[key][3] += record['sys']
+        summary[key][4] = max(summary[key][4], record['maxrss'])
+    return summary
+
+
+# print_summary
+# ==========================================================================================
+def print_summary(summary, group, total):
+    """Print the summary, sorted by decreasing wall time, and the total."""
+    width = max([len(' / '.join(group))]+[len(' / '.join([str(k) for k in key])) for key in summary.keys()])
+    print ' / '.join(group).ljust(width)+'    calls    wall (s)    user (s)     sys (s)    max RSS (MB)'
+    for key, value in sorted(summary.items(), key=lambda item: -item[1][1]):
+        print ' / '.join([str(k) for k in key]).ljust(width)+'%9d%12.1f%12.1f%12.1f%16d' % tuple(value)
+    print 'total'.ljust(width)+'%9d%12.1f%12.1f%12.1f%16d' % tuple(total)
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Summarize the trace of external commands run by the toolbox (wall time, CPU time and peak memory).\n' \
+        '  To record a trace, define the environment variable SCT_TRACE before running scripts, e.g.:\n' \
+        '    export SCT_TRACE=~/sct_trace.json\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' -i <trace>\n' \
+        '\n' \
+        'ARGUMENTS\n' \
+        '  -i <trace>                   trace file. Default=$SCT_TRACE\n' \
+        '  -g <field1,field2,...>       group by {'+','.join(fields_group)+'}. Default='+param.group+'\n' \
+        '                               e.g.: -g script,step\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # initialize parameters
+    param = param()
+    # call main function
+    sct.profile(main)
@@ -14,6 +14,12 @@
 import os
 import sys
 import commands
+import time
+import json
+import fcntl
+import tempfile
+import shutil
+import subprocess
 
 # TODO: under run(): add a flag "ignore error" for ComposeMultiTransform
 # TODO: check if user has bash or t-schell for fsloutput definition
@@ -29,7 +35,14 @@ fsloutput = 'export FSLOUTPUTTYPE=NIFTI; ' # for faster processing, all outputs
 def run(cmd, verbose=1):
     if verbose:
         print('>> ' + cmd)
-    status, output = commands.getstatusoutput(cmd)
+    # wait for free cores if concurrent scripts share a CPU budget (see scheduler below), and limit the number of threads
+    nb_cores = scheduler_acquire(cmd)
+    if nb_cores:
+        cmd = 'export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS='+str(nb_cores)+' OMP_NUM_THREADS='+str(nb_cores)+'; '+cmd
+    try:
+        status, output = run_traced(cmd, get_step())
+    finally:
+        scheduler_release(nb_cores)
     if status != 0:
         print('\nERROR!!! \n'+output+'\nExit program.\n')
         sys.exit(2)
@@ -37,6 +50,101 @@ def run(cmd, verbose=1):
         return status, output
 
 
+#=======================================================================================================================
+# run_traced
+#=======================================================================================================================
+# Run a shell command (same as commands.getstatusoutput). If the environment variable SCT_TRACE is defined, its wall
+# time, CPU time and peak memory are measured (see run_measured) and a record is appended to the file SCT_TRACE (one
+# JSON object per line, see sct_trace_summary.py), tagged with the calling script and step (see get_step).
+def run_traced(cmd, step=''):
+    fname_trace = os.environ.get('SCT_TRACE', '')
+    if fname_trace == '':
+        return commands.getstatusoutput(cmd)
+    time_start = time.time()
+    status, output, measures = run_measured(cmd)
+    record = {'time': round(time_start, 3),
+              'script': os.path.basename(sys.argv[0]),
+              'step': step,
+              'tool': get_tool(cmd),
+              'cmd': cmd,
+              'status': status,
+              'pid': os.getpid()}
+    record.update(measures)
+    # a single write per record, so that records of concurrent scripts are not mixed
+    fd = os.open(os.path.expanduser(fname_trace), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    os.write(fd, json.dumps(record)+'\n')
+    os.close(fd)
+    return status, output
+
+
+#=======================================================================================================================
+# run_measured
+#=======================================================================================================================
+# Run a shell command and measure its wall time, CPU time (user, sys) and peak memory (maxrss, in MB), including all its
+# subprocesses. Return status, output (as commands.getstatusoutput) and a dict of measures.
+# The peak memory is that of the largest process (not the sum of processes running at the same time).
+# The command is started by a small launcher process: a forked process inherits the peak memory of its parent, so that
+# the peak memory of a command started from this script would include the memory of the script.
+def run_measured(cmd):
+    time_start = time.time()
+    fd_read, fd_write = os.pipe()
+    process = subprocess.Popen([sys.executable, '-c', launcher, str(fd_write), '{ '+cmd+'; } 2>&1'],
+                               stdout=subprocess.PIPE, close_fds=False)
+    os.close(fd_write)
+    output = process.stdout.read()
+    process.stdout.close()
+    pid, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = status
+    if output[-1:] == '\n':
+        output = output[:-1]
+    f = os.fdopen(fd_read)
+    usage = f.read()
+    f.close()
+    if usage != '':
+        status, wall, user, sys_time, maxrss = json.loads(usage)
+    else:
+        # the launcher failed: measures include the launcher
+        wall, user, sys_time, maxrss = time.time()-time_start, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss
+    return status, output, {'wall': round(wall, 3),
+                            'user': round(user, 3),
+                            'sys': round(sys_time, 3),
+                            'maxrss': maxrss/1024/1024 if sys.platform == 'darwin' else maxrss/1024}  # MB (see get_maxrss)
+
+
+# Launcher of measured commands (argv: file descriptor where measures are written, command)
+launcher = '''
+import os, sys, time, json, subprocess
+time_start = time.time()
+process = subprocess.Popen(sys.argv[2], shell=True, close_fds=True)
+pid, status, rusage = os.wait4(process.pid, 0)
+os.write(int(sys.argv[1]), json.dumps([status, time.time()-time_start, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss]))
+'''
+
+
+#=======================================================================================================================
+# get_step
+#=======================================================================================================================
+# Return the name of the current step of a script (see step), or else the function which called run().
+def get_step():
+    if step_current[0] != '':
+        return step_current[0]
+    return sys._getframe(2).f_code.co_name
+
+
+#=======================================================================================================================
+# get_tool
+#=======================================================================================================================
+# Return the name of the program run by a command (first program which is not a shell utility, e.g. after "export ...;")
+def get_tool(cmd):
+    tools = [os.path.basename(cmd_part.split()[0]) for cmd_part in cmd.replace('&&', ';').replace('|', ';').split(';') if cmd_part.split() != []]
+    for tool in tools:
+        if tool not in tools_light:
+            return tool
+    if tools == []:
+        return ''
+    return tools[0]
+
+
 #=======================================================================================================================
 # extract_fname
 #=======================================================================================================================
@@ -76,22 +184,28 @@ def check_file_exist(fname):
 #=======================================================================================================================
 # get_dimension
 #=======================================================================================================================
-# Get dimensions of a nifti file using FSL
+# Get dimensions of a nifti file (same output as fslsize). Only the header is read, and the result is cached until the
+# file is modified.
+dimension_cache = {}
 def get_dimension(fname):
-    # apply fslsize on data
-    cmd = 'fslsize '+fname
-    status, output = commands.getstatusoutput(cmd)
-    # split output according to \n field
-    output_split = output.split()
-    # extract dimensions as integer
-    nx = int(output_split[1])
-    ny = int(output_split[3])
-    nz = int(output_split[5])
-    nt = int(output_split[7])
-    px = float(output_split[9])
-    py = float(output_split[11])
-    pz = float(output_split[13])
-    pt = float(output_split[15])
+    # like FSL, accept file names without extension
+    for ext in ['', '.nii', '.nii.gz']:
+        if os.path.isfile(fname+ext):
+            fname = fname+ext
+            break
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    if fname in dimension_cache and dimension_cache[fname][0] == (stat.st_mtime, stat.st_size):
+        return dimension_cache[fname][1]
+    # nibabel is imported here so that this module can be imported without it (e.g., by sct_check_dependences)
+    import nibabel
+    hdr = nibabel.load(fname).get_header()
+    dim = hdr['dim']
+    pixdim = hdr['pixdim']
+    # unused dimensions are 1. Voxel sizes are rounded to 6 significant digits, as printed by fslsize.
+    nx, ny, nz, nt = [int(dim[i]) if i <= dim[0] else 1 for i in range(1, 5)]
+    px, py, pz, pt = [float('%g' % pixdim[i]) if i <= dim[0] and pixdim[i] != 0 else 1.0 for i in range(1, 5)]
+    dimension_cache[fname] = ((stat.st_mtime, stat.st_size), (nx, ny, nz, nt, px, py, pz, pt))
     return nx, ny, nz, nt, px, py, pz, pt
 
 
@@ -99,22 +213,445 @@ def get_dimension(fname):
 # generate_output_file
 #=======================================================================================================================
 # Generate output file (put the extension for input file!!!)
+# The file is moved atomically: a concurrent reader sees either the previous output or the complete new one.
 def generate_output_file(fname_in, path_out, file_out, ext_out):
     # extract input file extension
     path_in, file_in, ext_in = extract_fname(fname_in)
-    # if output file already exists in nii or nii.gz format, delete it
-    if os.path.isfile(path_out+file_out+'.nii'):
-        os.system('rm '+path_out+file_out+'.nii')
-    if os.path.isfile(path_out+file_out+'.nii.gz'):
-        os.system('rm '+path_out+file_out+'.nii.gz')
-    # Move file to output folder (keep the same extension as input)
-    os.system('mv '+fname_in+' '+path_out+file_out+ext_in)
-    # convert to nii.gz if necessary
-    if ext_out == '.nii.gz' and ext_in != '.nii.gz':
-        os.system('fslchfiletype NIFTI_GZ '+path_out+file_out)
+    # convert to nii.gz if necessary (before moving the file), compressing in parallel
+    if ext_out == '.nii.gz' and ext_in == '.nii':
+        import sct_gzip
+        sct_gzip.compress(path_in+file_in+ext_in, path_in+file_in+'.nii.gz')
+        os.remove(path_in+file_in+ext_in)
+        ext_in = '.nii.gz'
+    # if output file already exists in the other format (nii or nii.gz), delete it
+    for ext in ['.nii', '.nii.gz']:
+        if ext != ext_in and os.path.isfile(path_out+file_out+ext):
+            os.remove(path_out+file_out+ext)
+    # Move file to output folder (keep the same extension as input). If the output folder is on another file system
+    # (e.g., temporary folder in RAM, see workspace), the file is copied next to the output first.
+    fname_out = path_out+file_out+ext_in
+    try:
+        os.rename(path_in+file_in+ext_in, fname_out)
+    except OSError:
+        fname_tmp = path_out+'.'+file_out+ext_in+'.'+str(os.getpid())
+        shutil.copyfile(path_in+file_in+ext_in, fname_tmp)
+        os.rename(fname_tmp, fname_out)
+        os.remove(path_in+file_in+ext_in)
     # display message
-    print '.. File created: '+path_out+file_out+ext_out
-    return path_out+file_out+ext_out
+    print '.. File created: '+fname_out
+    return fname_out
+
+
+#=======================================================================================================================
+# Orientation
+#=======================================================================================================================
+# Orientation of an image is given by 3 letters, one per voxel axis, as with sct_orientation: each letter is the
+# direction the axis comes from (e.g., RPI: right-to-left, posterior-to-anterior, inferior-to-superior). Nibabel uses
+# the opposite convention (direction the axis goes to): RPI <--> LAS.
+# Reorientation is done in-process: data are transposed/flipped as a view (no copy) and only written on disk when an
+# external tool needs the file (see set_orientation).
+orientation_opposite = {'R': 'L', 'L': 'R', 'A': 'P', 'P': 'A', 'I': 'S', 'S': 'I'}
+
+
+#=======================================================================================================================
+# get_orientation
+#=======================================================================================================================
+# Return the orientation of an image (only the header is read).
+def get_orientation(fname):
+    import nibabel
+    return ''.join([orientation_opposite[axcode] for axcode in nibabel.aff2axcodes(nibabel.load(fname).get_affine())])
+
+
+#=======================================================================================================================
+# reorient
+#=======================================================================================================================
+# Return data in orientation (view on the input array: no copy), and a copy of hdr with the corresponding affine and
+# voxel size. Only the first 3 dimensions are reoriented.
+def reorient(data, hdr, orientation):
+    from nibabel import orientations
+    transfo, hdr_out = reorient_header(hdr, orientation)
+    return orientations.apply_orientation(data, transfo), hdr_out
+
+
+#=======================================================================================================================
+# reorient_header
+#=======================================================================================================================
+# Return the transformation of the voxel axes (see nibabel.orientations) and a copy of hdr in orientation (shape, affine
+# and voxel size), without reading the data.
+def reorient_header(hdr, orientation):
+    import numpy
+    from nibabel import orientations
+    affine = hdr.get_best_affine()
+    ornt_in = orientations.io_orientation(affine)
+    ornt_out = orientations.axcodes2ornt([orientation_opposite[letter] for letter in orientation])
+    transfo = orientations.ornt_transform(ornt_in, ornt_out)
+    hdr_out = hdr.copy()
+    shape = list(hdr.get_data_shape())
+    zooms = list(hdr.get_zooms())
+    for i in range(3):
+        shape[int(transfo[i, 0])] = hdr.get_data_shape()[i]
+        zooms[int(transfo[i, 0])] = hdr.get_zooms()[i]
+    hdr_out.set_data_shape(shape)
+    hdr_out.set_zooms(zooms)
+    affine_out = numpy.dot(affine, orientations.inv_ornt_aff(transfo, hdr.get_data_shape()[0:3]))
+    hdr_out.set_qform(affine_out)
+    hdr_out.set_sform(affine_out)
+    return transfo, hdr_out
+
+
+#=======================================================================================================================
+# load_reoriented
+#=======================================================================================================================
+# Load an image in orientation. Return data (view, see reorient), header and orientation of the file.
+def load_reoriented(fname, orientation):
+    import nibabel
+    img = nibabel.load(fname)
+    data, hdr = reorient(img.get_data(), img.get_header(), orientation)
+    return data, hdr, get_orientation(fname)
+
+
+#=======================================================================================================================
+# set_orientation
+#=======================================================================================================================
+# Write fname_in in orientation as fname_out (which can be fname_in). Return the orientation of fname_in.
+def set_orientation(fname_in, fname_out, orientation):
+    import nibabel
+    import sct_gzip
+    data, hdr, orientation_in = load_reoriented(fname_in, orientation)
+    # write in a temporary file first (fname_in may be read while writing, if fname_out is fname_in)
+    path_out, file_out, ext_out = extract_fname(fname_out)
+    fname_tmp = path_out+file_out+'_'+str(os.getpid())+ext_out
+    sct_gzip.save(nibabel.Nifti1Image(data, None, hdr), fname_tmp)
+    os.rename(fname_tmp, fname_out)
+    return orientation_in
+
+
+#=======================================================================================================================
+# Image
+#=======================================================================================================================
+# NIfTI image with lazy access to the data. Data are read at first access. Uncompressed files (.nii) are memory-mapped:
+# only the slices which are read are loaded. For compressed files (.nii.gz), a slice (3D) or a volume (4D) can be read
+# without decompressing the whole file (see sct_gzip), as long as get_data() was not called.
+# Data are read-only; to modify them, work on a copy (copy()), which is in memory.
+# Properties derived from the data (nonzero voxels, bounding box, centroid of each slice...) are computed once, at
+# first use, in a single pass on the volume.
+# Usage:
+#   im = sct.Image(fname_centerline, 'RPI')
+#   z, x, y = im.get_centroids()
+#   data_t = sct.Image('dmri.nii.gz').get_volume(t)
+#   im_out = im.copy()
+#   im_out.get_data()[:, :, 0] = 0
+#   im_out.save('centerline_out.nii.gz')
+class Image:
+    def __init__(self, fname, orientation=''):
+        import nibabel
+        self.fname = fname
+        self.img = nibabel.load(fname)
+        self.hdr = self.img.get_header().copy()
+        self.orientation_file = get_orientation(fname)
+        self.orientation = self.orientation_file
+        if orientation != '' and orientation != self.orientation:
+            transfo, self.hdr = reorient_header(self.hdr, orientation)
+            self.orientation = orientation
+        self.data = None
+        self.hdr_file = None
+        self.reset()
+
+    # Forget derived properties (to call after data were modified)
+    def reset(self):
+        self.nonzero = None
+        self.centroids = None
+        self.max_per_slice = None
+
+    # Data (read-only, unless the image is a copy). No voxel is read before it is accessed.
+    def get_data(self):
+        if self.data is None:
+            data = self.img.get_data()
+            if self.orientation != self.orientation_file:
+                data, hdr = reorient(data, self.img.get_header(), self.orientation)
+            # read-only view (memory-mapped data must not be modified by mistake)
+            self.data = data.view()
+            self.data.flags.writeable = False
+        return self.data
+
+    def get_slice(self, iz):
+        shape = self.img.get_header().get_data_shape()
+        if self.data is None and self.is_compressed() and len(shape) == 3 and self.orientation == self.orientation_file:
+            return self.read_block(iz*shape[0]*shape[1], shape[0:2])
+        return self.get_data()[:, :, iz]
+
+    def get_volume(self, it):
+        shape = self.img.get_header().get_data_shape()
+        if self.data is None and self.is_compressed() and len(shape) == 4:
+            data = self.read_block(it*shape[0]*shape[1]*shape[2], shape[0:3])
+            if self.orientation != self.orientation_file:
+                data, hdr = reorient(data, self.img.get_header(), self.orientation)
+            return data
+        return self.get_data()[:, :, :, it]
+
+    def get_shape(self):
+        return self.hdr.get_data_shape()
+
+    def get_zooms(self):
+        return self.hdr.get_zooms()
+
+    def is_compressed(self):
+        return extract_fname(self.fname)[2] == '.nii.gz'
+
+    # Read voxels of the file (in the orientation of the file) from voxel index, without reading the whole file
+    def read_block(self, index, shape):
+        import gzip
+        import numpy
+        import nibabel
+        import sct_gzip
+        from nibabel.volumeutils import apply_read_scaling
+        # header as written in the file (nibabel resets the data offset and scaling of loaded images)
+        if self.hdr_file is None:
+            f = gzip.open(self.fname, 'rb')
+            self.hdr_file = nibabel.Nifti1Header.from_fileobj(f)
+            f.close()
+        hdr = self.hdr_file
+        dtype = hdr.get_data_dtype()
+        size = int(numpy.prod(shape))*dtype.itemsize
+        data = numpy.frombuffer(sct_gzip.read(self.fname, hdr.get_data_offset()+index*dtype.itemsize, size), dtype)
+        slope, inter = hdr.get_slope_inter()
+        return apply_read_scaling(data.reshape(shape, order='F'), slope, inter)
+
+    # Copy of the image, with data in memory (writable)
+    def copy(self):
+        import copy
+        im = copy.copy(self)
+        im.hdr = self.hdr.copy()
+        im.data = self.get_data().copy()
+        im.reset()
+        return im
+
+    # Coordinates (X, Y, Z) of voxels > 0 (3D images)
+    def get_nonzero(self):
+        if self.nonzero is None:
+            self.nonzero = (self.get_data() > 0).nonzero()[0:3]
+        return self.nonzero
+
+    # [[xmin, xmax], [ymin, ymax], [zmin, zmax]] of voxels > 0, or None if the image is empty
+    def get_bounding_box(self):
+        X, Y, Z = self.get_nonzero()
+        if len(X) == 0:
+            return None
+        return [[X.min(), X.max()], [Y.min(), Y.max()], [Z.min(), Z.max()]]
+
+    # Slices containing voxels > 0, and mean x and y of these voxels in each slice: z, x, y (arrays)
+    def get_centroids(self):
+        import numpy
+        if self.centroids is None:
+            X, Y, Z = self.get_nonzero()
+            nz = self.get_shape()[2]
+            count = numpy.bincount(Z, minlength=nz)
+            z = count.nonzero()[0]
+            x = numpy.bincount(Z, weights=X, minlength=nz)[z] / count[z]
+            y = numpy.bincount(Z, weights=Y, minlength=nz)[z] / count[z]
+            self.centroids = (z, x, y)
+        return self.centroids
+
+    # Coordinates x, y of the maximum of each slice (arrays of length nz)
+    def get_max_per_slice(self):
+        import numpy
+        if self.max_per_slice is None:
+            nx, ny, nz = self.get_shape()[0:3]
+            index = self.get_data()[:, :, :].reshape(nx*ny, nz, order='F').argmax(axis=0)
+            self.max_per_slice = (index % nx, index / nx)
+        return self.max_per_slice
+
+    # Save the image. The data type of the file is kept, unless dtype is given (e.g., 'uint8').
+    def save(self, fname, dtype=None):
+        import nibabel
+        import sct_gzip
+        hdr = self.hdr.copy()
+        if dtype is not None:
+            hdr.set_data_dtype(dtype)
+        sct_gzip.save(nibabel.Nifti1Image(self.get_data(), None, hdr), fname)
+
+
+#=======================================================================================================================
+# Workspace
+#=======================================================================================================================
+# Temporary files of a script are written in a folder private to the run, so that several scripts (or several runs of
+# the same script) can run concurrently in the same folder. The folder is created in the current folder, or in the
+# folder defined by the environment variable SCT_TMPDIR (e.g., a RAM disk such as /dev/shm).
+# Usage:
+#   fname_anat = os.path.abspath(fname_anat)  # input paths must be absolute, or relative to the workspace
+#   path_out = os.getcwd()+'/'
+#   with sct.workspace(remove_temp_files):
+#       sct.run('... tmp.anat.nii')
+#       sct.generate_output_file('tmp.anat.nii', path_out, file_out, ext_out)
+# On success, the folder is removed (if remove_temp_files=1). On failure, it is kept for inspection.
+
+
+#=======================================================================================================================
+# tmp_create
+#=======================================================================================================================
+# Create a unique temporary folder and return its absolute path.
+def tmp_create():
+    path_parent = os.path.expanduser(os.environ.get('SCT_TMPDIR', ''))
+    if path_parent == '':
+        path_parent = os.getcwd()
+    path_tmp = tempfile.mkdtemp(prefix='tmp.'+time.strftime("%y%m%d%H%M%S")+'_', dir=path_parent)
+    print('\nCreate temporary folder: '+path_tmp)
+    return path_tmp
+
+
+#=======================================================================================================================
+# workspace
+#=======================================================================================================================
+# Context manager: create a temporary folder (see tmp_create) and go into it. When leaving, go back to the previous
+# folder, and delete the temporary folder if everything went well and remove_temp_files=1.
+class workspace:
+    def __init__(self, remove_temp_files=1):
+        self.remove_temp_files = remove_temp_files
+        self.path_tmp = ''
+        self.path_cwd = ''
+
+    def __enter__(self):
+        self.path_cwd = os.getcwd()
+        self.path_tmp = tmp_create()
+        os.chdir(self.path_tmp)
+        return self.path_tmp
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.chdir(self.path_cwd)
+        # run() calls sys.exit(2) when a command fails
+        failed = exc_type is not None and not (exc_type is SystemExit and exc_value.code in [0, None])
+        if failed:
+            print('\nTemporary files are kept in: '+self.path_tmp)
+        elif self.remove_temp_files == 1:
+            print('\nDelete temporary files...')
+            shutil.rmtree(self.path_tmp, ignore_errors=True)
+        # do not catch the exception
+        return False
+
+
+#=======================================================================================================================
+# Profiling
+#=======================================================================================================================
+# Opt-in profiling of the Python code of scripts, enabled with the environment variable SCT_PROFILE:
+# - SCT_PROFILE=cprofile: deterministic profile of all function calls (cProfile). Read it with pstats, or snakeviz.
+# - SCT_PROFILE=sampling: the stack of the main thread is sampled every 10 ms (wall time, including time spent waiting
+#   for external commands), with a low overhead. Stacks are written in the folded format of flame graphs.
+# The profile is written in the folder SCT_PROFILE_DIR (default: folder where the script was started), as
+# <script>_<date>_<pid>.prof (cprofile) or .folded (sampling), with the wall time of each step and the peak memory of
+# the script at the end of the step (in MB: the peak memory of a step is known when it exceeds the previous peak) in
+# .steps.txt.
+# Steps name the major stages of a script: a step lasts until the next one starts (or the script ends). They are also
+# used as step names in the trace of external commands (SCT_TRACE, see run_traced).
+# Usage:
+#   sct.step('warp estimation')  # in scripts, at the start of each stage
+#   sct.profile(main)  # in the __main__ block of scripts, instead of main()
+step_current = ['', 0]  # name, start time
+step_records = []
+sampling_interval = 0.01
+
+
+#=======================================================================================================================
+# step
+#=======================================================================================================================
+# Start a new step (and end the current one). step('') ends the current step.
+def step(name):
+    if step_current[0] != '':
+        step_records.append((step_current[0], time.time()-step_current[1], get_maxrss()))
+    step_current[0] = name
+    step_current[1] = time.time()
+
+
+#=======================================================================================================================
+# profile
+#=======================================================================================================================
+# Call function main, under the profiler selected by SCT_PROFILE (no profiler if SCT_PROFILE is not defined).
+def profile(main):
+    mode = os.environ.get('SCT_PROFILE', '')
+    if mode == '':
+        return main()
+    if mode not in ['cprofile', 'sampling']:
+        print '\nWARNING: unknown profiler SCT_PROFILE='+mode+' (cprofile or sampling). Profiling is disabled.\n'
+        return main()
+    path_profile = os.path.expanduser(os.environ.get('SCT_PROFILE_DIR', os.getcwd()))
+    fname_profile = os.path.join(os.path.abspath(path_profile), os.path.splitext(os.path.basename(sys.argv[0]))[0]+'_'+time.strftime('%y%m%d%H%M%S')+'_'+str(os.getpid()))
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = Sampler()
+        profiler.start()
+    # the profile is written even if the script exits (sys.exit) or fails
+    try:
+        return main()
+    finally:
+        if mode == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(fname_profile+'.prof')
+            print '\nProfile: '+fname_profile+'.prof'
+        else:
+            profiler.stop()
+            profiler.save(fname_profile+'.folded')
+            print '\nProfile: '+fname_profile+'.folded'
+        step('')
+        f = open(fname_profile+'.steps.txt', 'w')
+        for name, duration, maxrss in step_records:
+            f.write('%10.3f %8d  %s\n' % (duration, maxrss, name))
+        f.close()
+
+
+#=======================================================================================================================
+# get_maxrss
+#=======================================================================================================================
+# Peak memory of this process (MB)
+def get_maxrss():
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on Mac OS X, in KB on Linux
+    if sys.platform == 'darwin':
+        return maxrss/1024/1024
+    return maxrss/1024
+
+
+#=======================================================================================================================
+# Sampler
+#=======================================================================================================================
+# Sampling profiler: a thread records the stack of the main thread every sampling_interval seconds.
+class Sampler:
+    def __init__(self):
+        import threading
+        self.thread = threading.Thread(target=self.sample)
+        self.thread.daemon = True
+        self.thread_id = threading.current_thread().ident
+        self.running = False
+        # number of samples per stack (tuple of 'file:function', outermost first)
+        self.stacks = {}
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def sample(self):
+        while self.running:
+            time.sleep(sampling_interval)
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(os.path.basename(frame.f_code.co_filename)+':'+frame.f_code.co_name)
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            self.stacks[stack] = self.stacks.get(stack, 0)+1
+
+    # Write stacks in the folded format (one line per stack: function1;function2;... number of samples)
+    def save(self, fname):
+        f = open(fname, 'w')
+        for stack, count in sorted(self.stacks.items()):
+            f.write(';'.join(stack)+' '+str(count)+'\n')
+        f.close()
 
 
 #=======================================================================================================================
@@ -131,9 +668,188 @@ def sign(x):
 #=======================================================================================================================
 # check_if_installed
 #=======================================================================================================================
-# check if dependant software is installed
+# check if dependant software is installed (cmd succeeds if the software works, e.g. 'flirt -help').
+# Successful checks are kept in a state file (see get_dependences), so that cmd is only run again if PATH changed. The
+# state is refreshed by sct_check_dependences.py.
 def check_if_installed(cmd, name_software):
+    dependences = get_dependences()
+    if dependences.get(cmd) == os.environ.get('PATH', ''):
+        return
     status, output = commands.getstatusoutput(cmd)
     if status != 0:
         print('\nERROR: '+name_software+' is not installed.\nExit program.\n')
         sys.exit(2)
+    dependences[cmd] = os.environ.get('PATH', '')
+    save_dependences(dependences)
+
+
+#=======================================================================================================================
+# Dependences
+#=======================================================================================================================
+# State of the checks of dependant software: {cmd: PATH when cmd succeeded}, in the file SCT_DEPENDENCES_FILE (default:
+# ~/.sct_dependences.json).
+
+# checks run by sct_check_dependences.py (cmd, name of the software)
+dependences_default = [('flirt -help', 'FSL'), ('WarpImageMultiTransform -h', 'ANTS')]
+
+
+def get_fname_dependences():
+    return os.path.expanduser(os.environ.get('SCT_DEPENDENCES_FILE', '~/.sct_dependences.json'))
+
+
+# Return the state of dependences ({} if there is no state file)
+def get_dependences():
+    try:
+        f = open(get_fname_dependences())
+        dependences = json.load(f)
+        f.close()
+    except (IOError, ValueError):
+        return {}
+    return dependences
+
+
+# Save the state of dependences (ignored if the file cannot be written)
+def save_dependences(dependences):
+    fname = get_fname_dependences()
+    try:
+        fname_tmp = fname+'.'+str(os.getpid())
+        f = open(fname_tmp, 'w')
+        json.dump(dependences, f)
+        f.close()
+        os.rename(fname_tmp, fname)
+    except (IOError, OSError):
+        pass
+
+
+# Run again all checks (those in the state and the default ones) and save the state. Return the names of the software
+# which are not working.
+def refresh_dependences():
+    checks = dict([(cmd, cmd.split()[0]) for cmd in get_dependences().keys()]+dependences_default)
+    dependences = {}
+    failed = []
+    for cmd, name_software in sorted(checks.items()):
+        status, output = commands.getstatusoutput(cmd)
+        if status == 0:
+            dependences[cmd] = os.environ.get('PATH', '')
+        elif name_software not in failed:
+            failed.append(name_software)
+    save_dependences(dependences)
+    return failed
+
+
+#=======================================================================================================================
+# Scheduler
+#=======================================================================================================================
+# When several scripts run concurrently on the same machine (e.g., one per subject), external commands launched with
+# run() are admitted against a CPU budget shared by all scripts, so that the machine is neither oversubscribed (ITK tools
+# use all cores by default) nor idle (FSL tools are single-threaded).
+# The scheduler is disabled by default. To enable it, define the environment variable SCT_CPU_BUDGET (number of cores
+# shared by concurrent scripts, e.g. the number of cores of the machine). Optional: SCT_MAX_THREADS (maximum number of
+# cores reserved by one multi-threaded job, default: SCT_CPU_BUDGET; only used by the scheduler).
+# Running commands are listed in a file (default: <tmp>/sct_scheduler_<uid>.json, or SCT_SCHEDULER_FILE) protected by a
+# lock file. Multi-threaded jobs get all free cores (up to SCT_MAX_THREADS) when they are admitted. Jobs are external
+# commands, and thread pools of the toolbox (e.g., compression in sct_gzip).
+
+# external commands using multiple threads (ITK/ANTs based)
+tools_multithread = ['antsRegistration', 'ANTS', 'antsApplyTransforms', 'WarpImageMultiTransform', 'ComposeMultiTransform',
+                     'ANTSUseLandmarkImagesToGetAffineTransform', 'ANTSUseLandmarkImagesToGetBSplineDisplacementField',
+                     'c3d', 'sct_orientation', 'sct_propseg', 'sct_dice_coefficient']
+# commands that do not need a core (shell utilities, and toolbox scripts: only the commands they launch are counted)
+tools_light = ['export', 'cd', 'ls', 'cp', 'mv', 'rm', 'mkdir', 'echo', 'cat', 'which', 'gzip', 'gunzip']
+
+
+#=======================================================================================================================
+# get_nb_threads
+#=======================================================================================================================
+# Return the number of cores needed by a command: 0 (no core), 1 (single-threaded) or -1 (multi-threaded).
+def get_nb_threads(cmd):
+    nb_threads = 0
+    for cmd_part in cmd.replace('&&', ';').replace('|', ';').split(';'):
+        if cmd_part.split() == []:
+            continue
+        tool = os.path.basename(cmd_part.split()[0])
+        if tool in tools_multithread:
+            return -1
+        elif tool not in tools_light and not tool.endswith('.py'):
+            nb_threads = 1
+    return nb_threads
+
+
+#=======================================================================================================================
+# scheduler_acquire
+#=======================================================================================================================
+# Wait until cores are available for cmd, and reserve them. Return the number of reserved cores (0 if the scheduler is
+# disabled or if cmd does not need a core). nb_threads: cores needed (see get_nb_threads), default: guessed from cmd.
+def scheduler_acquire(cmd, nb_threads=None):
+    budget = int(os.environ.get('SCT_CPU_BUDGET', 0))
+    if budget <= 0:
+        return 0
+    if nb_threads is None:
+        nb_threads = get_nb_threads(cmd)
+    if nb_threads == 0:
+        return 0
+    max_threads = min(int(os.environ.get('SCT_MAX_THREADS', budget)), budget)
+    while True:
+        jobs = scheduler_lock()
+        free = budget - sum(jobs.values())
+        if free >= 1:
+            if nb_threads == -1:
+                nb_cores = min(free, max_threads)
+            else:
+                nb_cores = 1
+            jobs[str(os.getpid())] = jobs.get(str(os.getpid()), 0) + nb_cores
+            scheduler_unlock(jobs)
+            return nb_cores
+        scheduler_unlock(jobs)
+        time.sleep(1)
+
+
+#=======================================================================================================================
+# scheduler_release
+#=======================================================================================================================
+# Release cores reserved by scheduler_acquire().
+def scheduler_release(nb_cores):
+    if nb_cores == 0:
+        return
+    jobs = scheduler_lock()
+    jobs[str(os.getpid())] = jobs.get(str(os.getpid()), 0) - nb_cores
+    scheduler_unlock(jobs)
+
+
+#=======================================================================================================================
+# scheduler_lock
+#=======================================================================================================================
+# Lock the scheduler file and return running jobs {pid: number of cores}. Jobs of dead processes are removed.
+scheduler_lock_file = []
+def scheduler_lock():
+    fname = os.environ.get('SCT_SCHEDULER_FILE', os.path.join(tempfile.gettempdir(), 'sct_scheduler_'+str(os.getuid())+'.json'))
+    f = open(fname+'.lock', 'a')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    scheduler_lock_file.append((f, fname))
+    jobs = {}
+    if os.path.isfile(fname):
+        fid = open(fname)
+        try:
+            jobs = json.load(fid)
+        except ValueError:
+            jobs = {}
+        fid.close()
+    for pid in jobs.keys():
+        try:
+            os.kill(int(pid), 0)
+        except OSError:
+            del jobs[pid]
+    return dict([(pid, n) for pid, n in jobs.items() if n > 0])
+
+
+#=======================================================================================================================
+# scheduler_unlock
+#=======================================================================================================================
+# Save running jobs and unlock the scheduler file.
+def scheduler_unlock(jobs):
+    f, fname = scheduler_lock_file.pop()
+    fid = open(fname, 'w')
+    json.dump(dict([(pid, n) for pid, n in jobs.items() if n > 0]), fid)
+    fid.close()
+    fcntl.flock(f, fcntl.LOCK_UN)
+    f.close()
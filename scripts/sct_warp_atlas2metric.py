@@ -9,11 +9,9 @@
 # DEPENDENCIES
 # ---------------------------------------------------------------------------------------
 # EXTERNAL PYTHON PACKAGES
-# none
-#
-# EXTERNAL SOFTWARE
-# - itksnap/c3d <http://www.itksnap.org/pmwiki/pmwiki.php?n=Main.HomePage>
-# - ants <http://stnava.github.io/ANTs/>
+# - nibabel: <http://nipy.sourceforge.net/nibabel/>
+# - numpy: <http://www.numpy.org>
+# - scipy: <http://www.scipy.org>
 #
 #
 # ---------------------------------------------------------------------------------------
@@ -31,14 +29,21 @@ class param:
     def __init__(self):
         self.debug              = 0
         self.verbose            = 0 # verbose
+        self.lazy               = 0 # 1: do not warp tracts now, they are warped when read (see load_tracts)
 
 import re
 import sys
-import commands
 import getopt
 import os
 import time
+import json
+import hashlib
 import sct_utils as sct
+import sct_compose_transfo
+import nibabel
+
+# description of the warped atlas (source tracts, transformation, tracts already warped), saved in the output folder
+file_manifest = 'warp_atlas2metric.json'
 
 # MAIN
 # ==========================================================================================
@@ -48,11 +53,13 @@ def main():
     fname_src = ''
     fname_transfo = ''
     path_out = 'atlas'
+    label_list = []
+    lazy = param.lazy
     verbose = param.verbose
     start_time = time.time()
 
     # get path of the toolbox
-    status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+    path_sct = os.environ.get('SCT_DIR', '')
     print path_sct
 
     # Parameters for debug mode
@@ -63,14 +70,18 @@ def main():
 
     # Check input parameters
     try:
-        opts, args = getopt.getopt(sys.argv[1:],'hd:w:o:v:')
+        opts, args = getopt.getopt(sys.argv[1:],'ha:d:w:l:o:v:')
     except getopt.GetoptError:
         usage()
     for opt, arg in opts:
         if opt == '-h':
             usage()
+        elif opt in ("-a"):
+            lazy = int(arg)
         elif opt in ("-d"):
             fname_src = arg
+        elif opt in ("-l"):
+            label_list = [int(x) for x in arg.split(',')]
         elif opt in ("-o"):
             path_out = arg
         elif opt in ("-w"):
@@ -91,6 +102,9 @@ def main():
     print '.. Metric image:         '+fname_src
     print '.. Transformation:       '+fname_transfo
     print '.. Output folder:        '+path_out
+    if label_list:
+        print '.. Selected tracts:      '+','.join([str(label) for label in label_list])
+    print '.. Lazy mode:            '+str(lazy)
 
     # Extract path, file and extension
     path_src, file_src, ext_src = sct.extract_fname(fname_src)
@@ -103,17 +117,139 @@ def main():
     # get atlas files
     status, output = sct.run('ls '+path_sct+'/data/atlas/vol*.nii.gz')
     file_atlas_list = output.split()
-    # Warp atlas
-    for i in xrange (0,len(file_atlas_list)):
-        path_atlas, file_atlas, ext_atlas = sct.extract_fname(file_atlas_list[i])
-        sct.run('WarpImageMultiTransform 3 '+file_atlas_list[i]+' '+path_out+'/'+file_atlas+ext_atlas+' -R '+fname_src+' '+fname_transfo)
+
+    # check selected tracts
+    for label in label_list:
+        if label not in range(0, len(file_atlas_list)):
+            print '\nERROR: "'+str(label)+'" is not a correct tract label. Exit program.\n'
+            sys.exit(2)
+
+    # Describe the warped atlas. Tracts which are not warped now are warped when they are read (see load_tracts).
+    write_manifest(path_out, {'dest': os.path.abspath(fname_src),
+                              'transfo': [os.path.abspath(fname_transfo)],
+                              'tracts': dict([(os.path.basename(fname), os.path.abspath(fname)) for fname in file_atlas_list]),
+                              'warped': {}})
+
+    # Warp atlas: all tracts by default, selected tracts only, or none in lazy mode
+    if not lazy:
+        if not label_list:
+            label_list = range(0, len(file_atlas_list))
+        warp_tracts([path_out+'/'+os.path.basename(file_atlas_list[label]) for label in label_list], verbose)
+
+    # Warp other template objects
+    fname_in_list = [path_sct+'/data/template/MNI-Poly-AMU_GM.nii.gz', path_sct+'/data/template/MNI-Poly-AMU_WM.nii.gz', path_sct+'/data/template/MNI-Poly-AMU_level.nii.gz', path_sct+'/data/template/MNI-Poly-AMU_CSF.nii.gz']
+    fname_out_list = [path_out+'/../gray_matter.nii.gz', path_out+'/../white_matter.nii.gz', path_out+'/../vertebral_labeling.nii.gz', path_out+'/../csf.nii.gz']
+    warp_volumes(fname_in_list, fname_out_list, [1, 1, 0, 0], fname_src, [fname_transfo], verbose)
+
     # Copy list.txt
     sct.run('cp '+path_sct+'/data/atlas/list.txt '+path_out+'/')
-    # Warp other template objects
-    sct.run('WarpImageMultiTransform 3 '+path_sct+'/data/template/MNI-Poly-AMU_GM.nii.gz '+path_out+'/../gray_matter.nii.gz -R '+fname_src+' '+fname_transfo)
-    sct.run('WarpImageMultiTransform 3 '+path_sct+'/data/template/MNI-Poly-AMU_WM.nii.gz '+path_out+'/../white_matter.nii.gz -R '+fname_src+' '+fname_transfo)
-    sct.run('WarpImageMultiTransform 3 '+path_sct+'/data/template/MNI-Poly-AMU_level.nii.gz '+path_out+'/../vertebral_labeling.nii.gz -R '+fname_src+' --use-NN '+fname_transfo)
-    sct.run('WarpImageMultiTransform 3 '+path_sct+'/data/template/MNI-Poly-AMU_CSF.nii.gz '+path_out+'/../csf.nii.gz -R '+fname_src+' --use-NN '+fname_transfo)
+
+    # display elapsed time
+    elapsed_time = time.time() - start_time
+    print '\nFinished! Elapsed time: '+str(int(round(elapsed_time)))+'s'
+
+
+# warp_volumes
+# ==========================================================================================
+def warp_volumes(fname_in_list, fname_out_list, interp_list, fname_dest, transfo_list, verbose=0):
+    """Warp several volumes onto the grid of fname_dest. The transformations (same syntax as ComposeMultiTransform)
+    are read once, and the sampling coordinates are computed once per source grid (all atlas volumes share the template
+    grid), so each volume only costs one interpolation. interp_list: 1 for linear, 0 for nearest neighbour."""
+    print '\nWarp '+str(len(fname_in_list))+' volumes...'
+    img_dest = nibabel.load(fname_dest)
+    shape_dest = img_dest.get_shape()[0:3]
+    affine_dest = img_dest.get_affine()
+    transfos = sct_compose_transfo.read_transfo_list(transfo_list)
+    coord = {}
+    for fname_in, fname_out, interp in zip(fname_in_list, fname_out_list, interp_list):
+        if verbose:
+            print '.. '+fname_in+' --> '+fname_out
+        img = nibabel.load(fname_in)
+        key = (img.get_shape()[0:3], img.get_affine().tostring())
+        if key not in coord:
+            coord[key] = sct_compose_transfo.sampling_coordinates(transfos, shape_dest, affine_dest, img.get_affine())
+        data = sct_compose_transfo.resample(img.get_data(), coord[key], shape_dest, interp)
+        hdr = img_dest.get_header().copy()
+        hdr.set_data_dtype(data.dtype)
+        nibabel.save(nibabel.Nifti1Image(data, affine_dest, hdr), fname_out)
+
+
+# warp_tracts
+# ==========================================================================================
+def warp_tracts(fname_tract_list, verbose=0):
+    """Warp the tracts of an atlas folder (output of this script) that are not warped yet, or were warped with a
+    transformation that has changed since (memoization per tract and transformation hash). All tracts to warp are
+    warped in one pass. Nothing is done for folders without description (atlas warped by a previous version)."""
+    if not fname_tract_list:
+        return
+    path_atlas = os.path.dirname(fname_tract_list[0])
+    manifest = read_manifest(path_atlas)
+    if manifest is None:
+        return
+    key = transfo_hash(manifest['dest'], manifest['transfo'])
+    fname_todo_list = [fname for fname in fname_tract_list
+                       if manifest['warped'].get(os.path.basename(fname)) != key or not os.path.isfile(fname)]
+    if fname_todo_list:
+        warp_volumes([manifest['tracts'][os.path.basename(fname)] for fname in fname_todo_list], fname_todo_list,
+                     [1 for fname in fname_todo_list], manifest['dest'], manifest['transfo'], verbose)
+        for fname in fname_todo_list:
+            manifest['warped'][os.path.basename(fname)] = key
+        write_manifest(path_atlas, manifest)
+
+
+# load_tracts
+# ==========================================================================================
+def load_tracts(fname_tract_list, verbose=0):
+    """Return the data of tracts of an atlas folder, warping them first if needed (see warp_tracts)."""
+    warp_tracts(fname_tract_list, verbose)
+    return [nibabel.load(fname).get_data() for fname in fname_tract_list]
+
+
+# list_tracts
+# ==========================================================================================
+def list_tracts(path_atlas):
+    """Return the (sorted) file names of all tracts of an atlas folder, warped or not. None if the folder has no
+    description."""
+    manifest = read_manifest(path_atlas)
+    if manifest is None:
+        return None
+    return [os.path.join(path_atlas, file_tract) for file_tract in sorted(manifest['tracts'].keys())]
+
+
+# transfo_hash
+# ==========================================================================================
+def transfo_hash(fname_dest, transfo_list):
+    """Hash of the transformation files and of the header of the destination image (i.e., everything that defines the
+    warped tracts besides the source tracts)."""
+    h = hashlib.sha1()
+    h.update(nibabel.load(fname_dest).get_header().binaryblock)
+    for fname in transfo_list:
+        h.update(fname)
+        f = open(fname, 'rb')
+        for block in iter(lambda: f.read(1 << 20), ''):
+            h.update(block)
+        f.close()
+    return h.hexdigest()
+
+
+# read_manifest
+# ==========================================================================================
+def read_manifest(path_atlas):
+    fname = os.path.join(path_atlas, file_manifest)
+    if not os.path.isfile(fname):
+        return None
+    f = open(fname)
+    manifest = json.load(f)
+    f.close()
+    return manifest
+
+
+# write_manifest
+# ==========================================================================================
+def write_manifest(path_atlas, manifest):
+    f = open(os.path.join(path_atlas, file_manifest), 'w')
+    json.dump(manifest, f, indent=1)
+    f.close()
 
 
 # Print usage
@@ -126,6 +262,8 @@ def usage():
         '\n'\
         'DESCRIPTION\n' \
         '  This script warps all the spinal cord tracts of the atlas according to the warping field given as input.\n' \
+        '  Tracts which are not warped by this script (see -l and -a) are warped when they are first read, e.g. by\n' \
+        '  sct_estimate_MAP_tracts.py, and are warped again if the warping field has changed.\n' \
         '\n' \
         'USAGE\n' \
         '  '+os.path.basename(__file__)+' -d <source> -w <dest>\n' \
@@ -136,7 +274,9 @@ def usage():
         '\n' \
         'OPTIONAL ARGUMENTS\n' \
         '  -o <output_folder>           output folder path (default=./atlas)\n' \
-        '  -v <0,1>                     verbose. Default='+str(param.verbose)+' (not functional yet)\n'
+        '  -l <label1,label2,...>       only warp selected tracts now (see list.txt). Default=all\n' \
+        '  -a <0,1>                     lazy mode: do not warp tracts now. Default='+str(param.lazy)+'\n' \
+        '  -v <0,1>                     verbose. Default='+str(param.verbose)+'\n'
 
 
     # exit program
@@ -149,4 +289,4 @@ if __name__ == "__main__":
     # initialize parameters
     param = param()
     # call main function
-    main()
+    sct.profile(main)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Apply warping fields to labels, by moving the coordinates of the labels instead of resampling the label volume.
+#
+# See Usage() below for more information.
+#
+#
+# DEPENDENCIES
+# ---------------------------------------------------------------------------------------
+# EXTERNAL PYTHON PACKAGES
+# - nibabel: <http://nipy.sourceforge.net/nibabel/>
+# - numpy: <http://www.numpy.org>
+# - scipy: <http://www.scipy.org>
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+# Note on conventions:
+# - Warping fields are ITK displacement fields (as output by ANTs): 5D NIfTI (nx, ny, nz, 1, 3) whose vectors are
+#   expressed in mm in the ITK physical space (LPS), whereas the NIfTI affine maps voxels to the RAS space.
+# - WarpImageMultiTransform resamples an image with a warping field defined on the DESTINATION grid: the intensity at
+#   the destination point p is read at p + u(p) in the source image. Hence, to move points from the source space to the
+#   destination space, the field defined on the SOURCE grid must be used, i.e., the inverse warping field (e.g., to push
+#   labels with warp_curve2straight, give warp_straight2curve). This is the ITK convention for point sets.
+# - The helpers warp_points, sample_warp, vox2phys, phys2vox and rasterize_points can be imported by other scripts
+#   (sampling helpers are defined in sct_compose_transfo).
+
+
+# DEFAULT PARAMETERS
+class param:
+    ## The constructor
+    def __init__(self):
+        self.debug              = 0
+        self.verbose            = 1 # verbose
+
+import sys
+import getopt
+import os
+import time
+import sct_utils as sct
+import sct_labels
+from sct_compose_transfo import read_warp, transform_points, sample_warp, vox2phys, phys2vox
+import nibabel
+import numpy
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    fname_label = ''
+    fname_dest = ''
+    fname_warp_list = []
+    fname_output = ''
+    verbose = param.verbose
+    start_time = time.time()
+
+    # Check input parameters
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'hi:d:w:o:v:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ("-i"):
+            fname_label = arg
+        elif opt in ("-d"):
+            fname_dest = arg
+        elif opt in ("-w"):
+            fname_warp_list = arg.split(',')
+        elif opt in ("-o"):
+            fname_output = arg
+        elif opt in ('-v'):
+            verbose = int(arg)
+
+    # display usage if a mandatory argument is not provided
+    if fname_label == '' or fname_dest == '' or fname_warp_list == []:
+        usage()
+
+    # check existence of input files
+    sct.check_file_exist(fname_label)
+    sct.check_file_exist(fname_dest)
+    for fname_warp in fname_warp_list:
+        sct.check_file_exist(fname_warp)
+
+    # define output file name
+    if fname_output == '':
+        path_label, file_label, ext_label = sct.extract_fname(fname_label)
+        fname_output = file_label+'_reg'+ext_label
+
+    # print arguments
+    if verbose:
+        print '\nCheck parameters:'
+        print '.. Labels:               '+fname_label
+        print '.. Destination:          '+fname_dest
+        print '.. Warping field(s):     '+', '.join(fname_warp_list)
+        print '.. Output:               '+fname_output
+
+    # Warp labels
+    warp_labels(fname_label, fname_dest, fname_warp_list, fname_output, verbose)
+
+    # display elapsed time
+    if verbose:
+        elapsed_time = time.time() - start_time
+        print '\nFinished! Elapsed time: '+str(int(round(elapsed_time)))+'s'
+
+
+# warp_labels
+# ==========================================================================================
+def warp_labels(fname_label, fname_dest, fname_warp_list, fname_output, verbose=1):
+    """Move the non-zero voxels of fname_label through the warping fields and write them on the grid of fname_dest."""
+
+    # read labels (nifti or sparse label file)
+    coord, value, shape, affine = sct_labels.read_labels(fname_label)
+    if verbose:
+        print '\nWarp '+str(len(value))+' labels...'
+
+    # move points
+    points = vox2phys(coord, affine)
+    points = warp_points(points, fname_warp_list)
+
+    # write points on the destination grid (only the header of the destination image is read)
+    img_dest = nibabel.load(fname_dest)
+    shape_dest = img_dest.get_shape()[0:3]
+    if sct_labels.is_sparse(fname_output):
+        coord_dest, inside = phys2grid(points, shape_dest, img_dest.get_affine(), verbose)
+        sct_labels.write_labels(fname_output, coord_dest[inside], value[inside], shape_dest, img_dest.get_affine())
+    else:
+        data_out = rasterize_points(points, value, shape_dest, img_dest.get_affine(), verbose)
+        hdr = img_dest.get_header().copy()
+        hdr.set_data_dtype('int32')
+        nibabel.save(nibabel.Nifti1Image(data_out, img_dest.get_affine(), hdr), fname_output)
+    if verbose:
+        print '.. File created: '+fname_output
+
+    return fname_output
+
+
+# warp_points
+# ==========================================================================================
+def warp_points(points, fname_warp_list):
+    """Move points (n x 3, physical RAS coordinates in mm) through a list of ITK displacement fields, applied in the
+    given order. Each field must be defined on the grid of the space the points are currently in (see note above)."""
+    return transform_points(points, [read_warp(fname_warp) for fname_warp in fname_warp_list])
+
+
+# phys2grid
+# ==========================================================================================
+def phys2grid(points, shape, affine, verbose=1):
+    """Return the voxels (n x 3) closest to points (n x 3, physical RAS coordinates in mm) on a grid of given shape and
+    affine, and a boolean array telling which points fall inside of the grid."""
+    coord = numpy.round(phys2vox(points, affine)).astype(int)
+    inside = numpy.all((coord >= 0) & (coord < numpy.array(shape)), axis=1)
+    if verbose and not numpy.all(inside):
+        print 'WARNING: '+str(numpy.sum(~inside))+' label(s) fall outside of the destination image and were removed.'
+    return coord, inside
+
+
+# rasterize_points
+# ==========================================================================================
+def rasterize_points(points, value, shape, affine, verbose=1):
+    """Write value at the voxels closest to points (n x 3, physical RAS coordinates in mm) on a grid of given shape and
+    affine (int32 array). Points falling outside of the grid are dropped."""
+    coord, inside = phys2grid(points, shape, affine, verbose)
+    return sct_labels.labels2data(coord[inside], value[inside], shape, 'int32')
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Apply warping fields to a label image. Instead of resampling the label volume (which might make labels\n' \
+        '  disappear with nearest-neighbour interpolation), the coordinates of each label are moved by sampling the\n' \
+        '  displacement field at the label position, and the labels are written on the grid of the destination image.\n' \
+        '  N.B. Points are moved with the INVERSE of the transformation used for images. E.g., to bring labels from the\n' \
+        '  curved to the straight space, use warp_straight2curve (not warp_curve2straight).\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' -i <labels> -d <dest> -w <warp>\n' \
+        '\n' \
+        'MANDATORY ARGUMENTS\n' \
+        '  -i <labels>                  label image (labels are non-zero voxels) or sparse label file (.json)\n' \
+        '  -d <dest>                    destination image (defines the output grid)\n' \
+        '  -w <warp1,warp2,...>         warping field(s) (ITK displacement field), applied in the given order\n' \
+        '\n' \
+        'OPTIONAL ARGUMENTS\n' \
+        '  -o <output>                  name of output file (use extension .json for a sparse label file). Default=labels_reg\n' \
+        '  -v <0,1>                     verbose. Default='+str(param.verbose)+'\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # initialize parameters
+    param = param()
+    # call main function
+    sct.profile(main)
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Performance benchmark of the toolbox on synthetic phantoms (see sct_phantom.py), across size tiers (from a cervical
+# segment to the whole spine). Each benchmark is timed on each tier:
+# - scripts are run as external commands (wall time, CPU time and peak memory, see sct_utils.run_measured). Scripts
+#   whose external programs or python modules are not installed are skipped (they are not recorded in the results),
+# - core functions are run in-process (best wall time of several repeats).
+# Results are saved as JSON, with metadata of the machine. They can be compared with a baseline (results of a previous
+# run), to flag regressions of wall time or peak memory. For each benchmark, the scaling exponent with the number of
+# voxels (time ~ voxels^exponent, between the smallest and the largest tier) is displayed.
+#
+# USAGE
+# ---------------------------------------------------------------------------------------
+#   sct_benchmark.py -t small,medium -o results.json
+#   sct_benchmark.py -t small,medium -b baseline.json
+#   sct_benchmark.py -i results.json -b baseline.json  # compare without running
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+
+# DEFAULT PARAMETERS
+class param:
+    ## The constructor
+    def __init__(self):
+        self.tiers              = 'small,medium'  # size tiers
+        self.curvature          = 10  # amplitude of the curvature of the cord (mm)
+        self.nb_repeats         = 3  # repeats of core functions (the best time is kept)
+        self.threshold          = 0.2  # relative increase of wall time or peak memory flagged as a regression
+        self.remove_temp_files  = 1
+
+import sys
+import getopt
+import os
+import time
+import json
+import math
+import platform
+import shutil
+import multiprocessing
+import imp
+from distutils.spawn import find_executable
+import numpy as np
+
+path_sct = os.path.abspath(os.path.dirname(os.path.abspath(__file__))+'/../..')
+sys.path.append(path_sct+'/scripts')
+import sct_utils as sct
+import sct_gzip
+from sct_phantom import generate_phantom
+
+# size tiers: field of view (mm), length of the cord (mm), resolution of the anatomical image (mm), resolution of the
+# diffusion-weighted series (mm) and number of volumes
+tiers = {'small': {'fov': 48, 'length': 60, 'resolution': 1.0, 'resolution_dmri': [2, 2, 5], 'nb_volumes': 16},  # cervical segment
+         'medium': {'fov': 64, 'length': 200, 'resolution': 0.8, 'resolution_dmri': [1, 1, 5], 'nb_volumes': 32},  # cervical cord
+         'large': {'fov': 64, 'length': 600, 'resolution': 0.5, 'resolution_dmri': [1, 1, 5], 'nb_volumes': 64}}  # whole spine
+tiers_order = ['small', 'medium', 'large']
+
+# scripts: name, command (files of the phantom: {t2}, {seg}, {centerline}, {dmri}, {bvecs}), external programs and
+# python modules needed by the script (benchmarks whose requirements are missing are skipped)
+benchmarks_script = [
+    ('sct_process_segmentation -p extract_centerline', 'sct_process_segmentation.py -i {seg} -p extract_centerline', [], []),
+    ('sct_process_segmentation -p compute_CSA', 'sct_process_segmentation.py -i {seg} -p compute_CSA', [], ['matplotlib']),
+    ('sct_dmri_separate_b0_and_dwi', 'sct_dmri_separate_b0_and_dwi.py -i {dmri} -b {bvecs}', [], []),
+    ('sct_straighten_spinalcord', 'sct_straighten_spinalcord.py -i {t2} -c {centerline}', ['flirt', 'WarpImageMultiTransform'], []),
+    ('sct_smooth_spinalcord', 'sct_smooth_spinalcord.py -i {t2} -c {centerline}', ['flirt', 'WarpImageMultiTransform', 'c3d'], []),
+    ('sct_flatten_sagittal', 'sct_flatten_sagittal.py -i {t2} -c {centerline}', ['flirt', 'WarpImageMultiTransform'], []),
+    ('sct_dmri_moco', 'sct_dmri_moco.py -i {dmri} -b {bvecs}', ['fslsplit', 'fslmerge', 'flirt'], [])]
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    tiers_run = param.tiers
+    curvature = param.curvature
+    nb_repeats = param.nb_repeats
+    threshold = param.threshold
+    remove_temp_files = param.remove_temp_files
+    fname_results = ''
+    fname_baseline = ''
+    fname_input = ''
+    selection = ''
+
+    # Check input parameters
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'hb:c:i:n:o:r:s:t:x:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ('-b'):
+            fname_baseline = arg
+        elif opt in ('-c'):
+            curvature = float(arg)
+        elif opt in ('-i'):
+            fname_input = arg
+        elif opt in ('-n'):
+            nb_repeats = int(arg)
+        elif opt in ('-o'):
+            fname_results = arg
+        elif opt in ('-r'):
+            remove_temp_files = int(arg)
+        elif opt in ('-s'):
+            selection = arg
+        elif opt in ('-t'):
+            tiers_run = arg
+        elif opt in ('-x'):
+            threshold = float(arg)
+
+    # check parameters
+    tiers_run = tiers_run.split(',')
+    for tier in tiers_run:
+        if tier not in tiers:
+            print '\nERROR: unknown tier '+tier+' (choose among '+', '.join(tiers_order)+'). Exit program.\n'
+            sys.exit(2)
+    if fname_baseline != '':
+        sct.check_file_exist(fname_baseline)
+
+    if fname_input != '':
+        # results of a previous run
+        sct.check_file_exist(fname_input)
+        results = json.load(open(fname_input))
+    else:
+        if fname_results == '':
+            fname_results = 'benchmark_'+time.strftime('%y%m%d%H%M%S')+'.json'
+        results = run_benchmarks([tier for tier in tiers_order if tier in tiers_run], curvature, nb_repeats,
+                                 selection.split(',') if selection != '' else [], remove_temp_files)
+        f = open(fname_results, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+        print '\nResults saved in '+fname_results
+
+    print_results(results)
+
+    if fname_baseline != '':
+        nb_regressions = compare(results, json.load(open(fname_baseline)), threshold)
+        if nb_regressions:
+            sys.exit(1)
+
+
+#=======================================================================================================================
+# run_benchmarks
+#=======================================================================================================================
+# Generate a phantom for each tier and run the benchmarks on it (all benchmarks, or those whose name starts with one of
+# the names in selection). Return the results, with metadata of the machine.
+def run_benchmarks(tiers_run, curvature, nb_repeats, selection, remove_temp_files):
+    results = {'machine': get_machine(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'version': open(path_sct+'/version.txt').read().strip(),
+               'curvature': curvature,
+               'tiers': dict([(tier, tiers[tier]) for tier in tiers_run]),
+               'results': []}
+    path_tmp = os.path.abspath('tmp.benchmark.'+time.strftime('%y%m%d%H%M%S'))
+    os.makedirs(path_tmp)
+    path_cwd = os.getcwd()
+    try:
+        for tier in tiers_run:
+            print '\nTier: '+tier
+            print '.. generate phantom'
+            t = tiers[tier]
+            fnames = generate_phantom(path_tmp+'/'+tier+'/data', t['fov'], t['length'], t['resolution'],
+                                      t['resolution_dmri'], t['nb_volumes'], curvature)
+            voxels = {'t2': int(np.prod(sct.Image(fnames['t2']).get_shape())),
+                      'dmri': int(np.prod(sct.Image(fnames['dmri']).get_shape()))}
+            # scripts (each one is run in its own folder, as output files are written in the current folder)
+            for i, (name, cmd, programs, modules) in enumerate(benchmarks_script):
+                if not is_selected(name, selection):
+                    continue
+                missing = get_missing(programs, modules)
+                if missing:
+                    print '.. '+name+' [SKIP] (not installed: '+', '.join(missing)+')'
+                    continue
+                key = 'dmri' if '{dmri}' in cmd else 't2'
+                path_run = path_tmp+'/'+tier+'/run_'+str(i)
+                os.makedirs(path_run)
+                os.chdir(path_run)
+                cmd = sys.executable+' '+path_sct+'/scripts/'+cmd.format(**fnames)
+                print '.. '+name,
+                sys.stdout.flush()
+                status, output, measures = sct.run_measured(cmd)
+                os.chdir(path_cwd)
+                if status != 0:
+                    print '[FAIL] (see '+path_run+'/benchmark.log)'
+                else:
+                    print '%.1fs' % measures['wall']
+                # keep the output of the script
+                f = open(path_run+'/benchmark.log', 'w')
+                f.write(cmd+'\n'+output+'\n')
+                f.close()
+                record = {'tier': tier, 'benchmark': name, 'kind': 'script', 'status': status, 'voxels': voxels[key]}
+                record.update(measures)
+                results['results'].append(record)
+            # core functions
+            for name, function, key in get_benchmarks_function(fnames, path_tmp+'/'+tier):
+                if not is_selected(name, selection):
+                    continue
+                print '.. '+name,
+                sys.stdout.flush()
+                walls = []
+                for i in range(nb_repeats):
+                    time_start = time.time()
+                    function()
+                    walls.append(time.time()-time_start)
+                print '%.3fs' % min(walls)
+                results['results'].append({'tier': tier, 'benchmark': name, 'kind': 'function', 'status': 0,
+                                           'voxels': voxels[key], 'wall': round(min(walls), 4)})
+            # remove phantom before next tier, to bound disk usage
+            if remove_temp_files:
+                shutil.rmtree(path_tmp+'/'+tier, ignore_errors=True)
+    finally:
+        os.chdir(path_cwd)
+        if remove_temp_files:
+            shutil.rmtree(path_tmp, ignore_errors=True)
+    return results
+
+
+#=======================================================================================================================
+# get_benchmarks_function
+#=======================================================================================================================
+# Core functions: list of (name, function without arguments, image whose number of voxels is reported)
+def get_benchmarks_function(fnames, path_tmp):
+    fname_t2_nii = path_tmp+'/t2.nii'
+    sct_gzip.save(sct.Image(fnames['t2']).img, fname_t2_nii)
+
+    def centroids():
+        sct.Image(fnames['seg'], 'RPI').get_centroids()
+
+    def bounding_box():
+        sct.Image(fnames['seg'], 'RPI').get_bounding_box()
+
+    def set_orientation():
+        sct.set_orientation(fnames['t2'], path_tmp+'/t2_ail.nii.gz', 'AIL')
+
+    def compress():
+        sct_gzip.compress(fname_t2_nii, path_tmp+'/t2_compressed.nii.gz')
+
+    def read_volume():
+        # last volume, from a new index
+        sct_gzip.index_cache.clear()
+        image = sct.Image(fnames['dmri'])
+        image.get_volume(image.get_shape()[3]-1)
+
+    return [('Image.get_centroids', centroids, 't2'),
+            ('Image.get_bounding_box', bounding_box, 't2'),
+            ('set_orientation', set_orientation, 't2'),
+            ('sct_gzip.compress', compress, 't2'),
+            ('Image.get_volume (last volume, .nii.gz)', read_volume, 'dmri')]
+
+
+#=======================================================================================================================
+# is_selected
+#=======================================================================================================================
+def is_selected(name, selection):
+    return selection == [] or any([name.startswith(s) for s in selection])
+
+
+#=======================================================================================================================
+# get_missing
+#=======================================================================================================================
+# Return the external programs (not found in PATH) and python modules (not importable) which are missing.
+def get_missing(programs, modules):
+    missing = [program for program in programs if find_executable(program) is None]
+    for module in modules:
+        try:
+            imp.find_module(module)
+        except ImportError:
+            missing.append(module)
+    return missing
+
+
+#=======================================================================================================================
+# get_machine
+#=======================================================================================================================
+# Metadata of the machine (results are only comparable on the same machine)
+def get_machine():
+    import numpy
+    import scipy
+    import nibabel
+    machine = {'hostname': platform.node(),
+               'platform': platform.platform(),
+               'processor': platform.processor(),
+               'nb_cores': multiprocessing.cpu_count(),
+               'memory': 0,
+               'python': platform.python_version(),
+               'numpy': numpy.__version__,
+               'scipy': scipy.__version__,
+               'nibabel': nibabel.__version__,
+               'sct_max_threads': os.environ.get('SCT_MAX_THREADS', '')}
+    # model of the processor and total memory (MB), on Linux
+    if os.path.isfile('/proc/cpuinfo'):
+        for line in open('/proc/cpuinfo'):
+            if line.startswith('model name'):
+                machine['processor'] = line.split(':', 1)[1].strip()
+                break
+    if os.path.isfile('/proc/meminfo'):
+        for line in open('/proc/meminfo'):
+            if line.startswith('MemTotal'):
+                machine['memory'] = int(line.split()[1])/1024
+                break
+    return machine
+
+
+#=======================================================================================================================
+# print_results
+#=======================================================================================================================
+# Print wall time (and peak memory of scripts) of each benchmark per tier, and the scaling exponent with the number of
+# voxels.
+def print_results(results):
+    tiers_run = [tier for tier in tiers_order if tier in results['tiers']]
+    records = dict([((r['tier'], r['benchmark']), r) for r in results['results']])
+    names = []
+    for r in results['results']:
+        if r['benchmark'] not in names:
+            names.append(r['benchmark'])
+    width = max([len(name) for name in names]+[9])
+    print '\nMachine: '+results['machine']['hostname']+', '+results['machine']['processor']+', '+\
+          str(results['machine']['nb_cores'])+' cores, '+str(results['machine']['memory'])+' MB'
+    print 'benchmark'.ljust(width)+''.join([(tier+' (s)').rjust(14)+(tier+' (MB)').rjust(14) for tier in tiers_run])+'    scaling'
+    for name in names:
+        line = name.ljust(width)
+        for tier in tiers_run:
+            r = records.get((tier, name))
+            if r is None:
+                line += ''.rjust(28)
+            elif r['status'] != 0:
+                line += 'FAIL'.rjust(14)+''.rjust(14)
+            else:
+                line += ('%.3f' % r['wall']).rjust(14)+(str(r['maxrss']) if 'maxrss' in r else '').rjust(14)
+        line += get_scaling([records[(tier, name)] for tier in tiers_run if (tier, name) in records]).rjust(11)
+        print line
+
+
+#=======================================================================================================================
+# get_scaling
+#=======================================================================================================================
+# Exponent of wall time with the number of voxels, between the smallest and the largest tier (1: linear)
+def get_scaling(records):
+    records = [r for r in records if r['status'] == 0 and r['wall'] > 0]
+    if len(records) < 2 or records[-1]['voxels'] == records[0]['voxels']:
+        return ''
+    return '%.2f' % (math.log(records[-1]['wall']/records[0]['wall'])/math.log(float(records[-1]['voxels'])/records[0]['voxels']))
+
+
+#=======================================================================================================================
+# compare
+#=======================================================================================================================
+# Compare results with a baseline: flag benchmarks whose wall time or peak memory increased by more than threshold
+# (relative), above the measurement noise (0.5 s, 20 MB), and benchmarks which failed. Return the number of regressions.
+def compare(results, baseline, threshold):
+    print '\nComparison with baseline of '+baseline['date']+' (threshold: +'+str(int(threshold*100))+'%)'
+    for key in ['hostname', 'processor', 'nb_cores']:
+        if results['machine'][key] != baseline['machine'][key]:
+            print 'WARNING: different machine ('+key+': '+str(results['machine'][key])+' vs. '+str(baseline['machine'][key])+')'
+    records_baseline = dict([((r['tier'], r['benchmark']), r) for r in baseline['results']])
+    nb_regressions = 0
+    for r in results['results']:
+        b = records_baseline.get((r['tier'], r['benchmark']))
+        if b is None or b['status'] != 0:
+            continue
+        name = r['tier']+' / '+r['benchmark']
+        if r['status'] != 0:
+            print 'REGRESSION: '+name+' failed'
+            nb_regressions += 1
+            continue
+        if r['wall'] > b['wall']*(1+threshold) and r['wall']-b['wall'] > 0.5:
+            print 'REGRESSION: '+name+' wall time: %.3fs -> %.3fs (+%d%%)' % (b['wall'], r['wall'], 100*(r['wall']/b['wall']-1))
+            nb_regressions += 1
+        elif b['wall'] > r['wall']*(1+threshold) and b['wall']-r['wall'] > 0.5:
+            print 'improvement: '+name+' wall time: %.3fs -> %.3fs (-%d%%)' % (b['wall'], r['wall'], 100*(1-r['wall']/b['wall']))
+        if 'maxrss' in r and 'maxrss' in b and r['maxrss'] > b['maxrss']*(1+threshold) and r['maxrss']-b['maxrss'] > 20:
+            print 'REGRESSION: '+name+' peak memory: %dMB -> %dMB' % (b['maxrss'], r['maxrss'])
+            nb_regressions += 1
+    print str(nb_regressions)+' regression(s)'
+    return nb_regressions
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Benchmark scripts and core functions on synthetic phantoms (curved cord), across size tiers:\n' \
+        '    small:  cervical segment (48 mm FOV, 60 mm, 1 mm, 16 diffusion volumes)\n' \
+        '    medium: cervical cord (64 mm FOV, 200 mm, 0.8 mm, 32 diffusion volumes)\n' \
+        '    large:  whole spine (64 mm FOV, 600 mm, 0.5 mm, 64 diffusion volumes)\n' \
+        '  Results are saved as JSON. With -b, they are compared with a baseline (exit status 1 if a regression is\n' \
+        '  found).\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' [-t <tier1,tier2,...>] [-o <results>] [-b <baseline>]\n' \
+        '\n' \
+        'OPTIONAL ARGUMENTS\n' \
+        '  -t <tier1,tier2,...>         size tiers {'+','.join(tiers_order)+'}. Default='+param.tiers+'\n' \
+        '  -c <curvature>               amplitude of the curvature of the cord (mm). Default='+str(param.curvature)+'\n' \
+        '  -s <name1,name2,...>         only run benchmarks whose name starts with one of the names.\n' \
+        '                               e.g.: -s sct_process_segmentation,Image\n' \
+        '  -n <nb_repeats>              repeats of core functions. Default='+str(param.nb_repeats)+'\n' \
+        '  -o <results>                 output file (JSON). Default=benchmark_<date>.json\n' \
+        '  -i <results>                 results of a previous run (no benchmark is run)\n' \
+        '  -b <baseline>                results to compare with\n' \
+        '  -x <threshold>               relative increase flagged as a regression. Default='+str(param.threshold)+'\n' \
+        '  -r {0,1}                     remove temporary files. Default='+str(param.remove_temp_files)+'\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # initialize parameters
+    param = param()
+    # call main function
+    main()
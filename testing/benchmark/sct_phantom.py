@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Generate a synthetic phantom of the spinal cord: a curved tubular cord surrounded by CSF, with its segmentation, its
+# centerline and a diffusion-weighted series (same approach as
+# testing/sct_estimate_MAP_tracts/test_sct_estimate_MAP_tracts__synthetic.py, in 3D).
+# The centerline is curved in the right-left direction (amplitude: curvature, one half period along the cord, as a
+# scoliosis) and in the antero-posterior direction (amplitude: curvature/2, one period, as the cervical lordosis and the
+# thoracic kyphosis). Images are in RPI orientation.
+#
+# Output files (in the output folder):
+#   t2.nii.gz               anatomical image (T2-like: bright CSF, darker cord, noise)
+#   t2_seg.nii.gz           segmentation of the cord
+#   t2_centerline.nii.gz    centerline of the cord (one voxel per slice)
+#   dmri.nii.gz             diffusion-weighted series (b=0 every 8 volumes)
+#   bvecs.txt               diffusion directions (nx3)
+#
+# USAGE
+# ---------------------------------------------------------------------------------------
+#   sct_phantom.py -o <folder> [-f <fov>] [-l <length>] [-r <resolution>] [-d <resolution_dmri>] [-n <nb_volumes>]
+#                  [-c <curvature>]
+#
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2014 Polytechnique Montreal <www.neuro.polymtl.ca>
+# Author: Julien Cohen-Adad
+# Modified: 2014-07-01
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+
+# DEFAULT PARAMETERS
+class param:
+    ## The constructor
+    def __init__(self):
+        self.fov                = 64  # field of view in the axial plane (mm)
+        self.length             = 100  # length of the cord (mm)
+        self.resolution         = 1.0  # resolution of the anatomical image (mm, isotropic)
+        self.resolution_dmri    = '2,2,5'  # resolution of the diffusion-weighted series (mm, x,y,z)
+        self.nb_volumes         = 16  # number of volumes of the diffusion-weighted series
+        self.curvature          = 10  # amplitude of the curvature of the centerline (mm)
+
+import sys
+import getopt
+import os
+import numpy as np
+import nibabel as nib
+
+# radius of the cord (right-left, antero-posterior) and of the CSF (mm)
+radius_cord = (4.5, 3.5)
+radius_csf = 7.0
+# intensities of the anatomical image
+intensity_csf = 100
+intensity_cord = 40
+intensity_background = 10
+sigma_noise = 3
+
+
+# MAIN
+# ==========================================================================================
+def main():
+
+    # Initialization
+    path_out = ''
+    fov = param.fov
+    length = param.length
+    resolution = param.resolution
+    resolution_dmri = param.resolution_dmri
+    nb_volumes = param.nb_volumes
+    curvature = param.curvature
+
+    # Check input parameters
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],'ho:f:l:r:d:n:c:')
+    except getopt.GetoptError:
+        usage()
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+        elif opt in ('-o'):
+            path_out = arg
+        elif opt in ('-f'):
+            fov = float(arg)
+        elif opt in ('-l'):
+            length = float(arg)
+        elif opt in ('-r'):
+            resolution = float(arg)
+        elif opt in ('-d'):
+            resolution_dmri = arg
+        elif opt in ('-n'):
+            nb_volumes = int(arg)
+        elif opt in ('-c'):
+            curvature = float(arg)
+
+    # display usage if a mandatory argument is not provided
+    if path_out == '':
+        usage()
+
+    fnames = generate_phantom(path_out, fov, length, resolution, [float(r) for r in resolution_dmri.split(',')],
+                              nb_volumes, curvature)
+    for fname in sorted(fnames.values()):
+        print '.. '+fname
+
+
+#=======================================================================================================================
+# generate_phantom
+#=======================================================================================================================
+# Generate all the images of a phantom in path_out (see header). Return the file names, as a dict (keys: t2, seg,
+# centerline, dmri, bvecs).
+def generate_phantom(path_out, fov, length, resolution, resolution_dmri, nb_volumes, curvature):
+    if not os.path.exists(path_out):
+        os.makedirs(path_out)
+    fnames = {'t2': path_out+'/t2.nii.gz',
+              'seg': path_out+'/t2_seg.nii.gz',
+              'centerline': path_out+'/t2_centerline.nii.gz',
+              'dmri': path_out+'/dmri.nii.gz',
+              'bvecs': path_out+'/bvecs.txt'}
+
+    # anatomical image, segmentation and centerline
+    shape = (int(round(fov/resolution)), int(round(fov/resolution)), int(round(length/resolution)))
+    affine = get_affine(shape, [resolution]*3)
+    x, y = get_grid(shape, [resolution]*3)
+    data = np.zeros(shape, dtype=np.float32)
+    seg = np.zeros(shape, dtype=np.uint8)
+    centerline = np.zeros(shape, dtype=np.uint8)
+    for iz in range(shape[2]):
+        xc, yc = get_center((iz+0.5)*resolution, length, curvature)
+        cord, csf = get_masks(x-xc, y-yc)
+        data[:, :, iz] = intensity_background+(intensity_csf-intensity_background)*csf+(intensity_cord-intensity_csf)*cord
+        seg[:, :, iz] = cord
+        centerline[int(round(xc/resolution+(shape[0]-1)/2.0)), int(round(yc/resolution+(shape[1]-1)/2.0)), iz] = 1
+    data += np.random.normal(0, sigma_noise, shape).astype(np.float32)
+    nib.save(nib.Nifti1Image(data, affine), fnames['t2'])
+    nib.save(nib.Nifti1Image(seg, affine), fnames['seg'])
+    nib.save(nib.Nifti1Image(centerline, affine), fnames['centerline'])
+    del data, seg, centerline
+
+    # diffusion-weighted series: b=0 every 8 volumes, directions evenly distributed on the sphere (golden spiral).
+    # Signal of the cord is attenuated according to the angle between the diffusion direction and the cord (along z).
+    bvecs = np.zeros((nb_volumes, 3))
+    index_dwi = [it for it in range(nb_volumes) if it % 8 != 0]
+    for i, it in enumerate(index_dwi):
+        z = 1-(2*i+1.0)/len(index_dwi)
+        bvecs[it] = [np.sqrt(1-z**2)*np.cos(np.pi*(3-np.sqrt(5))*i), np.sqrt(1-z**2)*np.sin(np.pi*(3-np.sqrt(5))*i), z]
+    np.savetxt(fnames['bvecs'], bvecs, fmt='%.6f')
+    shape = tuple([int(round(fov/resolution_dmri[0])), int(round(fov/resolution_dmri[1])),
+                   int(round(length/resolution_dmri[2]))])
+    x, y = get_grid(shape, resolution_dmri)
+    data = np.zeros(shape+(nb_volumes,), dtype=np.int16)
+    for iz in range(shape[2]):
+        xc, yc = get_center((iz+0.5)*resolution_dmri[2], length, curvature)
+        cord, csf = get_masks(x-xc, y-yc)
+        for it in range(nb_volumes):
+            # apparent diffusion coefficients (b=1000 s/mm2): CSF 3e-3 mm2/s, cord 0.5e-3 (across) to 1.7e-3 (along)
+            b = float(np.any(bvecs[it]))
+            attenuation_csf = np.exp(-3.0*b)
+            attenuation_cord = np.exp(-b*(0.5+1.2*bvecs[it][2]**2))
+            signal = intensity_background+(intensity_csf*attenuation_csf-intensity_background)*csf \
+                     +(intensity_csf*attenuation_cord-intensity_csf*attenuation_csf)*cord
+            data[:, :, iz, it] = np.round(10*(signal+np.random.normal(0, sigma_noise, signal.shape)))
+    nib.save(nib.Nifti1Image(data, get_affine(shape, resolution_dmri)), fnames['dmri'])
+
+    return fnames
+
+
+#=======================================================================================================================
+# get_center
+#=======================================================================================================================
+# Position (mm) of the centerline at z (mm, from the bottom of the cord), relative to the center of the field of view.
+def get_center(z, length, curvature):
+    return curvature*np.sin(np.pi*z/length), curvature/2.0*np.sin(2*np.pi*z/length)
+
+
+#=======================================================================================================================
+# get_masks
+#=======================================================================================================================
+# Masks of the cord and of the CSF (including the cord) in an axial slice, x and y being the coordinates (mm) relative to
+# the centerline.
+def get_masks(x, y):
+    cord = (x/radius_cord[0])**2+(y/radius_cord[1])**2 <= 1
+    csf = x**2+y**2 <= radius_csf**2
+    return cord, csf
+
+
+#=======================================================================================================================
+# get_grid
+#=======================================================================================================================
+# Coordinates (mm) of the voxels of an axial slice, relative to the center of the field of view.
+def get_grid(shape, resolution):
+    x = (np.arange(shape[0])-(shape[0]-1)/2.0)*resolution[0]
+    y = (np.arange(shape[1])-(shape[1]-1)/2.0)*resolution[1]
+    return np.meshgrid(x, y, indexing='ij')
+
+
+#=======================================================================================================================
+# get_affine
+#=======================================================================================================================
+# Affine of an image in RPI orientation (LAS for nibabel, see sct_utils), centered on the field of view.
+def get_affine(shape, resolution):
+    affine = np.diag([-resolution[0], resolution[1], resolution[2], 1.0])
+    affine[0:3, 3] = [(shape[0]-1)/2.0*resolution[0], -(shape[1]-1)/2.0*resolution[1], -(shape[2]-1)/2.0*resolution[2]]
+    return affine
+
+
+# Print usage
+# ==========================================================================================
+def usage():
+    print '\n' \
+        ''+os.path.basename(__file__)+'\n' \
+        '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n' \
+        'Part of the Spinal Cord Toolbox <https://sourceforge.net/projects/spinalcordtoolbox>\n' \
+        '\n'\
+        'DESCRIPTION\n' \
+        '  Generate a synthetic phantom of the spinal cord (curved cord in CSF): anatomical image, segmentation,\n' \
+        '  centerline and diffusion-weighted series.\n' \
+        '\n' \
+        'USAGE\n' \
+        '  '+os.path.basename(__file__)+' -o <folder>\n' \
+        '\n' \
+        'MANDATORY ARGUMENTS\n' \
+        '  -o <folder>                  output folder\n' \
+        '\n' \
+        'OPTIONAL ARGUMENTS\n' \
+        '  -f <fov>                     field of view in the axial plane (mm). Default='+str(param.fov)+'\n' \
+        '  -l <length>                  length of the cord (mm). Default='+str(param.length)+'\n' \
+        '  -r <resolution>              resolution of the anatomical image (mm). Default='+str(param.resolution)+'\n' \
+        '  -d <rx,ry,rz>                resolution of the diffusion-weighted series (mm). Default='+param.resolution_dmri+'\n' \
+        '  -n <nb_volumes>              number of diffusion-weighted volumes. Default='+str(param.nb_volumes)+'\n' \
+        '  -c <curvature>               amplitude of the curvature of the cord (mm). Default='+str(param.curvature)+'\n'
+
+    # exit program
+    sys.exit(2)
+
+
+# START PROGRAM
+# ==========================================================================================
+if __name__ == "__main__":
+    # initialize parameters
+    param = param()
+    # call main function
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+## @package test_sct_compose_transfo
+#
+# - generate a known translation field and a known ITK affine transformation (text file)
+# - compose them with sct_compose_transfo (as ComposeMultiTransform would), and compare the output warping field with
+#   the analytic displacement. Exit status is 1 if they differ.
+
+#Import library
+import nibabel as nib
+import numpy as np
+import sys
+import os
+
+# path of the toolbox scripts
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../../scripts')
+import sct_compose_transfo
+
+# translation of the warping field (mm, ITK physical space: LPS)
+translation_lps = np.array([2.0, -3.0, 1.5])
+# ITK affine transformation: y = M.(x-c) + t + c (LPS)
+angle = np.pi/12
+matrix_lps = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1.1]])
+offset_lps = np.array([-1.0, 4.0, 2.5])
+center_lps = np.array([3.0, -2.0, 10.0])
+# maximum error (mm)
+tolerance = 1e-3
+
+
+def main():
+
+    print '\nGeneration of files test ...'
+
+    # Extract path of script
+    path_script = os.path.dirname(os.path.abspath(__file__)) + '/'
+    path_tmp = path_script + 'results/'
+    if not os.path.exists(path_tmp):
+        os.makedirs(path_tmp)
+
+    # Grid of the reference and of the warping field: anisotropic voxels, oblique, not centered
+    shape = (12, 10, 8)
+    affine = np.array([[-0.8, 0.1, 0, 20], [0.05, 1.2, 0, -15], [0, 0, 2.0, 5], [0, 0, 0, 1]])
+    nib.save(nib.Nifti1Image(np.zeros(shape, dtype=np.float32), affine), path_tmp + 'reference.nii.gz')
+
+    # Translation field, written as ANTs does (5D, vectors in LPS)
+    data = np.tile(translation_lps.astype(np.float32), shape + (1, 1))
+    nib.save(nib.Nifti1Image(data, affine), path_tmp + 'warp_translation.nii.gz')
+
+    # Affine text file, written as ANTs does
+    f = open(path_tmp + 'affine.txt', 'w')
+    f.write('#Insight Transform File V1.0\n')
+    f.write('#Transform 0\n')
+    f.write('Transform: MatrixOffsetTransformBase_double_3_3\n')
+    f.write('Parameters: ' + ' '.join([repr(x) for x in list(matrix_lps.flatten()) + list(offset_lps)]) + '\n')
+    f.write('FixedParameters: ' + ' '.join([repr(x) for x in center_lps]) + '\n')
+    f.close()
+
+    # Physical coordinates (LPS) of the voxels of the reference
+    coord = np.indices(shape).reshape(3, -1).transpose()
+    points_lps = (np.dot(coord, affine[0:3, 0:3].transpose()) + affine[0:3, 3]) * np.array([-1, -1, 1])
+
+    status = 0
+
+    # [warp, affine]: p -> affine(p + warp(p))
+    print '\nTest: warping field followed by affine transformation'
+    expected = apply_affine(points_lps + translation_lps) - points_lps
+    status += check(path_tmp, ['warp_translation.nii.gz', 'affine.txt'], expected)
+
+    # [-i affine, warp]: p -> affine^-1(p) + warp (constant field, null outside of its grid)
+    print '\nTest: inverse affine transformation followed by warping field'
+    points_inv = np.dot(points_lps - offset_lps - center_lps, np.linalg.inv(matrix_lps).transpose()) + center_lps
+    coord_inv = np.dot(points_inv * np.array([-1, -1, 1]) - affine[0:3, 3], np.linalg.inv(affine[0:3, 0:3]).transpose())
+    inside = np.all((coord_inv >= 0) & (coord_inv <= np.array(shape) - 1), axis=1)
+    expected = points_inv + translation_lps * inside[:, np.newaxis] - points_lps
+    # the field is interpolated between its voxels: skip points close to its border
+    near_border = np.any((coord_inv > -1) & (coord_inv < 0) | (coord_inv > np.array(shape) - 1) & (coord_inv < np.array(shape)), axis=1)
+    status += check(path_tmp, ['-i', 'affine.txt', 'warp_translation.nii.gz'], expected, ~near_border)
+
+    if status:
+        print '\nFAILED'
+    else:
+        print '\nOK'
+    sys.exit(int(status > 0))
+
+
+# Apply the affine transformation to points (n x 3, LPS)
+def apply_affine(points):
+    return np.dot(points - center_lps, matrix_lps.transpose()) + offset_lps + center_lps
+
+
+# Compose transformations (in the folder path_tmp) on the grid of the reference and compare the output field (LPS) with
+# the expected displacement (n x 3, LPS) at voxels where mask is True. Return 0 if they match, 1 otherwise.
+def check(path_tmp, transfo_list, expected, mask=None):
+    os.chdir(path_tmp)
+    sct_compose_transfo.compose_transfo('warp_composed.nii.gz', 'reference.nii.gz', transfo_list, verbose=0)
+    field = nib.load('warp_composed.nii.gz').get_data()
+    field = field.reshape(-1, 3)
+    if mask is None:
+        mask = np.ones(field.shape[0], dtype=bool)
+    error = np.abs(field - expected)[mask].max()
+    print '\t  Maximum error: ' + str(error) + ' mm (' + str(mask.sum()) + ' voxels)'
+    return int(error > tolerance)
+
+#=======================================================================================================================
+# Start program
+#=======================================================================================================================
+if __name__ == "__main__":
+    # call main function
+    main()
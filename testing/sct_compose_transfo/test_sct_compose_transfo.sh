@@ -0,0 +1,9 @@
+#!/bin/bash
+#
+# This script tests sct_compose_transfo: composition of a known translation field and a known affine transformation,
+# checked against the analytic displacement.
+#
+# To run it, type:
+#   ./test_sct_compose_transfo.sh
+
+python test_sct_compose_transfo.py
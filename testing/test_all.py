@@ -2,6 +2,17 @@
 #
 # Launch all testing scripts.
 #
+# The peak memory of each test (largest process, including the processes launched by the scripts) is measured. A test
+# fails if it exceeds its memory budget, in MB, stored in the test folder (memory_budget.txt). Tests without a budget
+# are not checked: budgets are created with -u, from measured runs.
+# With -p, scripts are profiled (SCT_PROFILE, SCT_TRACE): the peak memory of each step of each script, and of the
+# external commands of each step, is written in <test>.memory.log.
+#
+# Usage:
+#   test_all.py [-p] [-u]
+#   -p: report of memory per step
+#   -u: update memory budgets (peak memory of passing tests + 25%)
+#
 # Author: Julien Cohen-Adad, Benjamin De Leener
 # Last Modif: 2014-06-11
 
@@ -9,14 +20,19 @@
 import os
 import getopt
 import sys
+import json
+import glob
+import shutil
 from numpy import loadtxt
-import commands
 # get path of the toolbox
-status, path_sct = commands.getstatusoutput('echo $SCT_DIR')
+path_sct = os.environ.get('SCT_DIR', '')
 # append path that contains scripts, to be able to load modules
 sys.path.append(path_sct + '/scripts')
 import sct_utils as sct
 
+# margin of memory budgets updated with -u
+budget_margin = 1.25
+
 
 # define nice colors
 class bcolors:
@@ -37,15 +53,15 @@ def print_line(string):
 
 
 def print_ok():
-    print "[" + bcolors.OKGREEN + "OK" + bcolors.ENDC + "]"
+    print "[" + bcolors.OKGREEN + "OK" + bcolors.ENDC + "]",
 
 
 def print_warning():
-    print "[" + bcolors.WARNING + "WARNING" + bcolors.ENDC + "]"
+    print "[" + bcolors.WARNING + "WARNING" + bcolors.ENDC + "]",
 
 
 def print_fail():
-    print "[" + bcolors.FAIL + "FAIL" + bcolors.ENDC + "]"
+    print "[" + bcolors.FAIL + "FAIL" + bcolors.ENDC + "]",
 
 def write_to_log_file(fname_log,string):
     f = open(fname_log, 'w')
@@ -53,22 +69,97 @@ def write_to_log_file(fname_log,string):
     f.close()
 
 def test_function(folder_test,dot_lines):
-    fname_log = folder_test + ".log" 
+    fname_log = folder_test + ".log"
     print_line('Checking '+folder_test+dot_lines)
     os.chdir(folder_test)
-    status, output = commands.getstatusoutput('./test_'+folder_test+'.sh')
+    if profiling:
+        path_profile = start_profiling()
+    status, output, measures = sct.run_measured('./test_'+folder_test+'.sh')
+    if update_budgets and status == 0:
+        write_to_log_file('memory_budget.txt', str(int(measures['maxrss']*budget_margin)))
+    budget = get_budget()
+    if status == 0 and budget and measures['maxrss'] > budget:
+        # memory regression
+        status = 1
+        output += '\n\nERROR: peak memory ('+str(measures['maxrss'])+' MB) exceeds the memory budget ('+str(budget)+' MB)'
     if status == 0:
         print_ok()
     else:
         print_fail()
+    print str(measures['maxrss'])+' MB'+(' / '+str(budget)+' MB' if budget else '')
+    if profiling:
+        report = stop_profiling(path_profile)
     os.chdir('../')
     write_to_log_file(fname_log,output)
+    if profiling:
+        write_to_log_file(folder_test + ".memory.log", report)
     return status
 
-    
+
+# Memory budget of the test in the current folder (MB, 0 if none)
+def get_budget():
+    if not os.path.isfile('memory_budget.txt'):
+        return 0
+    f = open('memory_budget.txt')
+    budget = int(f.read().split()[0])
+    f.close()
+    return budget
+
+
+# Profile the scripts run by the test (steps and external commands are recorded in the folder profile)
+def start_profiling():
+    path_profile = os.path.abspath('profile')
+    if os.path.exists(path_profile):
+        shutil.rmtree(path_profile)
+    os.makedirs(path_profile)
+    os.environ['SCT_PROFILE'] = 'sampling'
+    os.environ['SCT_PROFILE_DIR'] = path_profile
+    os.environ['SCT_TRACE'] = path_profile + '/trace.json'
+    return path_profile
+
+
+# Stop profiling and return the report of memory per step: for each script and step, peak memory of the script (at the
+# end of the step) and of the external commands run during the step
+def stop_profiling(path_profile):
+    for name in ['SCT_PROFILE', 'SCT_PROFILE_DIR', 'SCT_TRACE']:
+        del os.environ[name]
+    # peak memory of external commands per (script, step)
+    commands_maxrss = {}
+    if os.path.isfile(path_profile + '/trace.json'):
+        for line in open(path_profile + '/trace.json'):
+            record = json.loads(line)
+            key = (os.path.splitext(record['script'])[0], record['step'])
+            commands_maxrss[key] = max(commands_maxrss.get(key, 0), record['maxrss'])
+    report = 'script'.ljust(45) + 'step'.ljust(35) + '  wall (s)   script (MB)   commands (MB)\n'
+    for fname_steps in sorted(glob.glob(path_profile + '/*.steps.txt')):
+        script = os.path.basename(fname_steps).rsplit('_', 2)[0]
+        for line in open(fname_steps):
+            wall, maxrss, step = line.split(None, 2)
+            step = step.strip()
+            report += script.ljust(45) + step.ljust(35) + wall.rjust(10) + maxrss.rjust(14) + \
+                      str(commands_maxrss.pop((script, step), '')).rjust(16) + '\n'
+    # commands run outside of steps (or by scripts without steps)
+    for (script, step), maxrss in sorted(commands_maxrss.items()):
+        report += script.ljust(45) + step.ljust(35) + ''.rjust(10) + ''.rjust(14) + str(maxrss).rjust(16) + '\n'
+    return report
+
+
 # START MAIN
 # ==========================================================================================
 
+profiling = 0
+update_budgets = 0
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'pu')
+except getopt.GetoptError:
+    print 'Usage: test_all.py [-p] [-u]'
+    sys.exit(2)
+for opt, arg in opts:
+    if opt == '-p':
+        profiling = 1
+    elif opt == '-u':
+        update_budgets = 1
+
 status = []
 status.append( test_function('sct_segmentation_propagation',' .............. ') )
 status.append( test_function('sct_register_to_template',' .................. ') )
@@ -76,6 +167,7 @@ status.append( test_function('sct_register_multimodal',' ................... ')
 status.append( test_function('sct_warp_atlas2metric',' ..................... ') )
 status.append( test_function('sct_estimate_MAP_tracts',' ................... ') )
 status.append( test_function('sct_dmri_moco',' ............................. ') )
+status.append( test_function('sct_compose_transfo',' ....................... ') )
 
 print str(status)
 